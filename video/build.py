@@ -13,29 +13,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Top level module that ties together the components to generate and output video"""
+"""Top level module that ties together the components to generate and output video
 
-from double_buffer import DoubleBuffer
+Modules used by only one demo are imported when that demo is constructed, and
+the platform is imported only when building, so that importing this module
+stays cheap.
+"""
+
+from double_buffer import DoubleBuffer, WriteMux
 from hfosc import HfOscillator
-from life_buffer_filler import LifeBufferFiller
-from life_buffer_reader import LifeBufferReader
-from life_data_buffer import LifeDataBuffer, build_memories
-from life_writer import LifeWriter
-from oned_rules import Rules1DConfig, InitStyle
-from oned_writer import OneDWriter
 from output import add_gpdi_resources, GPDIOutput
 from pll import PLL
-from rgb_fifo import MonoFifoRGB
 from rgb import RGBElaboratable
 from rgb_reader import DoubleBufferReaderRGB
-from rng import RandomWordGenerator
-from rng_writer import RandomWriter
-from square_writer import SquareWriter
 from timing import VideoTimer
 from video_config import RESOLUTIONS
 
 from nmigen import *
-from nmigen.lib.fifo import AsyncFIFO
 from nmigen.utils import bits_for
 
 import argparse
@@ -56,10 +50,40 @@ class PlaidRGB(RGBElaboratable):
         return m
 
 
+# App clock name -> (HF oscillator MHz, or None) and (pixel clock divider, or None)
+APP_CLOCKS = {
+    'hf48': (48, None),
+    'hf24': (24, None),
+    'hf12': (12, None),
+    'hf6': (6, None),
+    'pixel': (None, 1),
+    'pixel_half': (None, 2),
+}
+
+
 class DemoBase(Elaboratable, ABC):
-    """A base for video demos"""
-    def __init__(self, resolution):
+    """A base for video demos
+
+    Demos that calculate in the 'app' clock domain set uses_app_clock, and
+    call add_app_clock() while constructing. The app clock comes from the HF
+    oscillator, or from the PLL's second output as a fraction of the pixel
+    clock. With hfosc_margin, timing of an HF oscillator app clock is checked
+    allowing for its frequency tolerance.
+    """
+    uses_app_clock = False
+
+    def __init__(self, resolution, app_clock='hf24', cell_size=1, hfosc_margin=False):
         self.resolution = resolution
+        self.app_clock = app_clock
+        self.cell_size = cell_size
+        self.hfosc_margin = hfosc_margin
+
+    def add_app_clock(self, m):
+        """Adds an HF oscillator for the app domain, if it is needed."""
+        mhz, _ = APP_CLOCKS[self.app_clock]
+        if mhz is not None:
+            m.submodules.hfosc = hfosc = HfOscillator('app', mhz, self.hfosc_margin)
+            m.domains += hfosc.domain
 
     def construct_rgb(self, m, vt):
         """
@@ -76,7 +100,13 @@ class DemoBase(Elaboratable, ABC):
         rgb = self.construct_rgb(m, vt)
         gpdi = platform.request('gpdi')
         gpdi_output = GPDIOutput(gpdi, rgb, vt)
-        pll = PLL(self.resolution.pll_config, 'sync')
+        _, divide = APP_CLOCKS[self.app_clock]
+        if self.uses_app_clock and divide is not None:
+            pll = PLL(self.resolution.pll_config, 'sync',
+                    second_domain_name='app', second_divide=divide)
+            m.domains += pll.second_domain
+        else:
+            pll = PLL(self.resolution.pll_config, 'sync')
         m.domains += pll.domain
         m.submodules += [vt, gpdi_output, pll]
         return m
@@ -127,100 +157,249 @@ class SquareProducer(Elaboratable):
 
 class FIFOSquares(DemoBase):
     """show a checker pattern via FIFO"""
-    def __init__(self, resolution):
-        super().__init__(resolution)
+    uses_app_clock = True
 
     def construct_rgb(self, m, video_timer):
+        from nmigen.lib.fifo import AsyncFIFO
+        from rgb_fifo import MonoFifoRGB
         fifo = AsyncFIFO(width=16, depth=16)
         fifo = DomainRenamer({'read': 'sync', 'write': 'app'})(fifo)
 
-        hfosc = HfOscillator('app')
-        m.domains += hfosc.domain
+        self.add_app_clock(m)
         producer = SquareProducer(self.resolution, fifo)
         producer = DomainRenamer({'sync': 'app'})(producer)
 
         rgb = MonoFifoRGB(video_timer, fifo)
-        m.submodules += [fifo, hfosc, producer, rgb]
+        m.submodules += [fifo, producer, rgb]
         return rgb
 
 
+class Buttons:
+    """Debounced buttons, shared between the writers of a design"""
+    def __init__(self):
+        self.pressed = {} # Button number -> pressed signal, in the app domain
+
+    def button(self, m, number=0):
+        """Returns a signal that is set for one app cycle when a button is
+        pressed. Each button is only added once, to the first module asking.
+        """
+        if number not in self.pressed:
+            press = ButtonPress(number)
+            m.submodules[f"button{number}"] = DomainRenamer({'sync': 'app'})(press)
+            self.pressed[number] = press.pressed
+        return self.pressed[number]
+
+
 class DBDemoBase(DemoBase):
+    """A base for demos that write to a double buffer
+
+    Each bit written is shown as a square of cell_size x cell_size pixels.
+    Writers write at the resolution given by self.cells.
+    """
+    uses_app_clock = True
+
+    @property
+    def cells(self):
+        return self.resolution.cells(self.cell_size)
+
     def construct_rgb(self, m, video_timer):
-        m.submodules.db = db = DoubleBuffer(self.resolution.words_per_line + 1,
+        m.submodules.db = db = DoubleBuffer(self.cells.words_per_line + 1,
                 write_domain='app', read_domain='sync')
-        m.submodules.hfosc = hfosc = HfOscillator('app')
-        m.domains += hfosc.domain
-        m.submodules.rgb = rgb = DoubleBufferReaderRGB(video_timer, db.read)
-        self.construct_writer(m, db.write)
+        self.add_app_clock(m)
+        m.submodules.rgb = rgb = DoubleBufferReaderRGB(video_timer, db.read,
+                scale=self.cell_size)
+        self.construct_writer(m, db.write, self.cells, Buttons())
         return rgb
 
-    def construct_writer(self, m, db_write):
+    @classmethod
+    def construct_writer(cls, m, db_write, cells, buttons):
         """
             Adds something to module m that writes to a double buffer
             m: module
             db_write: the write interface of the double buffer
+            cells: the resolution to write at
+            buttons: Buttons to use for input
+
+            A classmethod, so that writers can be built without a demo.
         """
         raise NotImplementedError()
 
 
 class DBSquares(DBDemoBase):
-    def construct_writer(self, m, db_write):
+    @classmethod
+    def construct_writer(cls, m, db_write, cells, buttons):
+        from square_writer import SquareWriter
         m.submodules.writer = DomainRenamer({'sync': 'app'})(
-                SquareWriter(self.resolution, db_write))
+                SquareWriter(cells, db_write))
 
 
 class DBOneD(DBDemoBase):
-    """show a checker pattern via DoubleBuffer"""
-    def __init__(self, resolution):
-        super().__init__(resolution)
-
-    def construct_writer(self, m, db_write):
-        #config = Rules1DConfig(18, InitStyle.SINGLE, 6)
-        config = Rules1DConfig(30, InitStyle.SINGLE, 1)
-        #config = Rules1DConfig(254, InitStyle.SINGLE, 6)
-        m.submodules.writer = DomainRenamer({'sync': 'app'})(
-                OneDWriter(self.resolution, db_write, config))
+    """1D automata. The user button steps through the rules and speeds in
+    oned_rules.CONFIGS"""
+    scroll = False # whether to keep lines in RAM, calculating only new lines
+
+    @classmethod
+    def construct_writer(cls, m, db_write, cells, buttons):
+        from oned_rules import CONFIGS
+        from oned_writer import OneDWriter
+        m2 = Module()
+        m2.submodules.writer = writer = OneDWriter(cells, db_write, CONFIGS[0],
+                scroll=cls.scroll)
+        # Each value is a rule number, with the speed above it
+        m2.submodules.configs = configs = ButtonSelector(
+                [c.num | (c.speed << 8) for c in CONFIGS], buttons.button(m))
+        m2.d.comb += [
+                writer.rule_in.eq(configs.value[:8]),
+                writer.rule_load.eq(configs.load),
+                writer.speed_in.eq(configs.value[8:]),
+                writer.speed_load.eq(configs.load),
+        ]
+        m.submodules.m2 = DomainRenamer({'sync': 'app'})(m2)
+
+
+class DBOneDScroll(DBOneD):
+    """1D automata, scrolling lines kept in RAM"""
+    scroll = True
 
 
 class DBRandom(DBDemoBase):
-    def construct_writer(self, m, db_write):
+    @classmethod
+    def construct_writer(cls, m, db_write, cells, buttons):
+        from rng_writer import RandomWriter
         m.submodules.writer = DomainRenamer({'sync': 'app'})(
-                RandomWriter(self.resolution, db_write))
+                RandomWriter(cells, db_write))
+
+
+class ButtonPress(Elaboratable):
+    """Debounces a button, setting pressed for one cycle on each press
+
+    The button is sampled every 2^18 cycles, which is long enough for it to
+    stop bouncing.
+    """
+    def __init__(self, number=0):
+        self.number = number
+        self.pressed = Signal() # output
+
+    def elaborate(self, platform):
+        from nmigen.lib.cdc import FFSynchronizer
+        m = Module()
+        button = Signal()
+        m.submodules.button_sync = FFSynchronizer(
+                platform.request('button', self.number).i, button)
+        timer = Signal(18)
+        sampled = Signal()
+        m.d.sync += [
+                timer.eq(timer + 1),
+                self.pressed.eq(0),
+        ]
+        with m.If(timer == 0):
+            m.d.sync += [
+                    sampled.eq(button),
+                    self.pressed.eq(button & ~sampled),
+            ]
+        return m
+
+
+class ButtonSelector(Elaboratable):
+    """Steps through a list of values each time press is set
+
+    load is set for one cycle when the value changes.
+    """
+    def __init__(self, values, press):
+        self.values = values
+        self.press = press # input
+        self.value = Signal(bits_for(max(values))) # output
+        self.load = Signal() # output
+
+    def elaborate(self, platform):
+        m = Module()
+        index = Signal(range(len(self.values)))
+        m.d.sync += self.load.eq(self.press)
+        with m.If(self.press):
+            m.d.sync += index.eq(Mux(index == len(self.values) - 1, 0, index + 1))
+        m.d.comb += self.value.eq(
+                Array(Const(v, len(self.value)) for v in self.values)[index])
+        return m
 
 
 class DBLife(DBDemoBase):
-    def construct_writer(self, m, db_write):
+    """Life. The user button steps through the rules in life_rules.RULES"""
+    generations = 1 # generations calculated per frame
+    width = 16 # cells calculated per cycle
+    calc_stages = 2 # pipeline register stages in the Life calculation
+    column_sums = True # whether to share column sums between cells
+
+    @classmethod
+    def construct_writer(cls, m, db_write, cells, buttons):
+        from life_rules import CalcLifeWord, CalcLifeWordColumns, RULES
+        from life_writer import build_life_writer
+        from rng import XorshiftGenerator
         m2 = Module()
-        res = self.resolution
-        read_ports, write_ports = build_memories(m2, res.words_per_line)
-
-        m2.submodules.buffer = buffer = LifeDataBuffer(read_ports, write_ports)
-        m2.submodules.filler = filler = LifeBufferFiller(
-                buffer.write, res.words_per_line, res.total_words)
-        m2.submodules.reader = reader = LifeBufferReader(
-                res.words_per_line, buffer.read)
+        writer = build_life_writer(m2, cells, db_write,
+                generations=cls.generations, width=cls.width,
+                calc_stages=cls.calc_stages,
+                calc_class=CalcLifeWordColumns if cls.column_sums else CalcLifeWord)
+        m2.submodules.rng = rng = XorshiftGenerator(cls.width, with_enable=True)
 
-        m2.submodules.writer = writer = LifeWriter(
-                res, db_write, filler.control, filler.ram, reader.interface)
-        m2.submodules.rng = rng = RandomWordGenerator(16, with_enable=True)
+        m2.submodules.rules = rules = ButtonSelector(list(RULES.values()), buttons.button(m))
 
         m2.d.comb += [
                 writer.rng_in.eq(rng.output),
                 rng.enable.eq(writer.rng_enable),
+                writer.rule_in.eq(rules.value),
+                writer.rule_load.eq(rules.load),
         ]
 
         m.submodules.m2 = DomainRenamer({'sync': 'app'})(m2)
 
 
-MODES = {d.__name__: d for d in [Plaid, FIFOSquares, DBSquares, DBOneD, DBRandom, DBLife]}
+class DBLife2(DBLife):
+    """Life, calculating two generations per frame"""
+    generations = 2
+
+
+class DBLife32(DBLife):
+    """Life, calculating 32 cells per cycle"""
+    width = 32
+
+
+class DBMulti(DBDemoBase):
+    """All of the double buffer demos in one design
+
+    Button 1, on the break off board, steps through the demos. Writers that
+    are not shown are held in reset. A writer leaving reset starts at the top
+    of the screen, and the reader shows its lines from the next frame.
+    """
+    demos = [DBSquares, DBOneD, DBRandom, DBLife]
+
+    @classmethod
+    def construct_writer(cls, m, db_write, cells, buttons):
+        # The user button is shared by the demos that use it
+        buttons.button(m, 0)
+        m.submodules.mux = mux = WriteMux(db_write, len(cls.demos))
+        m.submodules.select = select = DomainRenamer({'sync': 'app'})(
+                ButtonSelector(list(range(len(cls.demos))), buttons.button(m, 1)))
+        m.d.comb += mux.select.eq(select.value)
+        for n, demo_class in enumerate(cls.demos):
+            m2 = Module()
+            demo_class.construct_writer(m2, mux.writes[n], cells, buttons)
+            m.submodules[demo_class.__name__] = ResetInserter(
+                    {'app': select.value != n})(m2)
+
+
+MODES = {d.__name__: d for d in
+        [Plaid, FIFOSquares, DBSquares, DBOneD, DBOneDScroll, DBRandom, DBLife, DBLife2,
+            DBLife32, DBMulti]}
 
 
-def buildAndRunTest(demo, resolution, seed, retime, program):
+def buildAndRunTest(demo, resolution, app_clock, cell_size, hfosc_margin, seed, retime,
+        program):
     from nmigen_boards.icebreaker import ICEBreakerPlatform
     platform = ICEBreakerPlatform()
     add_gpdi_resources(platform)
+    platform.add_resources(platform.break_off_pmod)
     synth_opts = ["-retime"] if retime else []
-    platform.build(demo(resolution),
+    platform.build(demo(resolution, app_clock, cell_size, hfosc_margin),
             do_program=program, 
             synth_opts=synth_opts,
             nextpnr_opts=["--seed", seed])
@@ -238,6 +417,12 @@ if __name__ == '__main__':
             help='the type of output build')
     parser.add_argument('-r', '--resolution', default='640x480',
             choices=useful_resolutions, help='What resolution to choose')
+    parser.add_argument('-c', '--app-clock', default='hf24', choices=APP_CLOCKS.keys(),
+            help='clock for calculations: HF oscillator MHz, or fraction of pixel clock')
+    parser.add_argument('--cell-size', type=int, default=1, choices=[1, 2, 4],
+            help='size in pixels of each cell, for double buffer modes')
+    parser.add_argument('--hfosc-margin', action='store_true',
+            help='check HF oscillator app clock timing allowing for +/- 10%%')
     parser.add_argument('-s', '--seed', default='1', 
             help='seed to pass to nextpnr')
     parser.add_argument('--no-retime', dest='retime', action='store_false',
@@ -247,5 +432,6 @@ if __name__ == '__main__':
     parser.set_defaults(retime=True, program=True)
     args = parser.parse_args()
 
-    buildAndRunTest(MODES[args.mode], RESOLUTIONS[args.resolution], args.seed, args.retime, args.program)
+    buildAndRunTest(MODES[args.mode], RESOLUTIONS[args.resolution], args.app_clock,
+            args.cell_size, args.hfosc_margin, args.seed, args.retime, args.program)
 
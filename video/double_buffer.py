@@ -16,7 +16,7 @@
 from lfsr import Lfsr, watch_lfsr
 
 from nmigen import *
-from nmigen.back.pysim import Simulator
+from nmigen.back.pysim import Simulator, Settle
 from nmigen.hdl.rec import Layout
 from nmigen.lib.cdc import FFSynchronizer
 from nmigen.lib.fifo import SyncFIFO
@@ -149,6 +149,31 @@ class DoubleBuffer(Elaboratable):
         return m
 
 
+class WriteMux(Elaboratable):
+    """Shares a double buffer's write interface between several writers.
+
+    Only the writer numbered select writes to the double buffer, and only it
+    sees ready.
+    """
+    def __init__(self, db_write, count):
+        self.db_write = db_write
+        self.select = Signal(range(count)) # input
+        self.writes = [Record(DoubleBufferWriteLayout, name=f"write{n}")
+                for n in range(count)]
+
+    def elaborate(self, platform):
+        m = Module()
+        en = Array(w.en for w in self.writes)
+        data = Array(w.data for w in self.writes)
+        m.d.comb += [
+            self.db_write.en.eq(en[self.select]),
+            self.db_write.data.eq(data[self.select]),
+        ]
+        for n, w in enumerate(self.writes):
+            m.d.comb += w.ready.eq(self.db_write.ready & (self.select == n))
+        return m
+
+
 class DoubleBufferTest(SimulationTestCase):
 
     def setUp(self):
@@ -203,5 +228,27 @@ class DoubleBufferTest(SimulationTestCase):
 
         self.run_sim(reader, writer, write_trace=False)
 
+
+class WriteMuxTest(unittest.TestCase):
+    def test_select(self):
+        db_write = Record(DoubleBufferWriteLayout)
+        mux = WriteMux(db_write, 3)
+        def process():
+            yield db_write.ready.eq(1)
+            for n, w in enumerate(mux.writes):
+                yield w.en.eq(n != 1)
+                yield w.data.eq(0x100 + n)
+            for n in range(3):
+                yield mux.select.eq(n)
+                yield Settle()
+                self.assertEqual(n != 1, (yield db_write.en))
+                self.assertEqual(0x100 + n, (yield db_write.data))
+                for i, w in enumerate(mux.writes):
+                    self.assertEqual(i == n, (yield w.ready))
+
+        sim = Simulator(mux)
+        sim.add_process(process)
+        sim.run()
+
 if __name__ == '__main__':
     unittest.main()
@@ -16,8 +16,12 @@
 """Helpers for writing and testing Elaboratables."""
 
 from nmigen import *
-from nmigen.back.pysim import Simulator
+from nmigen.back.pysim import Simulator, Passive
 
+import io
+import os
+import sys
+import time
 import unittest
 
 def rename_sync(domain, elaboratable):
@@ -41,11 +45,99 @@ class SimpleElaboratable(Elaboratable):
         return self.m
 
 
+class SimulationProfile:
+    """Attributes simulation time to testbench processes.
+
+    Each process added through wrap() is timed while it runs, from each
+    command it receives to the next command it yields. Whatever is left over
+    from the step loop in run() is time spent in the simulator itself. Clock
+    cycles are counted by the passive process from cycle_counter().
+    """
+    def __init__(self):
+        self.process_times = {} # name -> seconds
+        self.total = 0.0
+        self.steps = 0
+        self.cycles = 0
+
+    def wrap(self, process):
+        """Returns a process that runs process, accumulating its time."""
+        name = process.__name__
+        n = 2
+        while name in self.process_times:
+            name = f"{process.__name__}_{n}"
+            n += 1
+        self.process_times[name] = 0.0
+        def wrapper():
+            coroutine = process()
+            response = None
+            exception = None
+            while True:
+                start = time.perf_counter()
+                try:
+                    if exception is None:
+                        command = coroutine.send(response)
+                    else:
+                        command = coroutine.throw(exception)
+                except StopIteration:
+                    return
+                finally:
+                    self.process_times[name] += time.perf_counter() - start
+                try:
+                    response = yield command
+                    exception = None
+                except Exception as e:
+                    exception = e
+        return wrapper
+
+    def cycle_counter(self):
+        """Returns a passive sync process that counts clock cycles."""
+        def counter():
+            yield Passive()
+            while True:
+                yield
+                self.cycles += 1
+        return counter
+
+    def run(self, sim):
+        """Runs sim while any processes are active, as Simulator.run does."""
+        start = time.perf_counter()
+        while sim.step():
+            self.steps += 1
+        self.total += time.perf_counter() - start
+
+    @property
+    def simulator_time(self):
+        return self.total - sum(self.process_times.values())
+
+    def report(self, title, file=None):
+        """Prints the times to file, which defaults to stderr."""
+        file = file or sys.stderr
+        cycles = max(self.cycles, 1)
+        def line(name, seconds):
+            print(f"  {name:24} {seconds:8.3f}s {seconds * 1e6 / cycles:10.1f}us/cycle "
+                    f"{seconds / max(self.total, 1e-9):6.1%}", file=file)
+        print(f"{title}: {self.cycles:.0f} cycles, {self.steps} steps, "
+                f"{self.total:.3f}s", file=file)
+        for name, seconds in sorted(self.process_times.items(),
+                key=lambda item: -item[1]):
+            line(name, seconds)
+        line('(simulator)', self.simulator_time)
+
+
 class SimulationTestCase(unittest.TestCase):
+    """Base for tests that simulate self.m with a single 1Hz sync clock.
+
+    Set profile to True, or set the SIM_PROFILE environment variable, to have
+    each call to run_sim report time spent in each process and in the
+    simulator itself.
+    """
+    profile = bool(os.environ.get('SIM_PROFILE'))
+
     def __init__(self, *args):
         super().__init__(*args)
         self.m = Module()
         self.extra_processes = []
+        self.sim_profile = None
         
     def toggle(self, signal):
         """Set signal high, then low"""
@@ -60,16 +152,57 @@ class SimulationTestCase(unittest.TestCase):
         else:
             self.m.submodules += submodule
 
-    def run_sim(self, *processes, write_trace=False):
+    def run_sim(self, *processes, write_trace=False, profile=None, profile_file=None):
+        """Simulates self.m until processes finish.
+
+        profile_file: where to write the profile report, default stderr
+        """
+        if profile is None:
+            profile = self.profile
         self.sim = Simulator(self.m)
-        for p in processes:
-            self.sim.add_sync_process(p)
-        for p in self.extra_processes:
+        self.sim_profile = SimulationProfile() if profile else None
+        for p in processes + tuple(self.extra_processes):
+            if profile:
+                p = self.sim_profile.wrap(p)
             self.sim.add_sync_process(p)
+        if profile:
+            self.sim.add_sync_process(self.sim_profile.cycle_counter())
 
         self.sim.add_clock(1) # 1Hz for simplicity of counting
+        run = self.sim_profile.run if profile else lambda sim: sim.run()
         if write_trace:
             with self.sim.write_vcd("zz.vcd", "zz.gtkw"):
-                self.sim.run()
+                run(self.sim)
         else:
-            self.sim.run()
+            run(self.sim)
+        if profile:
+            self.sim_profile.report(self.id(), file=profile_file)
+
+
+class SimulationProfileTest(SimulationTestCase):
+    def setUp(self):
+        self.counter = Signal(4)
+        self.m.d.sync += self.counter.eq(self.counter + 1)
+
+    def test_profile(self):
+        seen = []
+        def watcher():
+            yield Passive()
+            while True:
+                seen.append((yield self.counter))
+                yield
+        self.extra_processes.append(watcher)
+        def process():
+            for _ in range(10):
+                yield
+        report = io.StringIO()
+        self.run_sim(process, profile=True, profile_file=report)
+        self.assertEqual(seen[:3], [0, 1, 2])
+        self.assertEqual(set(self.sim_profile.process_times), {'process', 'watcher'})
+        self.assertEqual(self.sim_profile.cycles, 10)
+        self.assertGreater(self.sim_profile.simulator_time, 0)
+        lines = report.getvalue().splitlines()
+        self.assertEqual(4, len(lines))
+        self.assertTrue(lines[0].startswith(f"{self.id()}: 10 cycles,"))
+        self.assertEqual(['(simulator)', 'process', 'watcher'],
+                sorted(line.split()[0] for line in lines[1:]))
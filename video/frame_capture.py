@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Captures whole video frames during simulation.
+
+A FrameCapture watches the signals that a GPDIOutput sends to the pmod and
+records every clock of every frame into NumPy arrays. Completed frames can be
+written out as PNG files and streamed to a FrameComparator, which checks them
+against frames produced by a reference engine.
+"""
+from output import GPDILayout
+from util import all_bits_list
+
+from nmigen import *
+
+# pip install attrs
+from attr import attrs, attrib
+# pip install numpy
+import numpy as np
+
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+
+
+# Bit offsets of the GPDI fields when the record is read as a single value
+_OFFSETS = {}
+_offset = 0
+for _name, (_shape, _) in GPDILayout.fields.items():
+    _OFFSETS[_name] = _offset
+    _offset += Shape.cast(_shape).width
+
+
+def _field(raw, name, width=1):
+    return (raw >> _OFFSETS[name]) & ((1 << width) - 1)
+
+
+class CapturedFrame:
+    """One frame of GPDI signals.
+
+    The frame raster starts at the first active pixel after vertical sync and
+    covers every clock of the frame, including blanking.
+    """
+    def __init__(self, resolution, raw):
+        """
+            resolution: the resolution being captured
+            raw: (vertical.total, horizontal.total) array of GPDI record values
+        """
+        self.resolution = resolution
+        self.rgb = np.stack([_field(raw, c, 4) for c in ('red', 'green', 'blue')],
+                axis=-1).astype(np.uint8)
+        self.hs = _field(raw, 'hs').astype(bool)
+        self.vs = _field(raw, 'vs').astype(bool)
+        self.act = _field(raw, 'act').astype(bool)
+
+    @property
+    def pixels(self):
+        """The displayed pixels, as a (v.active, h.active, 3) array of 4 bit colors."""
+        h = self.resolution.horizontal
+        v = self.resolution.vertical
+        return self.rgb[self.act].reshape(v.active, h.active, 3)
+
+    @property
+    def mono(self):
+        """The displayed pixels as 0 or 1, taken from the top bit of red."""
+        return self.pixels[..., 0] >> 3
+
+    def write_png(self, filename):
+        write_png(filename, self.pixels)
+
+
+def write_png(filename, pixels):
+    """Writes a (height, width, 3) array of 4 bit colors to a PNG file."""
+    height, width, _ = pixels.shape
+    data = pixels.astype(np.uint8) * 17 # Scale 4 bit color to 8 bits
+    raw = b''.join(b'\x00' + data[y].tobytes() for y in range(height))
+    def chunk(kind, body):
+        crc = zlib.crc32(kind + body) & 0xffffffff
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', crc)
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw)))
+        f.write(chunk(b'IEND', b''))
+
+
+def mono_frame(rows):
+    """Converts rows of 16 bit words, as written to a double buffer, to a
+       (rows, 16 * words) array of mono pixels.
+    """
+    return np.array([all_bits_list(row) for row in rows], dtype=np.uint8)
+
+
+@attrs
+class FrameMismatch:
+    """Describes a captured frame that differs from the reference"""
+    frame = attrib() # index of the frame
+    count = attrib() # number of pixels that differ
+    first = attrib() # (y, x) of first differing pixel
+
+
+class FrameComparator:
+    """Compares captured frames with frames from a reference engine.
+
+    The reference is any iterable of frames. Each frame is either a
+    (v.active, h.active) array of mono pixels or a (v.active, h.active, 3)
+    array of 4 bit colors. Frames are compared as they arrive, so the
+    reference may be an endless generator.
+    """
+    def __init__(self, reference):
+        self.reference = iter(reference)
+        self.num_compared = 0
+        self.mismatches = []
+
+    def __call__(self, frame):
+        expected = np.asarray(next(self.reference))
+        actual = frame.mono if expected.ndim == 2 else frame.pixels
+        different = actual != expected
+        if expected.ndim == 3:
+            different = different.any(axis=-1)
+        if different.any():
+            first = tuple(int(i) for i in np.argwhere(different)[0])
+            self.mismatches.append(
+                    FrameMismatch(self.num_compared, int(different.sum()), first))
+        self.num_compared += 1
+
+    @property
+    def ok(self):
+        return not self.mismatches
+
+
+class FrameCapture:
+    """Records frames from a GPDI record during simulation.
+
+    Add the process to a simulator with add_sync_process, in the same domain
+    as the GPDIOutput. The process remains active until num_frames frames have
+    been captured.
+    """
+    def __init__(self, gpdi, resolution, num_frames, *,
+            on_frame=None, skip_frames=0, keep_frames=True, png_prefix=None):
+        """
+            gpdi: record with GPDILayout, as driven by a GPDIOutput
+            resolution: resolution of the video being captured
+            num_frames: number of frames to capture
+            on_frame: called with each CapturedFrame as it completes
+            skip_frames: number of frames to discard before capturing
+            keep_frames: whether to keep captured frames in self.frames
+            png_prefix: if set, each frame is also written to <prefix><n>.png
+        """
+        self.gpdi = gpdi
+        self.resolution = resolution
+        self.num_frames = num_frames
+        self.on_frame = on_frame
+        self.skip_frames = skip_frames
+        self.keep_frames = keep_frames
+        self.png_prefix = png_prefix
+        self.frames = []
+        self.num_captured = 0
+
+    def wait_frame_start(self):
+        """Waits for first active pixel after vertical sync."""
+        asserted = int(self.resolution.sync_positive)
+        while (yield self.gpdi.vs) != asserted:
+            yield
+        while not (yield self.gpdi.act):
+            yield
+
+    def capture_frame(self):
+        h_total = self.resolution.horizontal.total
+        v_total = self.resolution.vertical.total
+        raw = np.zeros((v_total, h_total), dtype=np.uint32)
+        for y in range(v_total):
+            row = raw[y]
+            for x in range(h_total):
+                row[x] = yield Value.cast(self.gpdi)
+                yield
+        return CapturedFrame(self.resolution, raw)
+
+    def add_frame(self, frame):
+        if self.png_prefix is not None:
+            frame.write_png(f"{self.png_prefix}{self.num_captured}.png")
+        if self.on_frame:
+            self.on_frame(frame)
+        if self.keep_frames:
+            self.frames.append(frame)
+        self.num_captured += 1
+
+    def process(self):
+        yield from self.wait_frame_start()
+        for n in range(self.skip_frames + self.num_frames):
+            frame = yield from self.capture_frame()
+            if n >= self.skip_frames:
+                self.add_frame(frame)
+
+
+def capture_frames(sim, gpdi, resolution, num_frames, *, reference=None,
+        domain='sync', **kwargs):
+    """Runs a simulation until num_frames frames have been captured.
+
+    If reference is given, frames are checked against it as they are captured.
+    Returns the FrameCapture. Its comparator attribute holds the results of any
+    comparison.
+    """
+    capture = FrameCapture(gpdi, resolution, num_frames, **kwargs)
+    capture.comparator = None
+    if reference is not None:
+        capture.comparator = FrameComparator(reference)
+        capture.on_frame = capture.comparator
+    sim.add_sync_process(capture.process, domain=domain)
+    sim.run()
+    return capture
+
+
+class FrameCaptureTest(unittest.TestCase):
+    def setUp(self):
+        from video_config import ResolutionParams, SyncConfig
+        self.res = ResolutionParams(None, True,
+                SyncConfig(4, 1, 1, 1), SyncConfig(3, 1, 1, 1))
+
+    def make_raw(self, color):
+        # Build a raster with a single color in the active area
+        h, v = self.res.horizontal, self.res.vertical
+        raw = np.zeros((v.total, h.total), dtype=np.uint32)
+        act = 1 << _OFFSETS['act']
+        raw[:v.active, :h.active] = act | color
+        return raw
+
+    def test_pixels(self):
+        frame = CapturedFrame(self.res, self.make_raw(0x5a3))
+        self.assertEqual(frame.pixels.shape, (3, 4, 3))
+        self.assertEqual(list(frame.pixels[2, 3]), [0x3, 0xa, 0x5])
+        self.assertFalse(frame.mono.any())
+        self.assertEqual(frame.act.sum(), 12)
+
+    def test_comparator(self):
+        white = CapturedFrame(self.res, self.make_raw(0xfff))
+        comparator = FrameComparator([np.ones((3, 4)), np.zeros((3, 4))])
+        comparator(white)
+        self.assertTrue(comparator.ok)
+        comparator(white)
+        self.assertEqual(comparator.mismatches, [FrameMismatch(1, 12, (0, 0))])
+
+    def test_mono_frame(self):
+        self.assertEqual(mono_frame([[1, 0x8000]]).tolist(),
+                [[1] + [0] * 30 + [1]])
+
+    def test_write_png(self):
+        frame = CapturedFrame(self.res, self.make_raw(0xf00))
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'frame.png')
+            frame.write_png(filename)
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(8), b'\x89PNG\r\n\x1a\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,12 +16,11 @@
 """ High frequency oscillator. """
 
 from nmigen import *
-from nmigen.back import verilog
 
 import argparse
 
 class HfOscillator(Elaboratable):
-    """Provides a 24MHz clock based on the HF Oscillator.
+    """Provides a 48, 24, 12 or 6MHz clock based on the HF Oscillator.
 
     A pixel clock outputting at 73.5MHz, puts out 16 pixels (one word) in
     2.17us At 24MHz, the calculating clock performs 5.2 cycles in that time,
@@ -31,27 +30,38 @@ class HfOscillator(Elaboratable):
     According to the documenatation, the HF oscillator should only be enabled
     100us after power up.  However, in practice, appears to works well enough.
     """
-    #TODO: make configurable 12/24/48
     #TODO: Use LFOSC to enable after 100us
     #TODO: Look closely at nmigen/vendor/lattice_ice40.py create_missing_domain
-    def __init__(self, domain_name):
+
+    # Frequency in MHz -> CLKHF_DIV parameter
+    DIVIDERS = {48: "0b00", 24: "0b01", 12: "0b10", 6: "0b11"}
+    # The datasheet allows for +/- 10%
+    TOLERANCE = 0.1
+
+    def __init__(self, domain_name, mhz=24, margin=False):
+        """
+            margin: whether to check timing at the fastest the oscillator may
+                run, allowing for TOLERANCE, rather than at its nominal
+                frequency
+        """
+        assert mhz in self.DIVIDERS, f"HF oscillator can not run at {mhz}MHz"
         self.domain = ClockDomain(domain_name)
+        self.mhz = mhz
+        self.margin = margin
 
     def elaborate(self, platform):
         m = Module()
         hfosc = Instance("SB_HFOSC",
-                p_CLKHF_DIV="0b01", #24MHz
-                #p_CLKHF_DIV="0b10", #12MHz
+                p_CLKHF_DIV=self.DIVIDERS[self.mhz],
                 i_CLKHFPU=1,
                 i_CLKHFEN=1,
                 o_CLKHF=self.domain.clk)
         m.submodules += [hfosc]
-        platform.add_clock_constraint(self.domain.clk, (24e6))
         # Bug: according to datasheet, must allow +/- 10%, but this design
-        # is marginal at 24MHz
-        #platform.add_clock_constraint(self.domain.clk, (24e6*1.1))
-        # 12MHz too slow for 1280x720
-        #platform.add_clock_constraint(self.domain.clk, (12e6*1.1))
+        # is marginal at 24MHz, so the margin is opt in
+        tolerance = self.TOLERANCE if self.margin else 0
+        platform.add_clock_constraint(self.domain.clk,
+                self.mhz * (1 + tolerance) * 1e6)
         return m
 
 if __name__ == '__main__':
@@ -60,6 +70,7 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     if args.generate:
+        from nmigen.back import verilog
         from nmigen_boards.icebreaker import ICEBreakerPlatform
         print(verilog.convert(HfOscillator('clk_app'), platform=ICEBreakerPlatform()))
     else:
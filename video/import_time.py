@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures how long it takes to import modules in this directory.
+
+Each module is imported in a fresh Python process, several times, and the
+fastest time is reported. The report also shows whether the import pulled in
+toolchain modules - the icebreaker platform, nmigen.build or the verilog
+back end - which should only be needed when building or generating.
+
+With --compare, the same modules are also measured as they were at an earlier
+git revision.
+
+    $ ./import_time.py
+    $ ./import_time.py --compare HEAD~1 output build
+"""
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+
+TOOLCHAIN_MODULES = ['nmigen_boards.icebreaker', 'nmigen.build', 'nmigen.back.verilog']
+
+# Run in a subprocess. Prints the import time, then any toolchain modules loaded.
+_MEASURE = """
+import sys, time
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+print(time.perf_counter() - start)
+print(' '.join(m for m in {toolchain!r} if m in sys.modules))
+"""
+
+
+def measure(directory, modules, repeat):
+    """Returns (seconds, toolchain modules loaded) for importing modules."""
+    code = _MEASURE.format(toolchain=TOOLCHAIN_MODULES)
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code, *modules], cwd=directory,
+                capture_output=True, text=True, check=True).stdout.splitlines()
+        seconds = float(out[0])
+        best = seconds if best is None else min(best, seconds)
+    loaded = out[1].split() if len(out) > 1 else []
+    return best, loaded
+
+
+def module_names(directory):
+    return sorted(os.path.basename(f)[:-3]
+            for f in glob.glob(os.path.join(directory, '*.py'))
+            if not f.endswith('__init__.py'))
+
+
+def export_revision(rev, directory):
+    """Writes the video directory at git revision rev into directory."""
+    archive = subprocess.run(['git', 'archive', rev, '.'], capture_output=True,
+            check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    subprocess.run(['tar', '-x', '-C', directory], input=archive, check=True)
+
+
+def report(name, current, earlier=None):
+    seconds, loaded = current
+    line = f"{name:22} {seconds * 1000:8.1f}ms"
+    if earlier is not None:
+        line += f" {earlier[0] * 1000:8.1f}ms {seconds / earlier[0] - 1:+7.1%}"
+    line += f"  {' '.join(loaded) or '-'}"
+    if earlier is not None:
+        line += f" (was {' '.join(earlier[1]) or '-'})"
+    print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('modules', nargs='*',
+            help='modules to import. Default is every module in this directory')
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+            help='number of times to import each module')
+    parser.add_argument('--compare', metavar='REV',
+            help='also measure modules at this git revision')
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    modules = args.modules or module_names(here)
+    with tempfile.TemporaryDirectory() as earlier_dir:
+        if args.compare:
+            export_revision(args.compare, earlier_dir)
+            print(f"{'module':22} {'now':>10} {args.compare:>10} {'change':>7}  toolchain modules")
+        else:
+            print(f"{'module':22} {'now':>10}  toolchain modules")
+        runs = [(m, [m]) for m in modules] + [('(all)', modules)]
+        for name, to_import in runs:
+            earlier = None
+            if args.compare:
+                present = [m for m in to_import
+                        if os.path.exists(os.path.join(earlier_dir, m + '.py'))]
+                if present:
+                    earlier = measure(earlier_dir, present, args.repeat)
+            report(name, measure(here, to_import, args.repeat), earlier)
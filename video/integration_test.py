@@ -13,90 +13,164 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Integration test for square writer integration test"""
+"""Integration tests for writers, double buffer, reader and output"""
+import itertools
 import unittest
 
 from nmigen import *
 from nmigen.back.pysim import Simulator
 
-from double_buffer import DoubleBuffer
+from double_buffer import DoubleBuffer, WriteMux
+from frame_capture import capture_frames, mono_frame
+from oned_rules import Rules1D, Rules1DConfig, InitStyle
+from oned_writer import OneDWriter
+from output import GPDILayout, GPDIOutput
 from rgb_reader import DoubleBufferReaderRGB
 from square_writer import SquareWriter
 from timing import VideoTimer
-from util import all_bits_list
 from video_config import RESOLUTIONS
 
-class SquareIntegrationFixture(Elaboratable):
-    """Configures a square writer, double buffer and reader."""
-    def __init__(self, resolution):
+# pip install numpy
+import numpy as np
+
+
+class WriterIntegrationFixture(Elaboratable):
+    """Configures a writer, double buffer, reader and GPDI output.
+
+    The writer runs in the 'app' domain, while the rest runs in 'sync'.
+    """
+    def __init__(self, resolution, make_writer, *, scale=1):
+        """
+            resolution: resolution to display
+            make_writer: called with the double buffer write interface.
+                Returns the writer Elaboratable.
+            scale: size of each written bit on screen. The writer should write
+                at resolution.cells(scale)
+        """
         self.resolution = resolution
-        # Output
-        self.out = Signal() # Monochrome color
-        self.active = Signal() # In active area
-        self.vertical_sync = Signal() # Vertical sync signal
+        self.make_writer = make_writer
+        self.scale = scale
+        # Output - stands in for the pmod
+        self.gpdi = Record(GPDILayout)
 
     def elaborate(self, platform):
         m = Module()
         m.domains += ClockDomain('sync')
         m.domains += ClockDomain('app')
         m.submodules.vt = vt = VideoTimer(self.resolution)
-        m.submodules.db = db = DoubleBuffer(self.resolution.words_per_line + 1,
+        cells = self.resolution.cells(self.scale)
+        m.submodules.db = db = DoubleBuffer(cells.words_per_line + 1,
                 write_domain='app', read_domain='sync')
-        m.submodules.rgb = rgb = DoubleBufferReaderRGB(vt, db.read)
+        m.submodules.rgb = rgb = DoubleBufferReaderRGB(vt, db.read, scale=self.scale)
         m.submodules.writer = DomainRenamer({'sync': 'app'})(
-                SquareWriter(self.resolution, db.write, size=0))
-        m.d.comb += [
-            self.out.eq(rgb.red[3]),
-            self.active.eq(vt.active),
-            self.vertical_sync.eq(vt.vertical_sync),
-        ]
+                self.make_writer(db.write))
+        m.submodules.gpdi = GPDIOutput(self.gpdi, rgb, vt)
         return m
 
 
-class SquareWriterTest(unittest.TestCase):
-    def setUp(self):
+def square_frame():
+    """Returns a TESTBIG resolution frame where the SquareWriter has size=0"""
+    rows = []
+    for row in range(44):
+        pat0 = [0x0000, 0xffff, 0x0000, 0xffff]
+        pat1 = [0xffff, 0x0000, 0xffff, 0x0000]
+        rows.append(pat1 if (row & 0x10) else pat0)
+    return mono_frame(rows)
+
+
+def oned_frames(cells, config, scale=1):
+    """Reference engine: yields frames expected from a OneDWriter"""
+    rules = Rules1D(cells.horizontal.active, config)
+    saved = rules.initdata()
+    while True:
+        expected = saved
+        rows = []
+        for row in range(cells.vertical.active):
+            rows.append(expected)
+            if row == rules.speed:
+                saved = expected
+            expected = rules.eval(expected)
+        frame = np.array(rows, dtype=np.uint8)
+        yield frame.repeat(scale, axis=0).repeat(scale, axis=1)
+
+
+class IntegrationTestCase(unittest.TestCase):
+    def make_sim(self, make_writer, scale=1):
         self.res = RESOLUTIONS['TESTBIG']
-        self.fixture = SquareIntegrationFixture(self.res)
+        self.cells = self.res.cells(scale)
+        self.fixture = WriterIntegrationFixture(self.res, make_writer, scale=scale)
         self.sim = Simulator(self.fixture)
+        self.sim.add_clock(1, domain='sync')
+        self.sim.add_clock(2.54, domain='app')
+
+    def check_frames(self, reference, num_frames):
+        capture = capture_frames(self.sim, self.fixture.gpdi, self.res,
+                num_frames, reference=reference, keep_frames=False)
+        self.assertEqual(capture.comparator.num_compared, num_frames)
+        self.assertEqual(capture.comparator.mismatches, [])
 
-        self.sim.add_clock(1, domain='sync') 
-        self.sim.add_clock(2.54, domain='app') 
 
-    def frame_bits(self):
-        # returns the bits for a TESTBIG resolution frame where
-        # the SquareWriter has size=0
-        result = []
-        for row in range(44):
-            pat0 = [0x0000, 0xffff, 0x0000, 0xffff]
-            pat1 = [0xffff, 0x0000, 0xffff, 0x0000]
-            pat = pat1 if (row & 0x10) else pat0
-            result += all_bits_list(pat)
-        return result
+class SquareWriterTest(IntegrationTestCase):
+    def setUp(self):
+        self.make_sim(lambda db_write: SquareWriter(self.res, db_write, size=0))
 
     def test_reader(self):
-        def process():
-            # Skip to after first vertical sync
-            while not (yield self.fixture.vertical_sync):
-                yield
-            while (yield self.fixture.vertical_sync):
+        self.check_frames(itertools.repeat(square_frame()), 2)
+
+
+class OneDWriterTest(IntegrationTestCase):
+    scale = 1
+
+    def setUp(self):
+        self.config = Rules1DConfig(30, InitStyle.SINGLE, 5)
+        self.make_sim(lambda db_write: OneDWriter(self.cells, db_write, self.config),
+                self.scale)
+
+    def test_reader(self):
+        self.check_frames(oned_frames(self.cells, self.config, self.scale), 2)
+
+
+class OneDWriterScale2Test(OneDWriterTest):
+    scale = 2
+
+
+class WriteMuxTest(IntegrationTestCase):
+    """Switches from a SquareWriter to a OneDWriter part way through a frame,
+    holding the writer that is not selected in reset."""
+    def setUp(self):
+        self.select = Signal()
+        self.config = Rules1DConfig(30, InitStyle.SINGLE, 5)
+        self.make_sim(self.make_writers)
+
+    def make_writers(self, db_write):
+        m = Module()
+        m.submodules.mux = mux = WriteMux(db_write, 2)
+        m.d.comb += mux.select.eq(self.select)
+        writers = [SquareWriter(self.res, mux.writes[0], size=0),
+                OneDWriter(self.cells, mux.writes[1], self.config)]
+        for n, writer in enumerate(writers):
+            m.submodules[f"writer{n}"] = ResetInserter(self.select != n)(writer)
+        return m
+
+    def switch_process(self):
+        # Switch in the middle of the second frame
+        asserted = int(self.res.sync_positive)
+        for _ in range(2):
+            while (yield self.fixture.gpdi.vs) == asserted:
                 yield
-            pix = 0
-            bits = self.frame_bits()
-            # Look for active pixels before next vertical sync
-            while not (yield self.fixture.vertical_sync):
-                if (yield self.fixture.active):
-                    out = yield self.fixture.out
-                    if out != bits[pix]:
-                        breakpoint()
-                    self.assertEqual(bits[pix], out)
-                    pix += 1
+            while (yield self.fixture.gpdi.vs) != asserted:
                 yield
-            self.assertEqual(pix,
-                    self.res.horizontal.active * self.res.vertical.active)
+        for _ in range(self.res.horizontal.total * self.res.vertical.total // 2):
+            yield
+        yield self.select.eq(1)
 
-        self.sim.add_sync_process(process, domain='sync')
-        with self.sim.write_vcd("zz.vcd", "zz.gtkw"):
-            self.sim.run()
+    def test_switch(self):
+        self.sim.add_sync_process(self.switch_process)
+        capture = capture_frames(self.sim, self.fixture.gpdi, self.res, 3)
+        # The new writer starts at the top of the screen from the next frame
+        oned = next(oned_frames(self.cells, self.config))
+        self.assertTrue((capture.frames[0].mono == square_frame()).all())
+        self.assertTrue((capture.frames[2].mono == oned).all())
 
 
 if __name__ == '__main__':
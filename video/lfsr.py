@@ -25,14 +25,16 @@
    be used with "<" or ">". "==" is O(log(n)) in the number of bits being
    compared.
 
-   The LFSRs increment every clock cycle, unless disabled.
+   The LFSRs increment every clock cycle, unless disabled. An LFSR may also
+   move several steps each cycle, for example to count pixels when more than
+   one pixel is handled per clock. The steps are then applied together, as
+   one XOR network per bit.
 
    For more information on this kind of LFSR see
    https://en.wikipedia.org/wiki/Linear-feedback_shift_register#Galois_LFSRs
 
 """
 from nmigen import *
-from nmigen.back import verilog
 from nmigen.back.pysim import Simulator
 from nmigen.utils import bits_for
 
@@ -78,35 +80,63 @@ POLYNOMIALS= {
 }
 
 
+def linear_map(fn, value, width=None):
+    """Applies fn, a linear function over GF(2) on ints, to an nMigen value.
+
+    Each bit of the result is a single flat XOR of the bits of value that
+    fn maps onto it, found by applying fn to each bit of value on its own.
+    Result is width bits wide, or the width of value if width is not given.
+    """
+    width = len(value) if width is None else width
+    columns = [fn(1 << i) for i in range(len(value))]
+    def xor(bit):
+        terms = [value[i] for i, c in enumerate(columns) if (c >> bit) & 1]
+        return Cat(*terms).xor() if terms else C(0, 1)
+    return Cat(*(xor(bit) for bit in range(width)))
+
+
 class LfsrConfig:
     """Specifies the parameters of the Lfsr and allows calculations to be made
     """
     @staticmethod
-    def num_bits(n, restart_value=1):
+    def num_bits(n, restart_value=1, *, steps_per_cycle=1):
         """Constructs a maximal length LFSR with n bits"""
-        return LfsrConfig.num_steps(2**n - 1, restart_value)
+        return LfsrConfig.num_steps(2**n - 1, restart_value,
+                steps_per_cycle=steps_per_cycle)
 
     @staticmethod
-    def num_steps(n, restart_value=1):
+    def num_steps(n, restart_value=1, *, steps_per_cycle=1):
         """Constructs an LFSR which has n steps before repeating"""
-        return LfsrConfig(n, restart_value, is_private_call=1)
+        return LfsrConfig(n, restart_value, steps_per_cycle, is_private_call=1)
 
-    def __init__(self, num_steps, restart_value, is_private_call=0):
+    def __init__(self, num_steps, restart_value, steps_per_cycle=1, is_private_call=0):
         """Private use num_steps() or num_bits()"""
         assert is_private_call
         self.num_steps = num_steps
+        self.steps_per_cycle = steps_per_cycle
         self.num_bits = max(bits_for(num_steps), 4)
         assert 4 <= self.num_bits <= 32
+        # A non-maximal LFSR restarts rather than rolling over, so must
+        # land exactly on its last step
+        assert self.is_maximal or num_steps % steps_per_cycle == 0
         self.polynomial = POLYNOMIALS[self.num_bits]
         # Ensure restart_value is in allowed range
         self.restart_value = (((restart_value or 1)-1) % num_steps) + 1
         # values is a list of all values by step
         self.values = [self.restart_value]
 
+    def step(self, value):
+        """Returns the value one step after value."""
+        return (value >> 1) ^ (self.polynomial if (value & 1) else 0)
+
+    def cycle_step(self, value):
+        """Returns the value steps_per_cycle steps after value."""
+        for _ in range(self.steps_per_cycle):
+            value = self.step(value)
+        return value
+
     def calculate_next(self):
-        prev = self.values[-1]
-        next = (prev >> 1) ^ (self.polynomial if (prev & 1) else 0)
-        self.values.append(next)
+        self.values.append(self.step(self.values[-1]))
 
     def value_at(self, step):
         """Gets value at this step."""
@@ -115,6 +145,22 @@ class LfsrConfig:
             self.calculate_next()
         return self.values[step]
 
+    def steps_passing(self, target):
+        """Gets the steps the LFSR may be at when it passes target.
+
+        When stepping more than once per cycle, the LFSR may step over the
+        target. It passes the target on cycles where target is the current
+        step or one of the steps skipped before the next cycle. Maximal LFSRs
+        roll over part way through a cycle, so may pass the target from any
+        of the steps_per_cycle steps before it. Non-maximal LFSRs always count
+        from zero.
+        """
+        k = self.steps_per_cycle
+        target %= self.num_steps
+        if self.is_maximal:
+            return sorted({(target - i) % self.num_steps for i in range(k)})
+        return [target - target % k]
+
     @property
     def is_maximal(self):
         return self.num_steps == 2**self.num_bits - 1
@@ -158,6 +204,21 @@ class LfsrConfigTest(unittest.TestCase):
         self.check_wrap(31)
         self.check_wrap(1000)
 
+    def test_cycle_step(self):
+        # Up to the last step, where non-maximal LFSRs restart instead
+        p = LfsrConfig.num_steps(200, steps_per_cycle=4)
+        for i in range(0, 196, 4):
+            self.assertEqual(p.value_at(i + 4), p.cycle_step(p.value_at(i)))
+
+    def test_steps_passing(self):
+        p = LfsrConfig.num_steps(200, steps_per_cycle=4)
+        self.assertEqual([0], p.steps_passing(0))
+        self.assertEqual([4], p.steps_passing(7))
+        self.assertEqual([196], p.steps_passing(199))
+        p = LfsrConfig.num_bits(5, steps_per_cycle=3)
+        self.assertEqual([3, 4, 5], p.steps_passing(5))
+        self.assertEqual([0, 29, 30], p.steps_passing(0))
+
 
 class Lfsr(Elaboratable):
     """Linear feedback shift register that increments each cycle"""
@@ -176,14 +237,16 @@ class Lfsr(Elaboratable):
         self.ports = [self.restart, self.enable, self.value]
 
     @staticmethod
-    def num_bits(n, *, restart_value=None, default_enabled=True):
+    def num_bits(n, *, restart_value=None, default_enabled=True, steps_per_cycle=1):
         """Constructs a maximal length LFSR with n bits"""
-        return Lfsr(LfsrConfig.num_bits(n, restart_value), default_enabled)
+        return Lfsr(LfsrConfig.num_bits(n, restart_value, steps_per_cycle=steps_per_cycle),
+                default_enabled)
 
     @staticmethod
-    def num_steps(n, *, restart_value=None, default_enabled=True):
+    def num_steps(n, *, restart_value=None, default_enabled=True, steps_per_cycle=1):
         """Constructs an LFSR which has n steps before repeating"""
-        return Lfsr(LfsrConfig.num_steps(n, restart_value), default_enabled)
+        return Lfsr(LfsrConfig.num_steps(n, restart_value, steps_per_cycle=steps_per_cycle),
+                default_enabled)
 
     def elaborate(self, platform):
         m = Module()
@@ -192,6 +255,9 @@ class Lfsr(Elaboratable):
             m.d.sync += self.value.eq(self.config.restart_value)
 
         def step():
+            if self.config.steps_per_cycle > 1:
+                m.d.sync += self.value.eq(linear_map(self.config.cycle_step, self.value))
+                return
             with m.If(self.value[0]):
                 m.d.sync += self.value.eq(self.value[1:] ^ self.config.polynomial)
             with m.Else():
@@ -218,6 +284,9 @@ class LfsrWatcher(Elaboratable):
     """Watches an LFSR, waiting for it to get to a particular step.
        Since matching a long value is relatively slow, actually matches on the
        step previous to the one we want, and waits for enable.
+
+       For LFSRs that take several steps per cycle, at_target is set on the
+       cycle that passes the target step (see LfsrConfig.steps_passing).
     """
     def __init__(self, lfsr, target_step, *, domain='sync'):
         self.lfsr = lfsr
@@ -237,16 +306,19 @@ class LfsrWatcher(Elaboratable):
         """
         m = Module()
         lfsr = self.lfsr
-        matches_at_restart = self.target == 0
+        config = lfsr.config
+        steps = config.steps_passing(self.target)
+        matches_at_restart = 0 in steps
 
-        # Look for match on previous step when about to rollover to value at
-        # step before the target
+        # Look for match on previous cycle's step when about to rollover to
+        # value at step before the target
         about_to_match = Signal(reset=matches_at_restart)
         with m.If(lfsr.restart):
             m.d[self.domain] += about_to_match.eq(matches_at_restart)
         with m.Elif(lfsr.enable):
-            match_value = lfsr.config.value_at(self.target-1)
-            m.d[self.domain] += about_to_match.eq(lfsr.value == match_value)
+            match_values = [config.value_at(s - config.steps_per_cycle) for s in steps]
+            m.d[self.domain] += about_to_match.eq(
+                    Cat(*(lfsr.value == v for v in match_values)).any())
 
         # If were about to match, we are now matching
         m.d.comb += self.at_target.eq(about_to_match)
@@ -268,8 +340,11 @@ def watch_lfsr(m, lfsr, step, *, domain='sync', name=None):
 
 
 class LfsrTest(unittest.TestCase):
+    steps_per_cycle = 1
+
     def config_lfsr(self, num_steps, restart_value, default_enabled=True):
-        self.config = LfsrConfig.num_steps(num_steps)
+        self.config = LfsrConfig.num_steps(num_steps,
+                steps_per_cycle=self.steps_per_cycle)
         self.lfsr = Lfsr(self.config, default_enabled)
 
     def run_sim(self, process):
@@ -279,8 +354,9 @@ class LfsrTest(unittest.TestCase):
         sim.run()
 
     def check_step(self, i):
+        # i counts cycles
         val = yield self.lfsr.value
-        self.assertEqual(val, self.config.value_at(i))
+        self.assertEqual(val, self.config.value_at(i * self.steps_per_cycle))
         yield
 
     def check_cycle(self, num_steps, restart_value=1):
@@ -343,6 +419,10 @@ class LfsrTest(unittest.TestCase):
         self.run_sim(process)
 
 
+class LfsrFourStepsTest(LfsrTest):
+    steps_per_cycle = 4
+
+
 @attrs
 class Cycle(object):
     # inputs
@@ -353,6 +433,8 @@ class Cycle(object):
 
 
 class LfsrWatcherTest(unittest.TestCase):
+    steps_per_cycle = 1
+
     def setUp(self):
         self.m = m = Module()
 
@@ -368,7 +450,10 @@ class LfsrWatcherTest(unittest.TestCase):
 
     def check(self, default_enabled, target, cycle_descriptions):
         # Given a sequence of descriptions for inputs and outputs, check it matches
-        self.m.submodules.lfsr = lfsr = Lfsr.num_bits(5, default_enabled=default_enabled)
+        # Cycle steps count cycles, each of which moves steps_per_cycle steps
+        k = self.steps_per_cycle
+        self.m.submodules.lfsr = lfsr = Lfsr.num_bits(5, default_enabled=default_enabled,
+                steps_per_cycle=k)
         matched = watch_lfsr(self.m, lfsr, target)
         def process():
             for desc in cycle_descriptions:
@@ -376,10 +461,10 @@ class LfsrWatcherTest(unittest.TestCase):
                 yield lfsr.enable.eq(desc.enable)
                 yield lfsr.restart.eq(desc.restart)
                 yield
-                should_match = (desc.step % 31) == target
+                should_match = (target - desc.step * k) % 31 < k
                 #if should_match: print("should match")
                 self.assertEqual((yield matched), should_match)
-                self.assertEqual((yield lfsr.value), lfsr.config.value_at(desc.step))
+                self.assertEqual((yield lfsr.value), lfsr.config.value_at(desc.step * k))
         self.run_sim(process)
 
     def check_always_enabled(self, target):
@@ -447,5 +532,11 @@ class LfsrWatcherTest(unittest.TestCase):
     def test0_random_restart(self):
         self.check_random_restart(0)
 
+
+class LfsrWatcherThreeStepsTest(LfsrWatcherTest):
+    # 31 steps is not a multiple of 3, so targets are passed from a
+    # different step on each lap
+    steps_per_cycle = 3
+
 if __name__ == '__main__':
     unittest.main()
@@ -21,8 +21,6 @@
 from lfsr import Lfsr, LfsrConfig, watch_lfsr
 
 from nmigen import *
-from nmigen.back import verilog
-from nmigen_boards.icebreaker import ICEBreakerPlatform
 
 import argparse
 import re
@@ -125,6 +123,7 @@ EXPERIMENTS = {f.__name__: f for f in
         [Fast5Bits, Fast11Bits, Reset11a, Reset11b, Chained1, Adders]}
 
 def find_freq(experiment, seed):
+    from nmigen_boards.icebreaker import ICEBreakerPlatform
     platform = ICEBreakerPlatform()
     platform.build(experiment,
             do_program=False, 
@@ -22,17 +22,27 @@ from elab import SimpleElaboratable, SimulationTestCase
 from life_data_buffer import LifeDataBufferWrite
 
 from enum import IntEnum
+import random
 import unittest
 
 
 class LifeBufferFillerMode(IntEnum):
-    """The buffer filler can operate in several modes."""
-    # reset RAM addresses, pre-fill buffer for calculating first line, save first line for later use
+    """The buffer filler can operate in several modes.
+
+    Whatever the mode, the line at RAM address zero is saved for later use
+    when it is read.
+    """
+    # reset RAM addresses, pre-fill buffer for calculating first line
     FIRST = 0 
     # normal mode - fill one line from RAM, increment addresses
     MIDDLE = 1
     # For final line of screen, use saved first line for wrap-around
     LAST = 2 
+    # fill one line from RAM, like MIDDLE, but leave it in the spare line
+    # until control.rotate
+    AHEAD = 3
+    # keep one line as it is written to RAM, for the next frame's FIRST
+    RETAIN = 4
 
 
 class LifeBufferFillerControl(object):
@@ -41,34 +51,73 @@ class LifeBufferFillerControl(object):
         self.start = Signal(1) # Input: toggle to start processing
         self.mode = Signal(LifeBufferFillerMode) # Input: mode of operation to start
         self.finished = Signal(1) # Output: toggle indicatesfilling is finished
+        self.rotate = Signal(1) # Input: toggle to rotate the buffer after AHEAD
+        self.empty_lines = Signal(32) # Output: count of lines filled without reading RAM
 
 
 class LifeBufferFillerRam(object):
     """Interface to RAM - should be connected to RAM prior to start of processing"""
-    def __init__(self):
+    def __init__(self, width=16):
         # Output, data available one cycle later
         self.addr = Signal(16)
-        # Input: data at address specified last cycle
-        self.data = Signal(16)
+        # Output: read from addr this cycle
+        self.en = Signal()
+        # Input: RAM accepted the read. When low, the read is retried
+        self.ready = Signal(reset=1)
+        # Input: data at address accepted last cycle
+        self.data = Signal(width)
+        # Input: data being written to RAM, for RETAIN mode
+        self.write_data = Signal(width)
+        self.write_en = Signal()
+        # Output: number of line in RAM being read
+        self.line = Signal(16)
+        # Input: whether the line has any live cells, one cycle after line.
+        # Lines without are filled with zeros, without reading RAM.
+        self.occupied = Signal(reset=1)
     
 
 class LifeBufferFiller(SimpleElaboratable):
-    """Fills a LifeDataBuffer from RAM."""
-    def __init__(self, life_data_buffer_write, words_per_line, total_words):
+    """Fills a LifeDataBuffer from RAM.
+
+    In FIRST mode, the filler starts reading `generations` lines before the
+    first line in RAM, and reads three lines. Each subsequent MIDDLE mode reads
+    the next line, wrapping from the last line in RAM back to the first.
+
+    Lines are written to the buffer's spare line, which is rotated in once
+    the line is complete. In AHEAD mode, the spare line is not rotated until
+    the control's rotate input is toggled, so that the next line may be read
+    while the current lines are still in use.
+
+    In RETAIN mode, the filler keeps the next line written to RAM, rather
+    than reading RAM. When the last `retained` lines written before the end
+    of a frame are the first lines needed by the next frame, FIRST mode only
+    reads the remaining 3 - retained lines.
+
+    Lines that are known to be empty are filled with zeros, without reading
+    RAM. The control's empty_lines counts these lines.
+
+    RAM words are as wide as the LifeDataBuffer's words. words_per_line and
+    total_words count these words.
+    """
+    def __init__(self, life_data_buffer_write, words_per_line, total_words, *,
+            generations=1, retained=0):
+        assert 0 <= retained <= 3
         self.control = LifeBufferFillerControl()
-        self.ram = LifeBufferFillerRam()
+        self.ram = LifeBufferFillerRam(len(life_data_buffer_write.data))
         self.write = life_data_buffer_write
         self.words_per_line = words_per_line
         self.total_words = total_words
+        self.num_lines = total_words // words_per_line
+        self.generations = generations
+        self.retained = retained
 
         # Internal, for line handling FSM
         self.begin_line = Signal() # input
         self.ended_line = Signal() # output
 
     def build_line_fsm(self, m):
-        # Write one line to the LifeDataBuffer
+        # Write one line to the LifeDataBuffer's spare line
         # Increments self.ram.addr pointer.
-        # Toggles 'next' to buffer before writing
 
         # Always plumb read RAM data into write data
         m.d.comb += self.write.data.eq(self.ram.data)
@@ -76,65 +125,110 @@ class LifeBufferFiller(SimpleElaboratable):
         # Begin line always resets to zero unless told otherwise
         m.d.sync += self.begin_line.eq(0)
 
+        # Next RAM address, wrapping to the start of RAM
+        next_addr = Mux(self.ram.addr == self.total_words - 1, 0, self.ram.addr + 1)
+        with m.If(self.ended_line):
+            m.d.sync += self.ram.line.eq(Mux(self.ram.line == self.num_lines - 1,
+                0, self.ram.line + 1))
+
+        # Number of reads accepted by RAM, and whether there is data from a
+        # read accepted last cycle
+        requested = Signal(range(self.words_per_line + 1))
+        valid = Signal()
+        m.d.sync += valid.eq(0)
+
         with m.FSM() as one:
             with m.State("BEGIN"):
                 with m.If(self.begin_line):
-                    m.d.comb += self.write.next.eq(1) # toggle next
-                    m.next = "WAIT_1"
-            with m.State("WAIT_1"):
-                # Wait 1 cycle for first RAM data to be returned
-                m.d.sync += [
-                    self.write.addr.eq(0),
-                    self.ram.addr.eq(self.ram.addr+1),
-                ]
-                m.next = "WORKING"
+                    m.d.sync += [
+                        self.write.save.eq(self.ram.addr == 0),
+                        self.write.addr.eq(0),
+                        requested.eq(0),
+                    ]
+                    m.next = "WORKING"
             with m.State("WORKING"):
-                m.d.comb += self.write.en.eq(1),
-                m.d.sync += self.write.addr.eq(self.write.addr+1)
-
-                with m.If(self.write.addr == self.words_per_line - 1):
-                    m.d.comb += self.ended_line.eq(1)
-                    m.next = "BEGIN"
-                with m.Else():
-                    m.d.sync += self.ram.addr.eq(self.ram.addr+1)
-
+                with m.If(~self.ram.occupied):
+                    # Write zeros, moving the RAM address along as if reading
+                    m.d.comb += [
+                        self.write.data.eq(0),
+                        self.write.en.eq(1),
+                    ]
+                    m.d.sync += [
+                        self.write.addr.eq(self.write.addr + 1),
+                        self.ram.addr.eq(next_addr),
+                    ]
+                    with m.If(self.write.addr == self.words_per_line - 1):
+                        m.d.comb += self.ended_line.eq(1)
+                        m.d.sync += self.control.empty_lines.eq(self.control.empty_lines + 1)
+                        m.next = "BEGIN"
+                with m.Elif(requested != self.words_per_line):
+                    m.d.comb += self.ram.en.eq(1)
+                    with m.If(self.ram.ready):
+                        m.d.sync += [
+                            valid.eq(1),
+                            requested.eq(requested + 1),
+                            self.ram.addr.eq(next_addr),
+                        ]
+                with m.If(valid):
+                    m.d.comb += self.write.en.eq(1),
+                    m.d.sync += self.write.addr.eq(self.write.addr+1)
+                    with m.If(self.write.addr == self.words_per_line - 1):
+                        m.d.comb += self.ended_line.eq(1)
+                        m.next = "BEGIN"
 
     def handle_first(self, m):
-        # We are in first mode - read last line, first line and second line, saving first line
+        # We are in first mode - read three lines, starting `generations` lines
+        # before the first line. With one generation, that is the last line,
+        # first line and second line. Lines that were retained are skipped.
+        to_read = 3 - self.retained
+        first_line = self.generations - self.retained
         with m.FSM() as first:
             with m.State("INIT"):
-                m.d.sync += self.ram.addr.eq(self.total_words - self.words_per_line)
-                m.d.sync += self.begin_line.eq(1)
-                m.next = "READ_LAST_LINE"
-            with m.State("READ_LAST_LINE"):
-                with m.If(self.ended_line):
-                    m.d.sync += [
-                            self.ram.addr.eq(0),
-                            self.write.save.eq(1),
-                    ]
+                m.d.sync += self.ram.addr.eq(
+                        (self.total_words - first_line * self.words_per_line) % self.total_words)
+                m.d.sync += self.ram.line.eq(
+                        (self.num_lines - first_line) % self.num_lines)
+                if to_read:
                     m.d.sync += self.begin_line.eq(1)
-                    m.next = "READ_FIRST_LINE"
-            with m.State("READ_FIRST_LINE"):
-                with m.If(self.ended_line):
-                    m.d.sync += self.write.save.eq(0)
-                    m.d.sync += self.begin_line.eq(1)
-                    m.next = "READ_SECOND_LINE"
-            with m.State("READ_SECOND_LINE"):
-                with m.If(self.ended_line):
+                    m.next = "READ_LINE_0"
+                else:
                     m.d.comb += self.control.finished.eq(1)
-                    m.next = "INIT"
-
-    def handle_middle(self, m):
-        # Kick of a vanilla line read
+            for n in range(to_read):
+                with m.State(f"READ_LINE_{n}"):
+                    with m.If(self.ended_line):
+                        m.d.comb += self.write.next.eq(1)
+                        if n + 1 < to_read:
+                            m.d.sync += self.begin_line.eq(1)
+                            m.next = f"READ_LINE_{n + 1}"
+                        else:
+                            m.d.comb += self.control.finished.eq(1)
+                            m.next = "INIT"
+
+    def handle_middle(self, m, rotate):
+        # Kick of a vanilla line read, rotating the buffer at the end if asked
         with m.FSM() as middle:
             with m.State("INIT"):
                 m.d.sync += self.begin_line.eq(1)
                 m.next = "READ"
             with m.State("READ"):
                 with m.If(self.ended_line):
+                    if rotate:
+                        m.d.comb += self.write.next.eq(1)
                     m.d.comb += self.control.finished.eq(1)
                     m.next = "INIT"
 
+    def handle_retain(self, m):
+        # Write words to the spare line as they are written to RAM
+        with m.If(self.ram.write_en):
+            m.d.comb += [
+                self.write.data.eq(self.ram.write_data),
+                self.write.en.eq(1),
+            ]
+            m.d.sync += self.write.addr.eq(self.write.addr + 1)
+            with m.If(self.write.addr == self.words_per_line - 1):
+                m.d.comb += self.write.next.eq(1)
+                m.d.comb += self.control.finished.eq(1)
+
     def handle_last(self, m):
         # Just toggle next without reading data - on reading side, reader will use saved data
         m.d.comb += self.write.next.eq(1)
@@ -151,13 +245,28 @@ class LifeBufferFiller(SimpleElaboratable):
                     with m.Switch(self.control.mode):
                         with m.Case(LifeBufferFillerMode.FIRST): m.next = "FIRST"
                         with m.Case(LifeBufferFillerMode.MIDDLE): m.next = "MIDDLE"
+                        with m.Case(LifeBufferFillerMode.AHEAD): m.next = "AHEAD"
+                        with m.Case(LifeBufferFillerMode.RETAIN):
+                            m.d.sync += [
+                                self.write.addr.eq(0),
+                                self.write.save.eq(0),
+                            ]
+                            m.next = "RETAIN"
                         with m.Default(): m.next = "LAST"
             with m.State("FIRST"):
                 self.handle_first(m)
                 with m.If(self.control.finished):
                     m.next = "WAIT"
             with m.State("MIDDLE"):
-                self.handle_middle(m)
+                self.handle_middle(m, rotate=True)
+                with m.If(self.control.finished):
+                    m.next = "WAIT"
+            with m.State("AHEAD"):
+                self.handle_middle(m, rotate=False)
+                with m.If(self.control.finished):
+                    m.next = "WAIT"
+            with m.State("RETAIN"):
+                self.handle_retain(m)
                 with m.If(self.control.finished):
                     m.next = "WAIT"
             with m.State("LAST"):
@@ -165,6 +274,10 @@ class LifeBufferFiller(SimpleElaboratable):
                 with m.If(self.control.finished):
                     m.next = "WAIT"
 
+        # Rotate in a line read ahead
+        with m.If(self.control.rotate):
+            m.d.comb += self.write.next.eq(1)
+
 
 class LifeBufferFillerTest(SimulationTestCase):
     def setUp(self):
@@ -178,7 +291,8 @@ class LifeBufferFillerTest(SimulationTestCase):
         class Record:
             def __init__(self):
                 self.write_count = 0
-                self.written_data = [] # new array added every time next toggled
+                self.written_data = [] # spare line added every time next toggled
+                self.spare = [-1] * 4 # line being written
                 self.saved = [-1] * 4 # overwritten while saving
         self.buf_record = Record()
 
@@ -192,14 +306,14 @@ class LifeBufferFillerTest(SimulationTestCase):
             en = yield self.write.en
             save = yield self.write.save
             rec = self.buf_record
-            curr_data = rec.written_data[-1] if rec.written_data else None
-            if next:
-                rec.written_data.append([-1, -1, -1, -1])
             if en:
                 rec.write_count += 1
-                curr_data[addr] = data
+                rec.spare[addr] = data
                 if save:
                     rec.saved[addr] = data
+            if next:
+                rec.written_data.append(rec.spare)
+                rec.spare = [-1, -1, -1, -1]
             yield
 
     def check_buf(self, write_count, data, saved):
@@ -289,5 +403,90 @@ class LifeBufferFillerTest(SimulationTestCase):
                 ],
                 [0x000, 0x010, 0x020, 0x030])
 
+    def test_two_generations(self):
+        # Starting two lines before the first line wraps around the end of RAM
+        self.bf.generations = 2
+        def process():
+            yield from self.run_mode(LifeBufferFillerMode.FIRST)
+            yield from self.run_mode(LifeBufferFillerMode.MIDDLE)
+            yield from self.run_mode(LifeBufferFillerMode.MIDDLE)
+            yield from self.run_mode(LifeBufferFillerMode.LAST)
+        self.run_sim(process)
+        self.check_buf(20,
+                [
+                    [0x0c0, 0x0d0, 0x0e0, 0x0f0],
+                    [0x100, 0x110, 0x120, 0x130],
+                    [0x000, 0x010, 0x020, 0x030],
+                    [0x040, 0x050, 0x060, 0x070],
+                    [0x080, 0x090, 0x0a0, 0x0b0],
+                    [-1, -1, -1, -1],
+                ],
+                [0x000, 0x010, 0x020, 0x030])
+
+    def test_ahead_with_stalls(self):
+        # RAM refuses reads at random, and the line read ahead is only
+        # rotated in when asked
+        def ready_sim():
+            yield Passive()
+            rand = random.Random(0)
+            while True:
+                yield self.bf.ram.ready.eq(rand.random() < 0.6)
+                yield
+        self.extra_processes.append(ready_sim)
+        def process():
+            yield from self.run_mode(LifeBufferFillerMode.FIRST)
+            yield from self.run_mode(LifeBufferFillerMode.AHEAD)
+            yield
+            self.assertEqual(len(self.buf_record.written_data), 3)
+            self.assertEqual(self.buf_record.spare, [0x080, 0x090, 0x0a0, 0x0b0])
+            yield from self.toggle(self.bf.control.rotate)
+        self.run_sim(process)
+        self.check_buf(16,
+                [
+                    [0x100, 0x110, 0x120, 0x130],
+                    [0x000, 0x010, 0x020, 0x030],
+                    [0x040, 0x050, 0x060, 0x070],
+                    [0x080, 0x090, 0x0a0, 0x0b0],
+                ],
+                [0x000, 0x010, 0x020, 0x030])
+
+    def test_retained(self):
+        # A line written to RAM is kept, so FIRST reads only two lines
+        self.bf.retained = 1
+        ram = self.bf.ram
+        def process():
+            yield self.bf.control.mode.eq(LifeBufferFillerMode.RETAIN)
+            yield from self.toggle(self.bf.control.start)
+            for i in range(4):
+                yield ram.write_data.eq(0x500 + i)
+                yield from self.toggle(ram.write_en)
+            yield from self.run_mode(LifeBufferFillerMode.FIRST)
+        self.run_sim(process)
+        self.check_buf(12,
+                [
+                    [0x500, 0x501, 0x502, 0x503],
+                    [0x000, 0x010, 0x020, 0x030],
+                    [0x040, 0x050, 0x060, 0x070],
+                ],
+                [0x000, 0x010, 0x020, 0x030])
+
+    def test_empty_line(self):
+        # Line 0 is empty, so is filled with zeros without reading RAM
+        ram = self.bf.ram
+        self.m.d.sync += ram.occupied.eq(ram.line != 0)
+        def process():
+            yield from self.run_mode(LifeBufferFillerMode.FIRST)
+            yield from self.run_mode(LifeBufferFillerMode.MIDDLE)
+            self.assertEqual(1, (yield self.bf.control.empty_lines))
+        self.run_sim(process)
+        self.check_buf(16,
+                [
+                    [0x100, 0x110, 0x120, 0x130],
+                    [0, 0, 0, 0],
+                    [0x040, 0x050, 0x060, 0x070],
+                    [0x080, 0x090, 0x0a0, 0x0b0],
+                ],
+                [0, 0, 0, 0])
+
 if __name__ == '__main__':
     unittest.main()
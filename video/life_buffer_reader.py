@@ -19,7 +19,7 @@ from nmigen.back.pysim import Simulator, Passive
 from nmigen.utils import bits_for
 
 from elab import SimpleElaboratable, SimulationTestCase
-from life_data_buffer import LifeDataBufferRead
+from life_data_buffer import LifeDataBuffer, LifeDataBufferRead, build_memories
 
 from enum import IntEnum
 import random
@@ -29,143 +29,307 @@ from util import all_bits_list, to_number
 
 class LifeBufferReaderInterface:
     """Control Interface for the LifeBufferReader"""
-    def __init__(self):
+    def __init__(self, width=16):
         self.begin = Signal() # Input: begin reading
         self.last = Signal() # Input: processing last row
-        self.ended = Signal() # Output: all data has been presented.
+        self.hold = Signal() # Input: hold current outputs for another cycle
+        self.ended = Signal() # Output: all data has been presented
         self.valid = Signal() # Output: data is valid
         self.count = Signal(7) # Output: number of word being presented
         # Output: 3*18bit array for life calc word 
-        self.life_data = [Signal(18, name=f"life_data_{i}") for i in range(3)]
+        self.life_data = [Signal(width + 2, name=f"life_data_{i}") for i in range(3)]
         # Output: 16 bit word for video display
-        self.curr_word = Signal(16) 
+        self.curr_word = Signal(width) 
+        # Output: whether each of the three lines has any live cells
+        self.occupied = Signal(3)
 
 
 class LifeBufferReader(SimpleElaboratable):
     """Reads the 3-line buffer providing inputs to downstream processing.
         - one set of life_data - 3x18 bit words - for input to CalcLifeWord
         - one current word - for output to video
+
+    Words are as wide as the LifeDataBuffer's words, so a buffer of 32 bit words
+    gives 3x34 bit life_data. words_per_line counts these words.
+
+    While hold is high, the reader does not advance, so that the same data is
+    presented again on the next cycle.
+
+    Each line takes exactly words_per_line reads. Lines may be read back to
+    back, by asserting begin while the last word of a line is read. The
+    bits that wrap around from each end of a line are taken from the line
+    buffer along with its first word, so the line buffer may rotate as soon
+    as the last word of a line has been read: pulsing next in the cycle
+    after begin moves on to the next line with no gap.
     """
     def __init__(self, words_per_line, life_data_buffer_read):
+        assert words_per_line >= 2
         self.words_per_line = words_per_line
         self.read = life_data_buffer_read
-        self.interface = LifeBufferReaderInterface()
+        self.width = len(life_data_buffer_read.data[0])
+        self.interface = LifeBufferReaderInterface(self.width)
 
-    def build_shift_registers(self, m):
+    def build_shift_registers(self, m, fetched_first, presenting_last):
         # Build the shift registers which run every cycle to shift data in from buffer
-        shift_register = [Signal(17, name=f"sr_{i}") for i in range(3)]
-        for ld, rd, sr in zip(self.interface.life_data, self.read.data, shift_register):
-            # Output is content of shift register + high bit of read_addr
-            m.d.comb += ld[17].eq(rd[0])
-            m.d.comb += ld[:17].eq(sr)
+        # Bits that wrap around from the other end of the line come from
+        # the line buffer's registers, rather than from reading again. Both
+        # are taken as the first word is fetched, so that they belong to the
+        # same line as the data, even if the line buffer has since rotated.
+        w = self.width
+        shift_register = [Signal(w + 1, name=f"sr_{i}") for i in range(3)]
+        first_bits = [Signal(name=f"first_bit_{i}") for i in range(3)]
+        for ld, rd, sr, first_bit, read_first_bit, last_bit in zip(self.interface.life_data,
+                self.read.data, shift_register, first_bits, self.read.first_bit,
+                self.read.last_bit):
+            with m.If(fetched_first):
+                m.d.sync += first_bit.eq(read_first_bit)
+            # Output is content of shift register + low bit of read data
+            m.d.comb += ld[w + 1].eq(Mux(presenting_last, first_bit, rd[0]))
+            m.d.comb += ld[:w + 1].eq(sr)
             # Move SR along and shift in read_data for next cycle
-            m.d.sync += sr[0].eq(sr[16])
+            m.d.sync += sr[0].eq(Mux(fetched_first, last_bit, sr[w]))
             m.d.sync += sr[1:].eq(rd)
 
+    def elaborate(self, platform):
+        return EnableInserter(~self.interface.hold)(super().elaborate(platform))
+
     def elab(self, m):
-        self.build_shift_registers(m)
-        m.d.comb += self.interface.curr_word.eq(self.interface.life_data[1][1:17])
-        m.d.comb += self.read.saved.eq(self.interface.last)
-
-        # we need to read words N-1, 0, 1, 2 ... N-1, 0 for a total of N+2 words
-        with m.FSM() as fsm:
-            with m.State("WAIT"):
-                # Wait for begin signal
-                # Count is at words_per_line - 2
-                with m.If(self.interface.begin):
-                    m.d.sync += self.read.addr.eq(self.words_per_line - 1)
-                    m.d.sync += self.interface.count.eq(0)
-                    m.next = "READ_N-1"
-            with m.State("READ_N-1"):
-                # Unknown word in data register. Reading N-1. Read word 0 next cycle.
-                m.d.sync += self.read.addr.eq(0)
-                m.next = "READ_0"
-            with m.State("READ_0"):
-                # N-1 in data register. Reading word 0. Read word 1 next cycle
-                # Tee up word 1
-                m.d.sync += self.read.addr.eq(1)
-                m.next = "READ_1"
-            with m.State("READ_1"):
-                # 0 in data register, now reading word 1. Read word 2 next cycle
-                m.d.sync += self.read.addr.eq(2)
-                m.next = "LOOP"
-            with m.State("LOOP"):
-                # Stable state: Valid data. Keep asking for next data word until
-                # read words N-1 and 0 for the second time
-                m.d.comb += self.interface.valid.eq(1)
-                count = self.interface.count
-                m.d.sync += count.eq(count+1)
-                with m.If(count == self.words_per_line-3):
-                    m.d.sync += self.read.addr.eq(0)
-                with m.Else():
-                    m.d.sync += self.read.addr.eq(count+3)
-                with m.If(count == self.words_per_line - 1):
-                    m.next = "ENDED"
-            with m.State("ENDED"):
-                m.d.comb += self.interface.ended.eq(1)
-                m.next = "WAIT"
+        interface = self.interface
+        count = interface.count
+        last_addr = self.words_per_line - 1
+        m.d.comb += self.read.saved.eq(interface.last)
+        m.d.comb += interface.occupied.eq(Cat(*self.read.occupied))
+        m.d.comb += self.read.en.eq(~interface.hold)
+
+        # We read words 0, 1, 2 ... N-1. Each word is in the read data
+        # register one cycle after it is read, and presented the cycle after
+        # that, alongside the low bit of the following word.
+        reading = Signal() # read.addr is being read
+        fetched = Signal() # read.data holds a word
+        fetched_first = Signal() # read.data holds word 0
+        m.d.sync += [
+            fetched.eq(reading),
+            fetched_first.eq(reading & (self.read.addr == 0)),
+            interface.valid.eq(fetched),
+            interface.ended.eq(interface.valid & (count == last_addr)),
+        ]
+        with m.If(fetched):
+            m.d.sync += count.eq(Mux(fetched_first, 0, count + 1))
+        self.build_shift_registers(m, fetched_first, count == last_addr)
+        m.d.comb += interface.curr_word.eq(interface.life_data[1][1:self.width + 1])
+
+        with m.If(reading):
+            m.d.sync += self.read.addr.eq(self.read.addr + 1)
+            with m.If(self.read.addr == last_addr):
+                m.d.sync += reading.eq(0)
+        # The next line may begin as the last word of this line is read
+        with m.If(interface.begin & (~reading | (self.read.addr == last_addr))):
+            m.d.sync += [
+                self.read.addr.eq(0),
+                reading.eq(1),
+            ]
 
 
 class LifeBufferReaderTest(SimulationTestCase):
+    width = 16
+    num_words = 8
+
     def setUp(self):
-        self.read = LifeDataBufferRead()
-        self.lbr = LifeBufferReader(8, self.read)
+        self.read = LifeDataBufferRead(self.width)
+        self.lbr = LifeBufferReader(self.num_words, self.read)
         self.add(self.lbr)
         self.extra_processes += [self.buf_sim]
         self.generate_data() # Ensure some data exists
 
     def generate_data(self, seed=1):
-        # Data is of the form of 3 lists of 8 elements
+        # Data is of the form of 3 lists of num_words elements
         random.seed(seed)
-        self.data_words = [[random.randrange(65536) for _ in range(8)] for _ in range(3)]
-        self.data_bits = [all_bits_list(l) for l in self.data_words]
+        self.data_words = [[random.randrange(2 ** self.width) for _ in range(self.num_words)]
+                for _ in range(3)]
+        self.data_bits = [all_bits_list(l, self.width) for l in self.data_words]
 
     def buf_sim(self):
         yield Passive()
         while True:
             addr = yield self.read.addr
+            if (yield self.read.en):
+                for i in range(3):
+                    # Reads beyond the end of the line return rubbish
+                    words = self.data_words[i]
+                    yield self.read.data[i].eq(words[addr] if addr < len(words) else 0x5a5a)
             for i in range(3):
-                yield self.read.data[i].eq(self.data_words[i][addr%8])
+                words = self.data_words[i]
+                yield self.read.first_bit[i].eq(words[0] & 1)
+                yield self.read.last_bit[i].eq(words[-1] >> (self.width - 1))
             yield
 
     def check_life_data(self, addr):
+        w = self.width
         for i in range(3):
             expected = to_number([
-                    self.data_bits[i][addr * 16 - 1],
-                    *self.data_bits[i][addr * 16 : (addr+1) * 16],
-                    self.data_bits[i][((addr+1) * 16) % (8*16)]])
+                    self.data_bits[i][addr * w - 1],
+                    *self.data_bits[i][addr * w : (addr+1) * w],
+                    self.data_bits[i][((addr+1) * w) % (self.num_words * w)]])
             actual = yield self.lbr.interface.life_data[i]
-            if actual != expected:
-                breakpoint()
             self.assertEqual(expected, actual)
 
-    def test(self):
+    def check_line(self, repeat=1):
+        # Reads one line, expecting each word repeat times
         lbr_if = self.lbr.interface
+        yield
+        yield
+        yield from self.toggle(lbr_if.begin)
+        while not (yield lbr_if.valid):
+            yield
+        for i in range(self.num_words):
+            for _ in range(repeat):
+                self.assertTrue((yield lbr_if.valid))
+                self.assertEqual(i, (yield lbr_if.count))
+                self.assertEqual(self.data_words[1][i], (yield lbr_if.curr_word))
+                yield from self.check_life_data(i)
+                yield
+
+        self.assertFalse((yield lbr_if.valid))
+        self.assertTrue((yield lbr_if.ended))
+        yield
+        self.assertFalse((yield lbr_if.valid))
+        self.assertFalse((yield lbr_if.ended))
+        yield
+
+    def test(self):
         num_cycles = 20
         def process():
-            
             for cycle in range(num_cycles):
                 self.generate_data(cycle)
+                yield from self.check_line()
+
+        self.run_sim(process)
+
+    def test_hold(self):
+        # Hold each valid word for one extra cycle
+        lbr_if = self.lbr.interface
+        held = Signal()
+        self.m.d.sync += held.eq(lbr_if.hold)
+        self.m.d.comb += lbr_if.hold.eq(lbr_if.valid & ~held)
+        def process():
+            for cycle in range(3):
+                self.generate_data(cycle)
+                yield from self.check_line(repeat=2)
+
+        self.run_sim(process)
+
+    def test_back_to_back(self):
+        # Begin held high reads line after line, with no gap between them
+        lbr_if = self.lbr.interface
+        def process():
+            yield lbr_if.begin.eq(1)
+            while not (yield lbr_if.valid):
                 yield
-                yield
-                yield from self.toggle(lbr_if.begin)
-                while not (yield lbr_if.valid):
-                    yield
-                for i in range(8):
+            for line in range(3):
+                for i in range(self.num_words):
                     self.assertTrue((yield lbr_if.valid))
                     self.assertEqual(i, (yield lbr_if.count))
                     self.assertEqual(self.data_words[1][i], (yield lbr_if.curr_word))
                     yield from self.check_life_data(i)
                     yield
 
-                self.assertFalse((yield lbr_if.valid))
-                self.assertTrue((yield lbr_if.ended))
-                yield
-                self.assertFalse((yield lbr_if.valid))
-                self.assertFalse((yield lbr_if.ended))
+        self.run_sim(process)
+
+
+class LifeBufferReader32Test(LifeBufferReaderTest):
+    width = 32
+    num_words = 2
+
+
+class LifeBufferReaderRotateTest(SimulationTestCase):
+    """Reads lines back to back from a LifeDataBuffer that rotates between
+    them."""
+    width = 16
+    num_words = 8
+
+    def setUp(self):
+        read_ports, write_ports = build_memories(self.m, self.num_words, width=self.width)
+        self.ldb = LifeDataBuffer(read_ports, write_ports)
+        self.add(self.ldb)
+        self.lbr = LifeBufferReader(self.num_words, self.ldb.read)
+        self.add(self.lbr)
+
+        # Rotates while filling the buffer
+        self.fill_next = Signal()
+        # Also rotate once, in the cycle after the last word of the first line
+        # is read, as the first word of the next line is read
+        read = self.ldb.read
+        seen_last = Signal()
+        rotate = Signal()
+        rotated = Signal()
+        with self.m.If(read.addr == self.num_words - 1):
+            self.m.d.sync += seen_last.eq(1)
+        self.m.d.comb += [
+                rotate.eq(seen_last & ~rotated & (read.addr == 0)),
+                self.ldb.write.next.eq(self.fill_next | rotate),
+        ]
+        with self.m.If(rotate):
+            self.m.d.sync += rotated.eq(1)
+
+    def generate_lines(self, num_lines):
+        # Each line's end bits differ from the line before's
+        lines = []
+        top = self.width - 1
+        for n in range(num_lines):
+            line = [random.randrange(2 ** self.width) for _ in range(self.num_words)]
+            if lines:
+                prev = lines[-1]
+                line[0] = (line[0] & ~1) | (~prev[0] & 1)
+                line[-1] = (line[-1] & ~(1 << top)) | (~prev[-1] & (1 << top))
+            lines.append(line)
+        return lines
+
+    def write_line(self, line):
+        write = self.ldb.write
+        for addr, data in enumerate(line):
+            yield write.addr.eq(addr)
+            yield write.data.eq(data)
+            yield from self.toggle(write.en)
+
+    def check_line(self, lines):
+        # Checks one line of output, from the given three lines of words
+        lbr_if = self.lbr.interface
+        w = self.width
+        bits = [all_bits_list(l, w) for l in lines]
+        for addr in range(self.num_words):
+            self.assertTrue((yield lbr_if.valid))
+            self.assertEqual(addr, (yield lbr_if.count))
+            self.assertEqual(lines[1][addr], (yield lbr_if.curr_word))
+            for i in range(3):
+                expected = to_number([
+                        bits[i][addr * w - 1],
+                        *bits[i][addr * w : (addr+1) * w],
+                        bits[i][((addr+1) * w) % (self.num_words * w)]])
+                self.assertEqual(expected, (yield self.lbr.interface.life_data[i]))
+            yield
+
+    def test_back_to_back(self):
+        random.seed(1)
+        l0, l1, l2, l3, l4 = self.generate_lines(5)
+        def process():
+            # Fill the buffer so l1, l2 and l3 are read, with l4 in the spare
+            for line in [l0, l1, l2, l3]:
+                yield from self.write_line(line)
+                yield from self.toggle(self.fill_next)
+            yield from self.write_line(l4)
+
+            yield self.lbr.interface.begin.eq(1)
+            while not (yield self.lbr.interface.valid):
                 yield
+            yield from self.check_line([l1, l2, l3])
+            yield from self.check_line([l2, l3, l4])
+
+        self.run_sim(process)
+
 
-        self.run_sim(process, write_trace=True )
+class LifeBufferReaderRotate32Test(LifeBufferReaderRotateTest):
+    width = 32
+    num_words = 2
 
 
 if __name__ == '__main__':
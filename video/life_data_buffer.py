@@ -24,12 +24,12 @@ import unittest
 
 class LifeDataBufferWrite(object):
     """Write interface for LifeDataBuffer.
-       Writes to last line of the LifeDataBuffer
+       Writes to the spare line of the LifeDataBuffer
     """
-    def __init__(self):
+    def __init__(self, width=16):
         self.next = Signal() # Rotate buffers. Takes effect next cycle.
         self.addr = Signal(7, name='w_addr') # Address to write
-        self.data = Signal(16, name='w_data') # Data to write at address
+        self.data = Signal(width, name='w_data') # Data to write at address
         self.en = Signal() # Write enable
         self.save = Signal() # When high, also save data as well as regular write
 
@@ -37,18 +37,25 @@ class LifeDataBufferRead(object):
     """Read interface for LifeDataBuffer.
        Simultaneously reads three lines of data.
     """
-    def __init__(self):
+    def __init__(self, width=16):
         self.addr = Signal(7, name='r_addr') # Address to read. Data appears one cycle later
-        self.data = [Signal(16, name=f'r_data{i}') for i in range(3)] # Data
+        self.data = [Signal(width, name=f'r_data{i}') for i in range(3)] # Data
         self.saved = Signal() # When high, last data replaced with saved data
+        self.en = Signal(reset=1) # When low, data holds its value next cycle
+        # Bit 0 of the first word, and top bit of the last word, of each line
+        self.first_bit = [Signal(name=f'r_first_bit{i}') for i in range(3)]
+        self.last_bit = [Signal(name=f'r_last_bit{i}') for i in range(3)]
+        # Whether each line has any bits set
+        self.occupied = [Signal(name=f'r_occupied{i}') for i in range(3)]
 
 class LifeDataBuffer(SimpleElaboratable):
     """Buffers words of cell data for the life simulation.
     
     A LifeDataBuffer provides simultaneous read access to three lines of data, up to
-    128 16 bit words wide. New data can be written to the last of the 3 lines.
-    When the "next" signal is enabled, the buffers rotate so the last line
-    becomes the second, the second line becomes the first, and the first line becomes the last.
+    128 16 bit words wide. A fourth, spare line may be written while the three
+    lines are read. When the "next" signal is enabled, the buffers rotate so
+    the spare line becomes the last, the last line becomes the second, the
+    second line becomes the first, and the first line becomes the spare.
 
     The LifeDataBuffer's purpose is to provide words of pixel/cell data that
     will later be formatted for a LifeCalcWord module.
@@ -56,73 +63,115 @@ class LifeDataBuffer(SimpleElaboratable):
     A single line of data can be saved and later substituted as the last line.
     This is used to implement wrapping between bottom and top of the screen.
 
-    This class is implemented with 4 16bitx128word memories.
+    The bits at each end of each line are kept in registers as they are
+    written, so that wrapping between the left and right of the screen does
+    not need extra reads. Lines must be written in address order, so that
+    the last word written is the last word of the line. Likewise, a register
+    records whether any bit of each line is set.
+
+    This class is implemented with 5 16bitx128word memories. Memories may
+    also be wider, for example 32 bits to hold two words of cell data at each
+    address.
     """
     def __init__(self, read_ports, write_ports):
         """Constructor.
 
-        This class is implemented as interface to 4 memories which are read in parallel in various ways.
+        This class is implemented as interface to 5 memories which are read in parallel in various ways.
            
-        :param read_ports: 4 memory read ports
-        :param write_ports: 4 memory write ports corresponding to the read_ports
+        :param read_ports: 5 memory read ports
+        :param write_ports: 5 memory write ports corresponding to the read_ports
         """
         self.read_ports = read_ports
         self.write_ports = write_ports
-        self.read = LifeDataBufferRead()
-        self.write = LifeDataBufferWrite()
+        width = len(write_ports[0].data)
+        self.read = LifeDataBufferRead(width)
+        self.write = LifeDataBufferWrite(width)
 
     def connect_addresses(self, m):
-        # Wire up addresses - All 4 BRAMs share read and write addresses + write data
-        for i in range(4):
+        # Wire up addresses - All 5 BRAMs share read and write addresses + write data
+        for i in range(5):
             m.d.comb += [
                 self.read_ports[i].addr.eq(self.read.addr),
+                self.read_ports[i].en.eq(self.read.en),
                 self.write_ports[i].addr.eq(self.write.addr),
                 self.write_ports[i].data.eq(self.write.data),
             ]
 
     def handle_reads(self, m, pos):
         """Handle read interface when self.pos == pos, where pos is constant"""
-        m.d.comb += self.read.data[0].eq(self.read_ports[(pos + 0) % 3].data)
-        m.d.comb += self.read.data[1].eq(self.read_ports[(pos + 1) % 3].data)
+        m.d.comb += self.read.data[0].eq(self.read_ports[(pos + 0) % 4].data)
+        m.d.comb += self.read.data[1].eq(self.read_ports[(pos + 1) % 4].data)
         m.d.comb += self.read.data[2].eq(Mux(self.read.saved, 
-            self.read_ports[3].data,
-            self.read_ports[(pos + 2) % 3].data))
+            self.read_ports[4].data,
+            self.read_ports[(pos + 2) % 4].data))
+        for i in range(2):
+            m.d.comb += self.read.first_bit[i].eq(self.first_bits[(pos + i) % 4])
+            m.d.comb += self.read.last_bit[i].eq(self.last_bits[(pos + i) % 4])
+        m.d.comb += self.read.first_bit[2].eq(Mux(self.read.saved,
+            self.first_bits[4], self.first_bits[(pos + 2) % 4]))
+        m.d.comb += self.read.last_bit[2].eq(Mux(self.read.saved,
+            self.last_bits[4], self.last_bits[(pos + 2) % 4]))
+        for i in range(2):
+            m.d.comb += self.read.occupied[i].eq(self.occupied[(pos + i) % 4])
+        m.d.comb += self.read.occupied[2].eq(Mux(self.read.saved,
+            self.occupied[4], self.occupied[(pos + 2) % 4]))
 
     def handle_writes(self, m, pos):
         """Handle write interface when self.pos == pos, where pos is constant"""
         with m.If(self.write.next):
-            m.d.sync += self.pos.eq((pos + 1) % 3)
+            m.d.sync += self.pos.eq((pos + 1) % 4)
 
         with m.If(self.write.en):
-            m.d.comb += self.write_ports[(pos + 2) % 3].en.eq(1)
-            m.d.comb += self.write_ports[3].en.eq(self.write.save)
+            m.d.comb += self.write_ports[(pos + 3) % 4].en.eq(1)
+            m.d.comb += self.write_ports[4].en.eq(self.write.save)
+            self.capture_line_bits(m, (pos + 3) % 4)
+            with m.If(self.write.save):
+                self.capture_line_bits(m, 4)
+
+    def capture_line_bits(self, m, line):
+        """Keep the end bits of data written to the given memory, and
+        whether any bits are set"""
+        data = self.write.data
+        with m.If(self.write.addr == 0):
+            m.d.sync += self.first_bits[line].eq(data[0])
+            m.d.sync += self.occupied[line].eq(data.any())
+        with m.Else():
+            m.d.sync += self.occupied[line].eq(self.occupied[line] | data.any())
+        m.d.sync += self.last_bits[line].eq(data[-1])
 
     def elab(self, m):
-        # Current position in three buffers - range 0..2
+        # Current position in four buffers - range 0..3
         self.pos = Signal(2)
+        # End bits of each memory's line
+        self.first_bits = [Signal(name=f'first_bit{i}') for i in range(5)]
+        self.last_bits = [Signal(name=f'last_bit{i}') for i in range(5)]
+        self.occupied = [Signal(name=f'occupied{i}') for i in range(5)]
         self.connect_addresses(m)
 
         # Each value of pos causes buffers to be wired differently
-        for p in range(3):
+        for p in range(4):
             with m.If(self.pos == p):
                 self.handle_writes(m, p)
                 self.handle_reads(m, p)
 
 
-def build_memories(m, depth):
+def build_memories(m, depth, *, width=16, prefix=''):
     """Builds memories suitable for use with the LifeDataBuffer.
         m - module to add the memories to
         depth - size of memory
+        width - width of each memory word
+        prefix - prefix for memory and submodule names, to allow more than one
+            set of memories in a module
         Returns a pair of lists: (read_ports, write_ports)
     """
-    memories = [Memory(width=16, depth=128, name=f"line_buffer_{i}")
-            for i in range(4)]
+    memories = [Memory(width=width, depth=128, name=f"{prefix}line_buffer_{i}")
+            for i in range(5)]
     read_ports = [mem.read_port(transparent=False) for mem in memories]
     for i, rp in enumerate(read_ports):
-        m.submodules[f"ldb_read{i}"] = rp
+        m.submodules[f"{prefix}ldb_read{i}"] = rp
     write_ports = [mem.write_port() for mem in memories]
     for i, wp in enumerate(write_ports):
-        m.submodules[f"ldb_write{i}"] = wp
+        m.submodules[f"{prefix}ldb_write{i}"] = wp
     return read_ports, write_ports
 
 
@@ -152,21 +201,26 @@ class LifeDataBufferTest(SimulationTestCase):
         for addr in range(4):
             values = [line[addr] for line in lines]
             yield from self.check(addr, values)
+        for line, first, last, occupied in zip(lines, self.ldb.read.first_bit,
+                self.ldb.read.last_bit, self.ldb.read.occupied):
+            self.assertEqual(line[0] & 1, (yield first))
+            self.assertEqual(line[3] >> 15, (yield last))
+            self.assertEqual(any(line), (yield occupied))
 
     def test_next(self):
         # Just working with addr 0, check that next works
         def process():
             # Write unique value into addr 0 of each line
-            for i in range(3):
-                yield from self.toggle(self.ldb.write.next)
+            for i in range(4):
                 yield from self.write(0, i)
+                yield from self.toggle(self.ldb.write.next)
 
             # Read back, using next to rotate buffer
-            yield from self.check(0, [0, 1, 2])
+            yield from self.check(0, [1, 2, 3])
             yield from self.toggle(self.ldb.write.next)
-            yield from self.check(0, [1, 2, 0])
+            yield from self.check(0, [2, 3, 0])
             yield from self.toggle(self.ldb.write.next)
-            yield from self.check(0, [2, 0, 1])
+            yield from self.check(0, [3, 0, 1])
             yield from self.toggle(self.ldb.write.next)
             yield from self.check(0, [0, 1, 2])
 
@@ -179,8 +233,8 @@ class LifeDataBufferTest(SimulationTestCase):
         def process():
             for line_no in range(num_lines):
                 # Write data
-                yield from self.toggle(self.ldb.write.next)
                 yield from self.write_line(all_lines[line_no])
+                yield from self.toggle(self.ldb.write.next)
 
                 # Check that is was as expected
                 l0 = all_lines[line_no-2] if line_no >= 2 else [0, 0, 0, 0]
@@ -192,7 +246,7 @@ class LifeDataBufferTest(SimulationTestCase):
 
     def test_save(self):
         # Write 4 lines, saving the first, then sub back in the first
-        l0, l1, l2, l3 = [[random.randrange(65536) for _ in range(4)] for _ in range(4)]
+        l0, l1, l2, l3, l4 = [[random.randrange(65536) for _ in range(4)] for _ in range(5)]
         def process():
             yield self.ldb.write.save.eq(1)
             yield from self.write_line(l0)
@@ -203,6 +257,10 @@ class LifeDataBufferTest(SimulationTestCase):
             yield from self.write_line(l2)
             yield from self.toggle(self.ldb.write.next)
             yield from self.write_line(l3)
+            yield from self.toggle(self.ldb.write.next)
+
+            # Reads do not see the spare line while it is written
+            yield from self.write_line(l4)
 
             yield from self.check_lines([l1, l2, l3])
             yield self.ldb.read.saved.eq(1)
@@ -213,9 +271,20 @@ class LifeDataBufferTest(SimulationTestCase):
             yield from self.check_lines([l2, l3, l0])
             yield self.ldb.read.saved.eq(0)
             yield
-            yield from self.check_lines([l2, l3, l1])
+            yield from self.check_lines([l2, l3, l4])
 
-        self.run_sim(process, write_trace=True)
+        self.run_sim(process)
+
+    def test_occupied(self):
+        # Lines are occupied if any word is non-zero
+        l0, l1, l2 = [0, 0, 0, 0], [0, 0, 0x100, 0], [0, 0, 0, 0]
+        def process():
+            for line in [[1, 2, 3, 4], l0, l1, l2]:
+                yield from self.write_line(line)
+                yield from self.toggle(self.ldb.write.next)
+            yield from self.check_lines([l0, l1, l2])
+
+        self.run_sim(process, write_trace=False)
 
 if __name__ == '__main__':
     unittest.main()
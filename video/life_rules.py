@@ -13,7 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Evaluates Conway's game of Life
+"""Evaluates Conway's game of Life, and other outer totalistic rules
+
+Rules are 18 bit masks. Bit n, for n from 0 to 8, is set if a dead cell with
+n live neighbours is born. Bit 9 + n is set if a live cell with n live
+neighbours survives.
 """
 from util import to_bit_list
 
@@ -27,20 +31,41 @@ import random
 import unittest
 
 
-def life_cell(bits):
+def parse_rule(rule):
+    """Returns the mask for a rule written like 'B3/S23'."""
+    birth, survive = rule.upper().split('/')
+    assert birth[0] == 'B' and survive[0] == 'S'
+    return (sum(1 << int(n) for n in birth[1:]) |
+            sum(1 << (9 + int(n)) for n in survive[1:]))
+
+
+LIFE_RULE = parse_rule('B3/S23')
+
+# Some rules that are interesting to watch
+RULES = {
+    'Life': LIFE_RULE,
+    'HighLife': parse_rule('B36/S23'),
+    'DayAndNight': parse_rule('B3678/S34678'),
+    'Seeds': parse_rule('B2/S'),
+    'LifeWithoutDeath': parse_rule('B3/S012345678'),
+    'Maze': parse_rule('B3/S12345'),
+}
+
+
+def life_cell(bits, rule=LIFE_RULE):
     """Calculate a single cell.
        Input is 9 bits - 3x3 cell
     """
-    total = sum(bits)
-    return int(total == 3 or (bits[4] and total == 4))
+    neighbours = sum(bits) - bits[4]
+    return (rule >> (neighbours + (9 if bits[4] else 0))) & 1
 
-def life_row(a, b, c):
+def life_row(a, b, c, rule=LIFE_RULE):
     """Evaluate a row.
        input is 3 rows of n+2 items
        output is n items representing next generation of center row.
     """
     assert len(a) == len(b) == len(c)
-    return [life_cell(a[i-1:i+2] + b[i-1:i+2] + c[i-1:i+2])
+    return [life_cell(a[i-1:i+2] + b[i-1:i+2] + c[i-1:i+2], rule)
         for i in range(1, len(a)-1)]
             
 
@@ -62,83 +87,268 @@ class LifeRulesTest(unittest.TestCase):
                     [1, 1, 0, 1, 0, 1, 0, 0, 1]),
                        [0, 0, 1, 0, 1, 0, 1])
 
+    def test_parse_rule(self):
+        self.assertEqual(LIFE_RULE, (1 << 3) | (1 << 11) | (1 << 12))
+        self.assertEqual(parse_rule('b2/s'), 1 << 2)
+
+    def test_high_life(self):
+        # Six neighbours gives birth in HighLife, but not in Life
+        bits = [1, 1, 1, 0, 0, 0, 1, 1, 1]
+        self.assertEqual(life_cell(bits), 0)
+        self.assertEqual(life_cell(bits, RULES['HighLife']), 1)
+
+
+def full_add(a, b, c):
+    """Returns (sum, carry) of three bits"""
+    return a ^ b ^ c, (a & b) | (a & c) | (b & c)
+
+
+def register_stage(m, stages, stage, values, prefix):
+    """Registers values if stage is within the first `stages` pipeline stages.
+
+    Returns the values to use for the rest of the calculation.
+    """
+    if stages < stage:
+        return values
+    registered = [Signal(name=f"{prefix}{stage}_{n}") for n in range(len(values))]
+    m.d.sync += [r.eq(v) for r, v in zip(registered, values)]
+    return registered
+
+
+def is_alive(m, stages, ones, twos, center, rule, prefix):
+    """Returns whether a cell is alive in the next generation.
+
+    ones and twos are three bits each, the counts of ones and twos from the
+    first level of carry-save adders. center is the current cell, and rule
+    the 18 bit rule mask. Register stage 2, if any, is placed after the
+    second level of adders.
+    """
+    one, two_a = full_add(*ones)
+    two_b, four = full_add(*twos)
+    # Total is one + 2 * (two_a + two_b) + 4 * four
+    one, two_a, two_b, four, center = register_stage(m, stages, 2,
+            [one, two_a, two_b, four, center], prefix)
+    total = Cat(one, two_a ^ two_b, (two_a & two_b) ^ four, two_a & two_b & four)
+    # Total includes the center cell, so a live cell looks up total - 1
+    births = Cat(rule[0:9], C(0, 1))
+    survivals = Cat(C(0, 1), rule[9:18])
+    return Mux(center, survivals, births).bit_select(total, 1)
+
 
 class CalcLifeCell(Elaboratable):
-    """An evaluator for a single cell"""
-    def __init__(self):
+    """An evaluator for a single cell
+
+    The 9 input bits are counted with two levels of carry-save adders, leaving
+    a count of ones, twos and fours that selects a bit of the rule.
+
+    stages: number of register stages, 0 to 2. The output is available stages
+    cycles after the input. With 1 stage, registers are placed after the first
+    level of adders, and with 2, also after the second.
+    """
+    MAX_STAGES = 2
+
+    def __init__(self, stages=0):
+        assert 0 <= stages <= self.MAX_STAGES
+        self.stages = stages
         # Inputs - 3x3
         self.input = Signal(9)
+        self.rule = Signal(18, reset=LIFE_RULE)
         # Output 
         self.output = Signal()
 
     def elaborate(self, platform):
         m = Module()
-        total = Signal(4)
         i = [self.input[n] for n in range(9)]
-        m.d.comb += [
-            total.eq(sum(i)),
-            self.output.eq((total == 3) | (i[4] & (total == 4)))
-        ]
+
+        # First level: each row of three bits gives a one and a two
+        rows = [full_add(*i[n:n + 3]) for n in range(0, 9, 3)]
+        values = register_stage(m, self.stages, 1,
+                [s for s, _ in rows] + [c for _, c in rows] + [i[4]], "stage")
+        ones, twos, center = values[0:3], values[3:6], values[6]
+
+        # Second level
+        m.d.comb += self.output.eq(is_alive(m, self.stages, ones, twos, center,
+                self.rule, "stage"))
         return m
 
 
 class CalcLifeCellTest(unittest.TestCase):
+    stages = 0
+
     def test_one_rule(self):
-        calc = CalcLifeCell()
+        self.check_rule(LIFE_RULE)
+
+    def test_other_rules(self):
+        for rule in RULES.values():
+            self.check_rule(rule)
+
+    def check_rule(self, rule):
+        calc = CalcLifeCell(self.stages)
         def process():
-            for i in range(512):
-                yield calc.input.eq(i)
-                yield Settle()
-                expected = life_cell(to_bit_list(i, width=9))
-                self.assertEqual((yield calc.output), expected)
+            yield calc.rule.eq(rule)
+            for i in range(512 + self.stages):
+                if i < 512:
+                    yield calc.input.eq(i)
+                if self.stages:
+                    yield
+                else:
+                    yield Settle()
+                n = i - self.stages
+                if n >= 0:
+                    expected = life_cell(to_bit_list(n, width=9), rule)
+                    self.assertEqual((yield calc.output), expected)
 
         sim = Simulator(calc)
-        #sim.add_clock(1) # 1Hz for simplicity of counting
-        sim.add_process(process)
+        if self.stages:
+            sim.add_clock(1) # 1Hz for simplicity of counting
+            sim.add_sync_process(process)
+        else:
+            sim.add_process(process)
         sim.run()
 
 
+class CalcLifeCellOneStageTest(CalcLifeCellTest):
+    stages = 1
+
+
+class CalcLifeCellTwoStageTest(CalcLifeCellTest):
+    stages = 2
+
+
 class CalcLifeWord(Elaboratable):
-    """An evaluator for 16 life cells in parallel"""
-    def __init__(self):
-        # 3 rows of 18 bits for input
-        self.input = [Signal(18) for _ in range(3)]
-        # Next generation of middle 16 bits
-        self.output = Signal(16)
+    """An evaluator for 16 (or width) life cells in parallel
+
+    stages: number of register stages in each CalcLifeCell. The output is
+    available stages cycles after the input.
+    """
+    def __init__(self, width=16, stages=0):
+        self.width = width
+        self.stages = stages
+        # 3 rows of width + 2 bits for input
+        self.input = [Signal(width + 2) for _ in range(3)]
+        self.rule = Signal(18, reset=LIFE_RULE)
+        # Next generation of middle width bits
+        self.output = Signal(width)
 
     def elaborate(self, platform):
         m = Module()
-        for i in range(16):
-            cell = CalcLifeCell()
+        for i in range(self.width):
+            cell = CalcLifeCell(self.stages)
             m.submodules[f"cell_{i}"] = cell
+            m.d.comb += cell.rule.eq(self.rule)
             m.d.comb += cell.input.eq(Cat(
                 self.input[0][i:i+3], self.input[1][i:i+3], self.input[2][i:i+3]))
             m.d.comb += self.output[i].eq(cell.output),
         return m
 
 class CalcLifeWordTest(unittest.TestCase):
+    calc_class = CalcLifeWord
+    width = 16
+    stages = 0
+    rule = LIFE_RULE
 
-    def check(self, inputs):
-        c = CalcLifeWord()
+    def check(self, *all_inputs):
+        # Checks each set of three input rows, all in one simulation
+        c = self.calc_class(self.width, self.stages)
         sim = Simulator(c)
-        expected = life_row(*(to_bit_list(i, 18) for i in inputs))
         def process():
-            for ci, val in zip(c.input, inputs):
-                yield ci.eq(val)
-            yield Settle()
-            actual = yield c.output
-            self.assertEqual(to_bit_list(actual), expected)
+            yield c.rule.eq(self.rule)
+            for n in range(len(all_inputs) + self.stages):
+                if n < len(all_inputs):
+                    for ci, val in zip(c.input, all_inputs[n]):
+                        yield ci.eq(val)
+                if self.stages:
+                    yield
+                else:
+                    yield Settle()
+                if n >= self.stages:
+                    inputs = all_inputs[n - self.stages]
+                    expected = life_row(*(to_bit_list(i, self.width + 2) for i in inputs),
+                            self.rule)
+                    actual = yield c.output
+                    self.assertEqual(to_bit_list(actual, self.width), expected)
 
-        sim.add_process(process)
+        if self.stages:
+            sim.add_clock(1)
+            sim.add_sync_process(process)
+        else:
+            sim.add_process(process)
         sim.run()
 
     def test_simple(self):
-        self.check([0, 0, 0])
-        self.check([0x3ffff, 0x3ffff, 0x3ffff])
+        ones = 2 ** (self.width + 2) - 1
+        self.check([0, 0, 0], [ones, ones, ones])
 
     def test_random(self):
-        for _ in range(50):
-            self.check([random.randrange(2**18) for _ in range(3)])
+        self.check(*([random.randrange(2 ** (self.width + 2)) for _ in range(3)]
+                for _ in range(50)))
+
+
+class CalcLifeWord32Test(CalcLifeWordTest):
+    width = 32
+
+
+class CalcLifeWordHighLifeTest(CalcLifeWordTest):
+    rule = RULES['HighLife']
+
+
+class CalcLifeWordColumns(Elaboratable):
+    """An evaluator for 16 (or width) life cells in parallel, with the same
+    interface as CalcLifeWord.
+
+    Rather than each cell adding up its own 3x3 window, each of the width + 2
+    columns of three cells is added up once, and each cell adds the sums of
+    three neighbouring columns. This saves two thirds of the first level of
+    adders.
+
+    stages: number of register stages, as for CalcLifeCell
+    """
+    def __init__(self, width=16, stages=0):
+        assert 0 <= stages <= CalcLifeCell.MAX_STAGES
+        self.width = width
+        self.stages = stages
+        # 3 rows of width + 2 bits for input
+        self.input = [Signal(width + 2) for _ in range(3)]
+        self.rule = Signal(18, reset=LIFE_RULE)
+        # Next generation of middle width bits
+        self.output = Signal(width)
+
+    def elaborate(self, platform):
+        m = Module()
+        w = self.width
+        top, middle, bottom = self.input
+
+        # First level: each column of three bits gives a one and a two
+        columns = [full_add(top[j], middle[j], bottom[j]) for j in range(w + 2)]
+        values = register_stage(m, self.stages, 1,
+                [s for s, _ in columns] + [c for _, c in columns] +
+                [middle[j] for j in range(1, w + 1)], "columns")
+        ones, twos, centers = values[0:w + 2], values[w + 2:2 * w + 4], values[2 * w + 4:]
+
+        # Second level, for each cell
+        for i in range(w):
+            m.d.comb += self.output[i].eq(is_alive(m, self.stages,
+                    ones[i:i + 3], twos[i:i + 3], centers[i], self.rule, f"cell{i}_"))
+        return m
+
+
+class CalcLifeWordColumnsTest(CalcLifeWordTest):
+    calc_class = CalcLifeWordColumns
+
+
+class CalcLifeWordColumns32Test(CalcLifeWordTest):
+    calc_class = CalcLifeWordColumns
+    width = 32
+
+
+class CalcLifeWordColumnsPipelinedTest(CalcLifeWordTest):
+    calc_class = CalcLifeWordColumns
+    stages = 2
+
+
+class CalcLifeWordColumnsDayAndNightTest(CalcLifeWordTest):
+    calc_class = CalcLifeWordColumns
+    rule = RULES['DayAndNight']
 
 if __name__ == '__main__':
         unittest.main()
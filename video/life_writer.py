@@ -23,151 +23,574 @@ from elab import SimpleElaboratable, SimulationTestCase
 from life_buffer_filler import LifeBufferFiller, LifeBufferFillerMode
 from life_buffer_reader import LifeBufferReader
 from life_data_buffer import LifeDataBuffer, build_memories
-from life_rules import life_row, CalcLifeWord
+from life_rules import life_row, CalcLifeWord, CalcLifeWordColumns, LIFE_RULE, RULES, parse_rule
 from spram import RamBank
+from stagnation import StagnationDetector
 from util import all_bits_list, flatten_list, to_number, to_words
 from video_config import RESOLUTIONS
 from writer import WriterBase
 
+# pip install attrs
+from attr import attrs, attrib
+
 from enum import IntEnum
 import random
 import unittest
 
 
+@attrs(frozen=True)
+class LifeStep:
+    """One step of the work that LifeWriter does for a line.
+
+    FILL steps fill the first stage's line buffer from RAM. ROTATE steps
+    rotate a later stage's line buffer, so that it uses its saved line.
+    PROCESS steps calculate one line in a stage, writing it to the next
+    stage's line buffer, or to the double buffer and RAM for the last stage.
+    """
+    kind = attrib() # 'FILL', 'ROTATE' or 'PROCESS'
+    stage = attrib(default=0)
+    mode = attrib(default=None) # For FILL, the LifeBufferFillerMode
+    save = attrib(default=False) # For PROCESS, save the line in the next stage
+    ahead = attrib(default=False) # For PROCESS, also fill the next line
+
+
+def retained_lines(generations):
+    """Number of lines kept in the first stage's line buffer as they are
+    written to RAM at the end of a frame. They are the first lines the
+    first stage needs for the next frame.
+    """
+    return min(generations, 3)
+
+
+def first_line_steps(generations):
+    """Steps to fill all stages' line buffers for the first line of the
+    screen, up to the point where each stage has just one line to calculate.
+
+    Each stage starts from the line buffer of the stage before, so stage s
+    calculates 2 * (generations - s) - 1 lines, starting that many lines before
+    the first line. The line that wraps to the first line is saved, for
+    use with the last line of the screen.
+    """
+    steps = []
+    lines = [0] * generations # lines held in each stage's line buffer
+    calculated = [0] * generations # lines calculated by each stage
+    def calculate(stage):
+        while lines[stage] < 3:
+            if stage == 0:
+                first = not steps
+                steps.append(LifeStep('FILL', mode=LifeBufferFillerMode.FIRST
+                        if first else LifeBufferFillerMode.MIDDLE))
+                lines[0] += 3 if first else 1
+            else:
+                calculate(stage - 1)
+        if stage == generations - 1:
+            return
+        steps.append(LifeStep('PROCESS', stage,
+                save=calculated[stage] == generations - 1 - stage))
+        calculated[stage] += 1
+        lines[stage] -= 1
+        lines[stage + 1] += 1
+
+    calculate(generations - 1)
+    # Remove the final calculations, each stage calculating one line
+    return steps[:len(steps) - (generations - 1)]
+
+
 class LifeWriter(WriterBase):
-    """Writes Life to a double buffer"""
-    def __init__(self, resolution, db, filler_control, filler_ram, reader_interface, *, fake_ram=False):
+    """Writes Life to a double buffer
+
+    The writer is made of one or more stages, each with its own line buffer,
+    reader and CalcLifeWord. The first stage's line buffer is filled from RAM,
+    and each following stage's line buffer is filled with the lines
+    calculated by the stage before. Each pass over RAM therefore advances
+    Life by as many generations as there are stages, without any more reads or
+    writes of RAM.
+
+    For each line, every stage calculates one line, each stage working a few
+    lines below the stage that follows it. The first line of the screen
+    takes extra steps to fill the line buffers, while on the last few lines of
+    the screen, the earlier stages have no more work to do.
+
+    While the lines are calculated, the filler reads the line needed for the
+    next line of the screen into the first stage's spare line buffer. RAM
+    reads and write backs share the RAM bank, so that each line takes about
+    one pass over its words rather than two.
+
+    Near the end of the frame, lines written to RAM are also kept in the first
+    stage's line buffer, so that the first line of the next frame reads fewer
+    lines from RAM.
+
+    An occupancy bitmap records which lines of RAM have any live cells. Empty
+    lines are not read from RAM. With one generation per frame, lines whose
+    neighbourhood is empty are not calculated either: zeros are written to
+    the double buffer, and nothing to RAM. lines_skipped counts these lines,
+    out of line_count lines written. Likewise, words that are unchanged are
+    not written back to RAM. ram_writes_skipped counts these, out of
+    ram_words.
+
+    The rule register holds the birth and survival masks used by every
+    stage, and is loaded from rule_in while rule_load is set. Rules where
+    cells are born with no neighbours do not skip lines.
+
+    The board is reseeded from rng_in every 4096 frames, and also on the
+    frame after the StagnationDetector finds that the board has stopped
+    changing. rng_in is as wide as the line buffers, and rng_enable asks for
+    a new value once per word of width cells.
+
+    Line buffers, RAM and CalcLifeWord may work on words of 32 cells. The
+    double buffer still takes 16 bits at a time, so the last stage holds its
+    reader for a cycle while the second half of each word is written out.
+
+    CalcLifeWord may be pipelined. The reader's valid and count signals are
+    delayed to match, and everything downstream of the calculation works from
+    the delayed signals.
+    """
+    def __init__(self, resolution, db, filler_control, filler_ram, reader_interfaces,
+            buffer_writes=(), *, calc_stages=0, calc_class=CalcLifeWord, fake_ram=False):
+        """
+            filler_control, filler_ram: filler for the first stage's line buffer
+            reader_interfaces: reader for each stage's line buffer
+            buffer_writes: write interface for each line buffer after the first
+            calc_stages: number of register stages in each CalcLifeWord
+            calc_class: CalcLifeWord or CalcLifeWordColumns
+        """
         super().__init__(resolution, db)
-        self.ram = RamBank(fake_ram)
+        self.width = len(reader_interfaces[0].curr_word)
+        self.ram = RamBank(fake_ram, width=self.width)
 
-        wpl = resolution.words_per_line
-        self.total_words = resolution.total_words
+        # Line buffers and RAM hold words of width cells
+        self.ram_words_per_line = self.words_per_line // (self.width // 16)
+        self.total_words = resolution.total_words // (self.width // 16)
 
         self.filler = filler_control
         self.filler_ram = filler_ram
 
-        self.reader = reader_interface
+        self.readers = reader_interfaces
+        self.buffer_writes = buffer_writes
+        self.generations = len(reader_interfaces)
+        assert len(buffer_writes) == self.generations - 1
+
+        self.calc_stages = calc_stages
+        self.calcs = [calc_class(self.width, calc_stages)
+                for _ in range(self.generations)]
+        # For 32 bit words, set while the reader holds for the high half
+        self.read_halves = [Signal(name=f"read_half{n}")
+                for n in range(self.generations)]
+        # Reader valid, count, half and word, delayed to line up with calc outputs
+        self.calc_valid = [None] * self.generations
+        self.calc_count = [None] * self.generations
+        self.calc_half = [None] * self.generations
+        self.calc_word = [None] * self.generations
+
+        self.rng_in = Signal(self.width) # input: one word of width cells
+        self.rng_enable = Signal() # output
 
-        self.calc = CalcLifeWord()
+        self.rule = Signal(18, reset=LIFE_RULE) # Rule applied by each stage
+        self.rule_in = Signal(18) # input
+        self.rule_load = Signal() # input
 
-        self.rng_in = Signal(16) # input
-        self.rng_enable = Signal() # output
+        # Set while the filler reads the next line ahead, and once it is done
+        self.reading_ahead = Signal()
+        self.read_ahead_done = Signal()
+
+        # Whether each line of RAM has any live cells
+        lines = resolution.vertical.active
+        self.occupancy = Memory(width=1, depth=lines, init=[1] * lines, name="occupancy")
+        self.occupancy_write = self.occupancy.write_port()
+        self.line_live = Signal() # Whether the line being written has live cells
+        self.line_count = Signal(32) # output
+        self.lines_skipped = Signal(32) # output
+
+        # Words written back to RAM, and how many of those were unchanged
+        self.ram_words = Signal(32) # output
+        self.ram_writes_skipped = Signal(32) # output
+
+        # Watches words output, to reseed boards that have stopped changing
+        self.stagnation = StagnationDetector()
+        self.reseeding = Signal() # Set for frames that are read from rng_in
 
     def connect_submodules(self, m):
         m.submodules.ram = self.ram
-        m.submodules.calc = self.calc
-        for i in range(3):
-            m.d.comb += self.calc.input[i].eq(self.reader.life_data[i])
+        m.submodules.stagnation = self.stagnation
+        # End the detector's frame once the last word has been counted
+        last_frame = Signal()
+        m.d.sync += last_frame.eq(self.f_count[0])
+        m.d.comb += [
+                self.stagnation.end_frame.eq(last_frame != self.f_count[0]),
+                self.reseeding.eq((self.f_count[:12] == 0) | self.stagnation.stagnant),
+        ]
+        m.d.comb += [
+                self.ram.read_addr.eq(self.filler_ram.addr),
+                self.ram.read_en.eq(self.filler_ram.en),
+                self.filler_ram.ready.eq(self.ram.read_ok),
+                self.filler_ram.data.eq(self.ram.data_out),
+        ]
+        m.submodules.occupancy_read = occupancy_read = self.occupancy.read_port(
+                transparent=False)
+        m.submodules.occupancy_write = self.occupancy_write
+        m.d.comb += [
+                occupancy_read.addr.eq(self.filler_ram.line),
+                self.filler_ram.occupied.eq(occupancy_read.data),
+        ]
+        for n, (calc, reader) in enumerate(zip(self.calcs, self.readers)):
+            m.submodules[f"calc{n or ''}"] = calc
+            m.d.comb += calc.rule.eq(self.rule)
+            for i in range(3):
+                m.d.comb += calc.input[i].eq(reader.life_data[i])
+            (self.calc_valid[n], self.calc_count[n], self.calc_half[n],
+                    self.calc_word[n]) = self.delay(m, [reader.valid, reader.count,
+                        self.read_halves[n], reader.curr_word], self.calc_stages)
+
+    def delay(self, m, signals, cycles):
+        """Returns copies of signals, delayed by the given number of cycles."""
+        for c in range(cycles):
+            delayed = [Signal.like(s, name=f"{s.name}_d{c + 1}") for s in signals]
+            m.d.sync += [d.eq(s) for d, s in zip(delayed, signals)]
+            signals = delayed
+        return signals
+
+    def connect_readers(self, m):
+        # Each stage's line buffer substitutes the saved line on the line that
+        # its newest line wraps to the first line of the screen.
+        lines = self.resolution.vertical.active
+        for stage, reader in enumerate(self.readers):
+            m.d.comb += reader.last.eq(
+                    self.v_count == lines - (self.generations - stage))
+
+    def fill(self, m, step, state, next_state, leds):
+        with m.State(state):
+            m.d.comb += [
+                    self.filler.mode.eq(step.mode),
+                    self.filler.start.eq(1),
+            ]
+            m.next = state + "_RUN"
+        with m.State(state + "_RUN"):
+            led_r, led_g = leds
+            if led_r is not None and led_g is not None:
+                m.d.comb += [
+                        led_r.eq(self.filler_ram.data == 0),
+                        led_g.eq(self.filler_ram.data != 0),
+                ]
+            with m.If(self.filler.finished):
+                m.next = next_state
+
+    def rotate(self, m, step, state, next_state):
+        with m.State(state):
+            m.d.comb += self.buffer_writes[step.stage - 1].next.eq(1)
+            m.next = next_state
+
+    def process(self, m, step, state, next_state, write_addr):
+        reader = self.readers[step.stage]
+        calc = self.calcs[step.stage]
+        valid = self.calc_valid[step.stage]
+        count = self.calc_count[step.stage]
+        is_last = step.stage == self.generations - 1
+        lines = self.resolution.vertical.active
+        first_kept = lines - self.generations
+        retaining = ((self.v_count >= first_kept)
+                & (self.v_count < first_kept + retained_lines(self.generations)))
+        # With one generation, a line with an empty neighbourhood stays empty
+        can_skip = is_last and self.generations == 1
+        skip = ((reader.occupied == 0) & ~self.reseeding & ~retaining
+                & ~self.rule[0])
+        with m.State(state):
+            if can_skip:
+                with m.If(skip):
+                    m.next = state + "_SKIP"
+                with m.Else():
+                    m.d.comb += reader.begin.eq(1)
+                    m.next = state + "_RUN"
+            else:
+                m.d.comb += reader.begin.eq(1)
+                m.next = state + "_RUN"
+            if step.ahead:
+                # Fill the next line while this line is calculated
+                with m.If(self.v_count < lines - self.generations - 1):
+                    m.d.comb += [
+                            self.filler.mode.eq(LifeBufferFillerMode.AHEAD),
+                            self.filler.start.eq(1),
+                    ]
+                    m.d.sync += self.reading_ahead.eq(1)
+            if is_last:
+                # Keep lines that the next frame starts from
+                with m.If(retaining):
+                    m.d.comb += [
+                            self.filler.mode.eq(LifeBufferFillerMode.RETAIN),
+                            self.filler.start.eq(1),
+                    ]
+        if can_skip:
+            with m.State(state + "_SKIP"):
+                # Output zeros, leaving RAM as it is
+                self.db_write_word(m, 0)
+                self.watch_word(m, 0)
+                with m.If(self.is_on_last_word()):
+                    m.d.sync += [
+                            write_addr.eq(Mux(
+                                write_addr == self.total_words - self.ram_words_per_line,
+                                0, write_addr + self.ram_words_per_line)),
+                            self.line_count.eq(self.line_count + 1),
+                            self.lines_skipped.eq(self.lines_skipped + 1),
+                    ]
+                self.increment_counts(m, on_end=next_state)
+        with m.State(state + "_RUN"):
+            if not is_last:
+                # Write to next stage's line buffer
+                write = self.buffer_writes[step.stage]
+                with m.If(valid):
+                    m.d.comb += [
+                            write.addr.eq(count),
+                            write.data.eq(calc.output),
+                            write.en.eq(1),
+                            write.save.eq(step.save),
+                    ]
+                    with m.If(count == self.ram_words_per_line - 1):
+                        m.d.comb += write.next.eq(1)
+                        m.next = next_state
+                return
+
+            # Read from line buffer, calculate, output and write to RAM
+            # Get a value to output
+            # Uses reader timing to count words, no matter what is displayed
+            if self.width == 32:
+                # Hold the reader after each word, so that each word is
+                # calculated twice, once for each half
+                read_half = self.read_halves[step.stage]
+                with m.If(reader.valid):
+                    m.d.sync += read_half.eq(~read_half)
+                    m.d.comb += reader.hold.eq(~read_half)
+            half = self.calc_half[step.stage]
+            with m.If(valid):
+                # Calculate an output value
+                val = Signal(16)
+                output = (calc.output if self.width == 16
+                        else Mux(half, calc.output[16:32], calc.output[0:16]))
+                with m.If(self.reseeding):
+                    if self.width == 16:
+                        m.d.comb += val.eq(self.rng_in)
+                        m.d.comb += self.rng_enable.eq(1)
+                    else:
+                        # One random word covers both halves
+                        m.d.comb += val.eq(Mux(half, self.rng_in[16:32], self.rng_in[0:16]))
+                        m.d.comb += self.rng_enable.eq(half)
+                with m.Else():
+                    m.d.comb += val.eq(output)
+                self.db_write_word(m, val)
+                self.watch_word(m, val)
+
+                old = self.calc_word[step.stage]
+                if self.width == 16:
+                    self.write_ram(m, write_addr, val, old)
+                else:
+                    # Keep the low half until the high half is available
+                    low = Signal(16)
+                    with m.If(~half):
+                        m.d.sync += low.eq(val)
+                    with m.Else():
+                        self.write_ram(m, write_addr, Cat(low, val), old)
 
-    def calc_filler_mode(self):
-        return Mux(self.v_count == 0, LifeBufferFillerMode.FIRST, 
-                Mux(self.is_on_last_line(), LifeBufferFillerMode.LAST, 
-                    LifeBufferFillerMode.MIDDLE))
+                # Record whether the line has live cells
+                with m.If(self.is_on_last_word()):
+                    m.d.comb += [
+                            self.occupancy_write.addr.eq(self.v_count),
+                            self.occupancy_write.data.eq(self.line_live | val.any()),
+                            self.occupancy_write.en.eq(1),
+                    ]
+                    m.d.sync += [
+                            self.line_live.eq(0),
+                            self.line_count.eq(self.line_count + 1),
+                    ]
+                with m.Else():
+                    m.d.sync += self.line_live.eq(self.line_live | val.any())
+
+                # Increment pixel counts, and when finished a line, write the tag
+                self.increment_counts(m, on_end=next_state)
+
+    def watch_word(self, m, data):
+        """Passes a word written to the double buffer to the stagnation detector."""
+        m.d.comb += [
+            self.stagnation.data.eq(data),
+            self.stagnation.en.eq(1),
+        ]
+
+    def write_ram(self, m, write_addr, data, old):
+        """Writes data to RAM at write_addr, and moves on to the next address.
+
+        With one generation, old is the word in RAM at write_addr, and the
+        write is skipped when data is unchanged, leaving the RAM free for
+        the filler. The filler sees every word, for RETAIN mode.
+        """
+        unchanged = (data == old) if self.generations == 1 else 0
+        m.d.comb += [
+            self.ram.addr.eq(write_addr),
+            self.ram.wren.eq(~unchanged),
+            self.ram.data_in.eq(data),
+            self.filler_ram.write_data.eq(data),
+            self.filler_ram.write_en.eq(1),
+        ]
+        m.d.sync += [
+            write_addr.eq(write_addr + 1),
+            self.ram_words.eq(self.ram_words + 1),
+            self.ram_writes_skipped.eq(self.ram_writes_skipped + unchanged),
+        ]
+        with m.If(write_addr == self.total_words - 1):
+            m.d.sync += write_addr.eq(0)
+
+    def build_steps(self, m, name, steps, next_state, write_addr, leds):
+        """Builds a state for each step, named name_0, name_1 etc.
+
+        The last step moves to next_state.
+        """
+        for n, step in enumerate(steps):
+            state = f"{name}_{n}"
+            step_next = f"{name}_{n + 1}" if n + 1 < len(steps) else next_state
+            if step.kind == 'FILL':
+                self.fill(m, step, state, step_next, leds)
+            elif step.kind == 'ROTATE':
+                self.rotate(m, step, state, step_next)
+            else:
+                self.process(m, step, state, step_next, write_addr)
 
     def elaborate(self, platform):
         m = Module()
         self.connect_submodules(m)
-        m.d.comb += self.reader.last.eq(self.is_on_last_line())
+        self.connect_readers(m)
         led_r = platform.request("led_r", 0) if platform else None
         led_g = platform.request("led_g", 0) if platform else None
+        leds = (led_r, led_g)
 
         write_addr = Signal(16)
+        lines = self.resolution.vertical.active
+        k = self.generations
+
+        with m.If(self.rule_load):
+            m.d.sync += self.rule.eq(self.rule_in)
+
+        with m.If(self.reading_ahead & self.filler.finished):
+            m.d.sync += self.read_ahead_done.eq(1)
 
         with m.FSM() as fsm:
-            # Wait for double buffer flip, and start fetch
+            # Wait for double buffer flip, and start on the steps for this line
             with m.State("WAIT_START"):
                 with m.If(self.db.ready):
-                    m.d.sync += [
-                            self.filler.mode.eq(self.calc_filler_mode()),
-                            self.filler.start.eq(1),
-                    ]
-                    m.next = "FILL"
-            with m.State("FILL"):
-                # fill buffer
-                m.d.sync += self.filler.start.eq(0)
-                m.d.comb += [
-                        self.ram.addr.eq(self.filler_ram.addr),
-                        self.filler_ram.data.eq(self.ram.data_out),
-                ]
-                if led_r is not None and led_g is not None:
-                    m.d.comb += [
-                            led_r.eq(self.filler_ram.data == 0),
-                            led_g.eq(self.filler_ram.data != 0),
-                    ]
-                with m.If(self.filler.finished):
-                    m.d.sync += self.reader.begin.eq(1)
-                    m.next = "PROCESS"
-            with m.State("PROCESS"):
-                m.d.sync += self.reader.begin.eq(0)
-                # Read from line buffer, calculate, output and write to RAM
-                # Get a value to output
-                # Uses reader timing to count words, no matter what is displayed
-                with m.If(self.reader.valid):
-                    # Calculate an output value
-                    val = Signal(16)
-                    with m.If(self.f_count[:12] == 0):
-                        m.d.comb += val.eq(self.rng_in)
-                        m.d.comb += self.rng_enable.eq(1)
+                    with m.If(self.v_count == 0):
+                        m.next = "FIRST_0"
+                    for n in range(1, k + 1):
+                        with m.Elif(self.v_count == lines - n):
+                            m.next = f"LAST_{n}_0"
                     with m.Else():
-                        m.d.comb += val.eq(self.calc.output)
-                    self.db_write_word(m, val)
+                        # The line was read ahead during the previous line
+                        m.next = "PROCESS_0_0"
+
+            # Each line ends with each stage, from some stage onwards,
+            # calculating one line
+            for stage in range(k):
+                self.build_steps(m, f"PROCESS_{stage}",
+                        [LifeStep('PROCESS', stage, ahead=stage == 0)],
+                        f"PROCESS_{stage + 1}_0" if stage + 1 < k else "WRITE_TAG",
+                        write_addr, leds)
+            self.build_steps(m, "FIRST", first_line_steps(k), "PROCESS_0_0",
+                    write_addr, leds)
+            # On the nth line from the bottom, stage k - n uses its saved line,
+            # and the stages before it have nothing to do
+            for n in range(1, k + 1):
+                stage = k - n
+                first_step = (LifeStep('FILL', mode=LifeBufferFillerMode.LAST)
+                        if stage == 0 else LifeStep('ROTATE', stage))
+                self.build_steps(m, f"LAST_{n}", [first_step],
+                        f"PROCESS_{stage}_0", write_addr, leds)
 
-                    # Tell RAM to write data
-                    m.d.comb += [
-                        self.ram.addr.eq(write_addr),
-                        self.ram.wren.eq(1),
-                        self.ram.data_in.eq(val)
+            with m.State("WRITE_TAG"):
+                # Once any line read ahead is complete, rotate it into the
+                # line buffer and write tag to output
+                with m.If(~self.reading_ahead | self.read_ahead_done
+                        | self.filler.finished):
+                    m.d.comb += self.filler.rotate.eq(self.reading_ahead)
+                    m.d.sync += [
+                            self.reading_ahead.eq(0),
+                            self.read_ahead_done.eq(0),
                     ]
+                    self.db_write_tag(m)
+                    m.next = "WAIT_START"
 
-                    # Increment RAM address
-                    m.d.sync += write_addr.eq(write_addr + 1)
-                    with m.If(write_addr == self.total_words - 1):
-                        m.d.sync += write_addr.eq(0)
+        return m
 
-                    # Increment pixel counts, and when finished a line, write the tag
-                    self.increment_counts(m, on_end="WRITE_TAG")
 
-            with m.State("WRITE_TAG"):
-                # Write tag to output
-                self.db_write_tag(m)
-                m.next = "WAIT_START"
-
-        return m
+def build_life_writer(m, resolution, db_write, *, generations=1, width=16,
+        calc_stages=0, calc_class=CalcLifeWord, fake_ram=False):
+    """Adds a LifeWriter to m, along with the line buffers, filler and readers
+    that it drives.
+
+    generations: number of generations calculated for each frame
+    width: number of cells calculated each cycle, 16 or 32
+    calc_stages: number of pipeline register stages in each CalcLifeWord
+    calc_class: CalcLifeWord or CalcLifeWordColumns
+
+    The caller is responsible for connecting rng_in and rng_enable.
+    Returns the LifeWriter.
+    """
+    assert resolution.words_per_line % (width // 16) == 0
+    wpl = resolution.words_per_line // (width // 16)
+    total_words = resolution.total_words // (width // 16)
+    readers = []
+    buffer_writes = []
+    for stage in range(generations):
+        suffix = str(stage) if stage else ''
+        read_ports, write_ports = build_memories(m, wpl, width=width,
+                prefix=f"gen{stage}_" if stage else '')
+        m.submodules['buffer' + suffix] = buffer = LifeDataBuffer(read_ports, write_ports)
+        if stage == 0:
+            m.submodules.filler = filler = LifeBufferFiller(
+                    buffer.write, wpl, total_words, generations=generations,
+                    retained=retained_lines(generations))
+        else:
+            buffer_writes.append(buffer.write)
+        m.submodules['reader' + suffix] = reader = LifeBufferReader(wpl, buffer.read)
+        readers.append(reader.interface)
+    m.submodules.writer = writer = LifeWriter(resolution, db_write,
+            filler.control, filler.ram, readers, buffer_writes,
+            calc_stages=calc_stages, calc_class=calc_class, fake_ram=fake_ram)
+    return writer
 
 
 class LifeWriterTest(SimulationTestCase):
+    generations = 1
+    width = 16
+    calc_stages = 0
+    calc_class = CalcLifeWord
+    scale = 1 # Size of each cell on screen
+    rule = LIFE_RULE
+    line_cycles = 34 # Cycles to give the writer after reading each line
+
     def setUp(self):
         # Set up simulation
-        self.res = RESOLUTIONS['TESTBIG']
+        self.res = RESOLUTIONS['TESTBIG'].cells(self.scale)
         wpl = self.res.words_per_line
         db = DoubleBuffer(wpl + 1, read_domain='sync', write_domain='sync')
         self.add(db, 'db')
         self.db_read = db.read
+        self.lw = build_life_writer(self.m, self.res, db.write,
+                generations=self.generations, width=self.width,
+                calc_stages=self.calc_stages, calc_class=self.calc_class, fake_ram=True)
 
-        read_ports, write_ports = build_memories(self.m, wpl)
-        ldbuf = LifeDataBuffer(read_ports, write_ports)
-        self.add(ldbuf, 'ldbuf')
-        filler = LifeBufferFiller(ldbuf.write, wpl, self.res.total_words)
-        self.add(filler, 'filler')
-        ldreader = LifeBufferReader(wpl, ldbuf.read)
-        self.add(ldreader, 'ldreader')
-
-        self.lw = LifeWriter(self.res, db.write, filler.control,
-                filler.ram, ldreader.interface, fake_ram=True)
-        self.add(self.lw, 'lw')
+        self.rng_data = self.make_rng_data()
+        self.extra_processes.append(self.rng_process)
 
+    def make_rng_data(self):
         # Make a list of random numbers for rng, same size as frame
         random.seed(0)
-        self.rng_data = [
-                [random.randrange(65536) for _ in range(self.res.words_per_line)]
+        return [[random.randrange(65536) for _ in range(self.res.words_per_line)]
                 for _ in range(self.res.vertical.active)]
-        self.extra_processes.append(self.rng_process)
+
+    def rng_words(self):
+        return flatten_list(self.rng_data)
 
     def rng_process(self):
         yield Passive()
-        # Set new data whenever enable is set
-        for word in flatten_list(self.rng_data):
-            yield self.lw.rng_in.eq(word)
+        # Set new data whenever enable is set, packing 16 bit words to width
+        words = self.rng_words()
+        n = self.width // 16
+        for i in range(0, len(words), n):
+            yield self.lw.rng_in.eq(sum(w << (16 * j) for j, w in enumerate(words[i:i + n])))
             yield
             while not (yield self.lw.rng_enable):
                 yield
@@ -176,7 +599,7 @@ class LifeWriterTest(SimulationTestCase):
         # That's all the data we have
         while not (yield self.lw.rng_enable):
             yield
-        fail("Requested more random numbers than expected")
+        self.fail("Requested more random numbers than expected")
 
     def check_row(self, frame, row, tag, words):
         def check_value(expected):
@@ -192,7 +615,7 @@ class LifeWriterTest(SimulationTestCase):
         for n, val in enumerate(words):
             yield from check_value(val)
         yield from check_value(tag)
-        for i in range(34): yield # Give the writer a bit of time
+        for i in range(self.line_cycles): yield # Give the writer a bit of time
 
     def calc_next(self, expected, i):
         def bits_from(row):
@@ -201,29 +624,165 @@ class LifeWriterTest(SimulationTestCase):
         a = bits_from(expected[i-1])
         b = bits_from(expected[i])
         c = bits_from(expected[(i+1)%(self.res.vertical.active)])
-        result = life_row(a, b, c)
+        result = life_row(a, b, c, self.rule)
         return to_words(result)
 
+    def next_expected(self, frame, expected):
+        """Returns expected frame after the given frame."""
+        return self.calc_next_frame(expected)
+
+    def calc_next_frame(self, expected):
+        for _ in range(self.generations):
+            expected = [self.calc_next(expected, i) for i in range(len(expected))]
+        return expected
+
     def test_run(self):
         # reads the double buffer
         num_frames = 3
         def reader():
+            # Load the rule before the first line is calculated
+            yield self.lw.rule_in.eq(self.rule)
+            yield self.lw.rule_load.eq(1)
             yield
+            yield self.lw.rule_load.eq(0)
             yield
             yield from self.toggle(self.db_read.toggle)
-            for i in range(30): yield # Give the writer a bit of time
+            for i in range(self.line_cycles): yield # Give the writer a bit of time
             expected = self.rng_data
-            expected_next = [None] * len(expected)
             wpl = self.res.words_per_line
             for f in range(num_frames):
                 for i in range(0, self.res.vertical.active):
                     #if f == 1: breakpoint()
                     yield from self.check_row(f, i, i==0, expected[i])
-                    expected_next[i] = self.calc_next(expected, i)
-                expected = expected_next[:]
+                expected = self.next_expected(f, expected)
+            yield from self.check_stats(num_frames)
 
         self.run_sim(reader, write_trace=False)
 
+    def check_stats(self, num_frames):
+        # Lines are only skipped when most lines are empty
+        self.assertEqual(0, (yield self.lw.lines_skipped))
+        self.assertEqual(0, (yield self.lw.filler.empty_lines))
+        yield
+
+
+class LifeWriterTwoGenerationsTest(LifeWriterTest):
+    generations = 2
+    line_cycles = 80
+
+
+class LifeWriterThreeGenerationsTest(LifeWriterTest):
+    generations = 3
+    line_cycles = 150
+
+
+class LifeWriter32Test(LifeWriterTest):
+    width = 32
+    line_cycles = 30
+
+
+class LifeWriter32TwoGenerationsTest(LifeWriterTest):
+    generations = 2
+    width = 32
+    line_cycles = 55
+
+
+class LifeWriterPipelinedTest(LifeWriterTest):
+    calc_stages = 2
+    line_cycles = 40
+
+
+class LifeWriter32PipelinedTwoGenerationsTest(LifeWriterTest):
+    generations = 2
+    width = 32
+    calc_stages = 2
+    calc_class = CalcLifeWordColumns
+    line_cycles = 65
+
+
+class LifeWriterScale2Test(LifeWriterTest):
+    scale = 2
+    line_cycles = 34
+
+
+class LifeWriterHighLifeTest(LifeWriterTest):
+    rule = RULES['HighLife']
+
+
+class LifeWriterSparseTest(LifeWriterTest):
+    # A glider and a blinker, and otherwise empty
+    def make_rng_data(self):
+        data = [[0] * self.res.words_per_line for _ in range(self.res.vertical.active)]
+        data[10][1], data[11][1], data[12][1] = 0x0002, 0x0004, 0x0007
+        data[30][2] = data[31][2] = data[32][2] = 0x0100
+        return data
+
+    def check_stats(self, num_frames):
+        skipped = yield self.lw.lines_skipped
+        lines = yield self.lw.line_count
+        self.assertGreaterEqual(lines, num_frames * self.res.vertical.active)
+        self.assertGreater(skipped, lines // 2)
+        self.assertGreater((yield self.lw.filler.empty_lines), lines // 2)
+        # Of the lines calculated, most words are unchanged
+        self.assertGreater((yield self.lw.ram_writes_skipped),
+                (yield self.lw.ram_words) // 2)
+
+
+class LifeWriterSparseTwoGenerationsTest(LifeWriterSparseTest):
+    generations = 2
+    line_cycles = 80
+
+    def check_stats(self, num_frames):
+        # Lines are not skipped, but empty lines are not read
+        self.assertEqual(0, (yield self.lw.lines_skipped))
+        self.assertGreater((yield self.lw.filler.empty_lines), 0)
+        self.assertEqual(0, (yield self.lw.ram_writes_skipped))
+
+
+class LifeWriterSparseBirthTest(LifeWriterSparseTest):
+    # Cells with no neighbours are born, so no lines are skipped
+    rule = parse_rule('B03/S23')
+
+    def check_stats(self, num_frames):
+        self.assertEqual(0, (yield self.lw.lines_skipped))
+
+
+class LifeWriterStillTest(LifeWriterTest):
+    # A block, which does not change, so the third frame is reseeded
+    def make_rng_data(self):
+        data = [[0] * self.res.words_per_line for _ in range(self.res.vertical.active)]
+        data[20][1] = data[21][1] = 0x0030
+        return data
+
+    def setUp(self):
+        super().setUp()
+        random.seed(1)
+        self.reseed_data = [[random.randrange(65536) for _ in range(self.res.words_per_line)]
+                for _ in range(self.res.vertical.active)]
+
+    def rng_words(self):
+        return flatten_list(self.rng_data) + flatten_list(self.reseed_data)
+
+    def next_expected(self, frame, expected):
+        return self.reseed_data if frame == 1 else self.calc_next_frame(expected)
+
+    def check_stats(self, num_frames):
+        yield
+
+
+class FirstLineStepsTest(unittest.TestCase):
+    def test_one(self):
+        self.assertEqual(first_line_steps(1),
+                [LifeStep('FILL', mode=LifeBufferFillerMode.FIRST)])
+
+    def test_two(self):
+        first = LifeStep('FILL', mode=LifeBufferFillerMode.FIRST)
+        middle = LifeStep('FILL', mode=LifeBufferFillerMode.MIDDLE)
+        self.assertEqual(first_line_steps(2), [
+                first, LifeStep('PROCESS', 0),
+                middle, LifeStep('PROCESS', 0, save=True),
+                middle])
+
 
 if __name__ == '__main__':
         unittest.main()
@@ -35,6 +35,16 @@ class Rules1DConfig:
     speed = attrib(default=1)
 
 
+# Some configurations that are interesting to watch
+CONFIGS = [
+    Rules1DConfig(30, InitStyle.SINGLE, 1),
+    Rules1DConfig(18, InitStyle.SINGLE, 6),
+    Rules1DConfig(254, InitStyle.SINGLE, 6),
+    Rules1DConfig(90, InitStyle.SINGLE, 1),
+    Rules1DConfig(110, InitStyle.SINGLE, 1),
+]
+
+
 class Rules1DConfigTest(unittest.TestCase):
     def test_attr_names(self):
         c = Rules1DConfig(201, InitStyle.SINGLE, 22)
@@ -101,24 +111,27 @@ class Rules1DTest(unittest.TestCase):
 
 
 class Calc1DCell(Elaboratable):
-    """An evaluator for a single cell in a 1D automata."""
-    def __init__(self, rules):
-        self.rules = rules
+    """An evaluator for a single cell in a 1D automata.
+
+    The rule number is the lookup table: the three input bits select a bit
+    of it.
+    """
+    def __init__(self):
+        self.rule = Signal(8)
         self.input = Signal(3)
         self.output = Signal()
 
     def elaborate(self, platform):
         m = Module()
-        r = Array(self.rules.eval_one(i) for i in range(7))
-        m.d.comb += self.output.eq(r[self.input])
+        m.d.comb += self.output.eq(self.rule.bit_select(self.input, 1))
         return m
 
 
 class Calc1DCellTest(unittest.TestCase):
     def test_one_rule(self):
-        r = Rules1D(1, Rules1DConfig(30, InitStyle.SINGLE))
-        e = Calc1DCell(r)
+        e = Calc1DCell()
         def process():
+            yield e.rule.eq(30)
             expected = [0, 1, 1, 1, 1, 0, 0, 0]
             for i, o in enumerate(expected):
                 yield e.input.eq(i)
@@ -130,31 +143,60 @@ class Calc1DCellTest(unittest.TestCase):
         sim.add_process(process)
         sim.run()
 
+    def test_all_rules(self):
+        e = Calc1DCell()
+        def process():
+            for num in range(256):
+                r = Rules1D(1, Rules1DConfig(num, InitStyle.SINGLE))
+                yield e.rule.eq(num)
+                for i in range(8):
+                    yield e.input.eq(i)
+                    yield Settle()
+                    self.assertEqual(r.eval_one(i), (yield e.output))
+
+        sim = Simulator(e)
+        sim.add_process(process)
+        sim.run()
+
 
 class Calc1DWord(Elaboratable):
-    """An evaluator for a 16 bit word of a 1D automata."""
-    def __init__(self, rules):
-        self.rules = rules
-        self.input = Signal(18)
+    """An evaluator for a 16 bit word of a 1D automata.
+
+    depth: number of generations to calculate. Each generation is a row of
+    cells two narrower than the one before, so the input is 16 + 2 * depth
+    bits wide.
+    """
+    def __init__(self, depth=1):
+        assert 1 <= depth <= 16
+        self.depth = depth
+        self.rule = Signal(8)
+        self.input = Signal(16 + 2 * depth)
         self.output = Signal(16)
 
     def elaborate(self, platform):
         m = Module()
-        for i in range(16):
-            cell = Calc1DCell(self.rules)
-            m.submodules[f"cell_{i}"] = cell
-            m.d.comb += [
-                    cell.input.eq(self.input[i:i+3][::-1]),
-                    self.output[i].eq(cell.output),
-            ]
+        row = self.input
+        for d in range(self.depth):
+            width = len(row) - 2
+            next_row = Signal(width, name=f"gen{d + 1}")
+            for i in range(width):
+                cell = Calc1DCell()
+                m.submodules[f"cell_{d}_{i}"] = cell
+                m.d.comb += [
+                        cell.rule.eq(self.rule),
+                        cell.input.eq(row[i:i+3][::-1]),
+                        next_row[i].eq(cell.output),
+                ]
+            row = next_row
+        m.d.comb += self.output.eq(row)
         return m
 
 
 class Calc1DWordTest(unittest.TestCase):
     def test_one_rule(self):
-        r = Rules1D(1, Rules1DConfig(30, InitStyle.SINGLE))
-        e = Calc1DWord(r)
+        e = Calc1DWord()
         def process():
+            yield e.rule.eq(30)
             # 18 bits in, 16 bits out
             in_bits  = [1, 0, 0, 0, 1, 1, 0, 1, 0, 0, 1, 1, 1, 0, 0, 1, 0, 1] 
             expected = [   1, 0, 1, 1, 0, 0, 1, 1, 1, 1, 0, 0, 1, 1, 1, 0]
@@ -170,6 +212,27 @@ class Calc1DWordTest(unittest.TestCase):
         sim.add_process(process)
         sim.run()
 
+    def test_depth(self):
+        for depth in [2, 5, 16]:
+            e = Calc1DWord(depth)
+            r = Rules1D(16 + 2 * depth, Rules1DConfig(110, InitStyle.RANDOM))
+            def process():
+                yield e.rule.eq(110)
+                for _ in range(10):
+                    bits = r.initdata()
+                    yield e.input.eq(sum(b << i for i, b in enumerate(bits)))
+                    yield Settle()
+                    # Cells near the ends are wrong once wrapped, but the
+                    # middle 16 are right
+                    for _ in range(depth):
+                        bits = r.eval(bits)
+                    expected = sum(b << i for i, b in enumerate(bits[depth:depth + 16]))
+                    self.assertEqual(expected, (yield e.output))
+
+            sim = Simulator(e)
+            sim.add_process(process)
+            sim.run()
+
 
 if __name__ == '__main__':
         unittest.main()
@@ -19,6 +19,7 @@ from double_buffer import DoubleBuffer
 from elab import SimulationTestCase
 from lfsr import Lfsr, LfsrConfig
 from oned_rules import Calc1DWord, Rules1D, Rules1DConfig, InitStyle
+from spram import RamBank
 from util import to_words
 from video_config import RESOLUTIONS
 from writer import WriterBase
@@ -31,11 +32,50 @@ import unittest
 
 
 class OneDWriter(WriterBase):
-    """Writes 1D automata to a double buffer"""
-    def __init__(self, resolution, db, rules_config):
+    """Writes 1D automata to a double buffer
+
+    The rule number and speed start from rules_config, and are registers
+    that may be loaded while running, from rule_in while rule_load is set
+    and from speed_in while speed_load is set. The initial line comes from
+    rules_config only.
+
+    Each frame starts from the line that was speed lines down the previous
+    frame.
+
+    Without scroll, every line of every frame is calculated. With scroll,
+    the lines shown are kept in RAM as a circular buffer, and only the last
+    speed lines of each frame are calculated, while the rest are read back
+    from RAM. Speed must then be less than the number of lines, and loads
+    of larger speeds are ignored. Speed changes take effect at the start of
+    the next frame.
+    """
+    def __init__(self, resolution, db, rules_config, *, scroll=False,
+            fake_ram=False):
         super().__init__(resolution, db)
         self.rules = Rules1D(resolution.horizontal.active, rules_config)
-        self.calc = Calc1DWord(self.rules)
+        self.calc = Calc1DWord()
+        self.scroll = scroll
+        if scroll:
+            assert resolution.total_words <= 1 << 16
+            self.ram = RamBank(fake_ram)
+
+        self.rule = Signal(8, reset=rules_config.num)
+        self.rule_in = Signal(8) # input
+        self.rule_load = Signal() # input
+        # Line that is saved to start the next frame
+        self.speed = Signal(bits_for(resolution.vertical.active), reset=rules_config.speed)
+        self.speed_in = Signal.like(self.speed) # input
+        self.speed_load = Signal() # input
+        self.rows_calculated = Signal(32) # output
+
+        # For scroll, set until the first frame is in RAM
+        self.first_frame = Signal(reset=1)
+        # For scroll, speed for this frame, and addresses in RAM of the first
+        # line of the screen and of the current line
+        self.frame_speed = Signal.like(self.speed, reset=rules_config.speed)
+        self.top_addr = Signal(16)
+        self.line_addr = Signal(16)
+        self.stream_start = Signal()
 
         # These signals are used to coordinate various FSMs. They are pulsed
         # high in the comb domain, and we rely on their default value being 0.
@@ -77,6 +117,8 @@ class OneDWriter(WriterBase):
                 self.db_write_word(m, self.save_rp.data)
                 # Copy read data to scratch memory
                 self.write_mem(m, self.scratch_wp, self.h_count, self.save_rp.data)
+                if self.scroll:
+                    self.write_ram(m, self.save_rp.data)
                 # Set up read for next word
                 m.d.comb += self.save_rp.addr.eq(self.h_count + 1)
                 self.increment_counts(m, on_end="WRITE_TAG")
@@ -134,8 +176,10 @@ class OneDWriter(WriterBase):
                 # Write output to db, to scratch and to save
                 self.db_write_word(m, self.calc.output)
                 self.write_mem(m, self.scratch_wp, self.h_count, self.calc.output)
-                with m.If(self.v_count == self.rules.speed):
+                with m.If(self.v_count == self.speed):
                     self.write_mem(m, self.save_wp, self.h_count, self.calc.output)
+                if self.scroll:
+                    self.write_ram(m, self.calc.output)
 
                 # Shift data along
                 m.d.sync += [
@@ -156,9 +200,76 @@ class OneDWriter(WriterBase):
                 m.d.comb += self.line_end.eq(1)
                 m.next = "WAIT"
 
+    def do_stream_fsm(self, m):
+        """Defines an FSM to output a line kept in RAM, for scroll.
+           Outputs from RAM, and copies to scratch mem, in case the next
+           line is calculated.
+           Starts outputting when stream_start goes high.
+           Pulses line_end when finished.
+        """
+        ram = self.ram
+        with m.FSM() as stream:
+            with m.State("WAIT"):
+                with m.If(self.stream_start):
+                    # Set up read for word 0
+                    m.d.comb += [
+                            ram.read_addr.eq(self.line_addr),
+                            ram.read_en.eq(1),
+                    ]
+                    m.next = "WRITE_DATA"
+            with m.State("WRITE_DATA"):
+                self.db_write_word(m, ram.data_out)
+                self.write_mem(m, self.scratch_wp, self.h_count, ram.data_out)
+                # Set up read for next word
+                m.d.comb += [
+                        ram.read_addr.eq(self.line_addr + self.h_count + 1),
+                        ram.read_en.eq(1),
+                ]
+                self.increment_counts(m, on_end="WRITE_TAG")
+            with m.State("WRITE_TAG"):
+                self.db_write_tag(m)
+                m.next = "FINISHED"
+            with m.State("FINISHED"):
+                m.d.comb += self.line_end.eq(1)
+                m.next = "WAIT"
+
+    def write_ram(self, m, data):
+        """Writes a word of the current line to RAM."""
+        m.d.comb += [
+                self.ram.addr.eq(self.line_addr + self.h_count),
+                self.ram.data_in.eq(data),
+                self.ram.wren.eq(1),
+        ]
+
+    def update_addresses(self, m):
+        """At the end of each line, moves on to the next line in RAM. At the
+        end of each frame, moves the first line of the screen down by the
+        speed that the next frame uses.
+        """
+        wpl = self.words_per_line
+        total = self.resolution.total_words
+        with m.If(self.line_end):
+            m.d.sync += self.line_addr.eq(Mux(self.line_addr == total - wpl,
+                    0, self.line_addr + wpl))
+            with m.If(self.v_count == 0):
+                top = self.top_addr + self.speed * wpl
+                top = Mux(top >= total, top - total, top)[:16]
+                m.d.sync += [
+                        self.top_addr.eq(top),
+                        self.line_addr.eq(top),
+                        self.first_frame.eq(0),
+                        self.frame_speed.eq(self.speed),
+                ]
+
     def elaborate(self, platform):
         m = Module()
         m.submodules.calc = self.calc
+        m.d.comb += self.calc.rule.eq(self.rule)
+        with m.If(self.rule_load):
+            m.d.sync += self.rule.eq(self.rule_in)
+        speed_ok = (self.speed_in < self.resolution.vertical.active) if self.scroll else 1
+        with m.If(self.speed_load & speed_ok):
+            m.d.sync += self.speed.eq(self.speed_in)
 
         # Use one memory each for scratch and save. 
         self.save_rp, self.save_wp = self.make_mem(m, 'save',
@@ -167,15 +278,33 @@ class OneDWriter(WriterBase):
 
         self.do_line0_fsm(m)
         self.do_line_fsm(m)
+        if self.scroll:
+            m.submodules.ram = self.ram
+            self.do_stream_fsm(m)
+            self.update_addresses(m)
+        with m.If(self.line_start):
+            m.d.sync += self.rows_calculated.eq(self.rows_calculated + 1)
 
         # Wait for double buffer flip, and start either line 0 or regular line processing
+        lines = self.resolution.vertical.active
         with m.FSM() as fsm:
             with m.State("WAIT_START"):
                 with m.If(self.db.ready):
-                    with m.If(self.v_count == 0):
-                        m.d.comb += self.line0_start.eq(1)
-                    with m.Else():
-                        m.d.comb += self.line_start.eq(1)
+                    if self.scroll:
+                        # Only the first frame, and the last speed lines of
+                        # each frame after it, are calculated
+                        with m.If(self.first_frame & (self.v_count == 0)):
+                            m.d.comb += self.line0_start.eq(1)
+                        with m.Elif(self.first_frame
+                                | (self.v_count >= lines - self.frame_speed)):
+                            m.d.comb += self.line_start.eq(1)
+                        with m.Else():
+                            m.d.comb += self.stream_start.eq(1)
+                    else:
+                        with m.If(self.v_count == 0):
+                            m.d.comb += self.line0_start.eq(1)
+                        with m.Else():
+                            m.d.comb += self.line_start.eq(1)
                     m.next = "WAIT_END"
             with m.State("WAIT_END"):
                 with m.If(self.line_end):
@@ -185,16 +314,20 @@ class OneDWriter(WriterBase):
 
 
 class OneDWriterTest(SimulationTestCase):
+    config = Rules1DConfig(30, InitStyle.SINGLE, 5)
+    loaded = None # Config loaded when the simulation starts
+    scroll = False
+
     def setUp(self):
         res = RESOLUTIONS['TESTBIG']
         db = DoubleBuffer(res.words_per_line + 1,
                 read_domain='sync', write_domain='sync')
         self.add(db, 'db')
         self.read = db.read
-        config = Rules1DConfig(30, InitStyle.SINGLE, 5)
-        self.rules = Rules1D(res.horizontal.active, config)
-        onedw = OneDWriter(res, db.write, config)
-        self.add(onedw, 'onedw')
+        self.rules = Rules1D(res.horizontal.active, self.loaded or self.config)
+        self.onedw = OneDWriter(res, db.write, self.config, scroll=self.scroll,
+                fake_ram=True)
+        self.add(self.onedw, 'onedw')
 
     def check_row(self, tag, bits):
         def check_value(expected):
@@ -214,6 +347,12 @@ class OneDWriterTest(SimulationTestCase):
     def test_write_read(self):
         num_frames = 3
         def reader():
+            if self.loaded:
+                w = self.onedw
+                yield w.rule_in.eq(self.loaded.num)
+                yield w.speed_in.eq(self.loaded.speed)
+                yield from self.toggle(w.rule_load)
+                yield from self.toggle(w.speed_load)
             yield
             yield
             yield from self.toggle(self.read.toggle)
@@ -227,9 +366,37 @@ class OneDWriterTest(SimulationTestCase):
                     if row == self.rules.speed:
                         saved = expected
                     expected = self.rules.eval(expected)
+            if self.scroll:
+                # Only the first frame, then speed lines per frame
+                lines = self.onedw.resolution.vertical.active
+                self.assertEqual(lines - 1 + (num_frames - 1) * self.rules.speed,
+                        (yield self.onedw.rows_calculated))
 
         self.run_sim(reader, write_trace=False)
 
 
+class OneDWriterLoadTest(OneDWriterTest):
+    loaded = Rules1DConfig(110, InitStyle.SINGLE, 9)
+
+
+class OneDWriterScrollTest(OneDWriterTest):
+    scroll = True
+
+
+class OneDWriterScrollLoadTest(OneDWriterTest):
+    scroll = True
+    loaded = Rules1DConfig(110, InitStyle.SINGLE, 9)
+
+
+class OneDWriterScrollBadSpeedTest(OneDWriterTest):
+    # Too fast to scroll, so only the rule is loaded
+    scroll = True
+    loaded = Rules1DConfig(110, InitStyle.SINGLE, 44)
+
+    def setUp(self):
+        super().setUp()
+        self.rules = Rules1D(self.rules.width, Rules1DConfig(110, InitStyle.SINGLE, 5))
+
+
 if __name__ == '__main__':
         unittest.main()
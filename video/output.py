@@ -16,12 +16,21 @@
 """Output of GPDI signals to the pmod.
 """
 from nmigen import *
-from nmigen.build import *
-from nmigen.back import verilog
-from nmigen_boards.icebreaker import ICEBreakerPlatform
+from nmigen.hdl.rec import Layout
 
 import argparse
 
+# Same shape as the gpdi resource. Used to stand in for the pmod in simulation.
+GPDILayout = Layout([
+    ('red', 4),
+    ('green', 4),
+    ('blue', 4),
+    ('hs', 1),
+    ('vs', 1),
+    ('act', 1),
+    ('clk', 1),
+])
+
 class GPDIOutput(Elaboratable):
     """Maps output signals onto 12-bit DVI pmod
     
@@ -54,6 +63,7 @@ class GPDIOutput(Elaboratable):
         return m
 
 def add_gpdi_resources(platform):
+    from nmigen.build import Resource, Subsignal, Pins
     pmod0 = ('pmod', 0)
     pmod1 = ('pmod', 1)
     platform.add_resources([
@@ -74,6 +84,8 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     if args.generate:
+        from nmigen.back import verilog
+        from nmigen_boards.icebreaker import ICEBreakerPlatform
         platform = ICEBreakerPlatform()
         add_gpdi_resources(platform)
 
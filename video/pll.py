@@ -33,19 +33,43 @@ class PLL(Elaboratable):
        and https://github.com/icebreaker-fpga/icebreaker-examples/blob/master/dvi-12bit/dvi-12bit.v 
 
        Calculate sync values use icepll from the Icestorm tools.
+
+       Optionally, a second clock domain is driven from the PLL's second
+       output, using SB_PLL40_2F_PAD. The second clock runs at the same
+       frequency as the first, or half of it.
     """
-    def __init__(self, pll_config, domain_name):
+    def __init__(self, pll_config, domain_name, *, second_domain_name=None, second_divide=1):
         """
         pll_config: specifies how PLL ought to be configured
         domain_name: name of the clock domain to be produced
+        second_domain_name: name of a second clock domain to be produced, if any
+        second_divide: 1 or 2, the second clock's divider
         """
+        assert second_divide in (1, 2)
         self.pll_config = pll_config
         self.domain = ClockDomain(domain_name)
+        self.second_domain = None
+        if second_domain_name:
+            self.second_domain = ClockDomain(second_domain_name)
+        self.second_divide = second_divide
 
     def elaborate(self, platform):
         m = Module()
         clock_in = platform.request('clk12', 0, dir='-').io
-        pll = Instance("SB_PLL40_PAD",
+        if self.second_domain:
+            outputs = dict(
+                p_PLLOUT_SELECT_PORTA='GENCLK',
+                p_PLLOUT_SELECT_PORTB='GENCLK_HALF' if self.second_divide == 2 else 'GENCLK',
+                p_ENABLE_ICEGATE_PORTA=0,
+                p_ENABLE_ICEGATE_PORTB=0,
+                o_PLLOUTGLOBALA=self.domain.clk,
+                o_PLLOUTGLOBALB=self.second_domain.clk)
+        else:
+            outputs = dict(
+                p_PLLOUT_SELECT='GENCLK',
+                p_ENABLE_ICEGATE=0,
+                o_PLLOUTGLOBAL=self.domain.clk)
+        pll = Instance("SB_PLL40_2F_PAD" if self.second_domain else "SB_PLL40_PAD",
             p_DIVR=self.pll_config.divr,
             p_DIVF=self.pll_config.divf,
             p_DIVQ=self.pll_config.divq,
@@ -55,14 +79,15 @@ class PLL(Elaboratable):
             p_FDA_FEEDBACK=0,
             p_FDA_RELATIVE=0,
             p_SHIFTREG_DIV_MODE=0,
-            p_PLLOUT_SELECT='GENCLK',
-            p_ENABLE_ICEGATE=0,
             i_PACKAGEPIN=clock_in, 
-            o_PLLOUTGLOBAL=self.domain.clk,
             i_RESETB=Const(1),
-            i_BYPASS=Const(0))
+            i_BYPASS=Const(0),
+            **outputs)
         m.submodules += [pll]
         platform.add_clock_constraint(self.domain.clk, self.pll_config.mhz * 1e6)
+        if self.second_domain:
+            platform.add_clock_constraint(self.second_domain.clk,
+                    self.pll_config.mhz * 1e6 / self.second_divide)
         return m 
 
 
@@ -234,14 +234,23 @@ class LineShifterTest(unittest.TestCase):
 
 class DoubleBufferReaderRGB(RGBElaboratable):
     """Reads monochrome pixels from a double buffer and turns them into rgb.
+
+    With a scale of 2 or 4, each bit in the double buffer is shown as a
+    square of scale x scale pixels. Each bit is repeated for scale pixels,
+    and each line is shown scale times before toggling the double buffer.
+    Lines in the double buffer are then 1/scale of the screen width, and
+    there are 1/scale as many of them.
     """
-    def __init__(self, vt, db):
+    def __init__(self, vt, db, *, scale=1):
         """
             vt: the VideoTimer for the display to drive
             db: the DoubleBuffer read interface to fetch pixels from
+            scale: size of each bit on screen, 1, 2 or 4
         """
+        assert scale in (1, 2, 4)
         super().__init__(vt)
         self.db = db
+        self.scale = scale
 
         # Interface to double buffer
         self.r_data = Signal(16)
@@ -249,12 +258,24 @@ class DoubleBufferReaderRGB(RGBElaboratable):
         self.res = vt.params
         self.line_shifter = LineShifter()
 
+        # High on cycles that the line shifter advances
+        self.step = Signal()
+
         # For debugging functionality (slow)
         self.debug = 0
 
+    def connect_step(self, m):
+        """Step the line shifter on the line start, then every scale cycles"""
+        if self.scale == 1:
+            m.d.comb += self.step.eq(1)
+            return
+        phase = Signal(range(self.scale))
+        m.d.sync += phase.eq(Mux(self.line_shifter.start, 1, phase + 1))
+        m.d.comb += self.step.eq(self.line_shifter.start | (phase == 0))
+
     def connect_line_shifter(self, m):
         """Connect line_shifter"""
-        m.submodules.lineshifter = self.line_shifter
+        m.submodules.lineshifter = EnableInserter(self.step)(self.line_shifter)
         m.d.comb += self.line_shifter.r_data.eq(self.db.data)
         m.d.comb += self.line_shifter.r_last.eq(self.db.last)
 
@@ -265,25 +286,45 @@ class DoubleBufferReaderRGB(RGBElaboratable):
             m.d.comb += self.line_shifter.start.eq(1)
 
         m.d.comb += self.color.eq(Mux(self.line_shifter.output, 0xfff, 0x000))
-        with m.If(self.line_shifter.r_next):
+        with m.If(self.line_shifter.r_next & self.step):
             m.d.comb += self.db.next.eq(1)
 
+    def last_repeat(self, m, first_line):
+        """Returns whether the line just shown is the last showing of its line
+        in the double buffer. Also whether that line is the first in the frame.
+        """
+        if self.scale == 1:
+            return C(1), first_line
+        # Counts showings of the current line. Line 0 of the screen is the
+        # first showing of the first line.
+        repeat = Signal(range(self.scale))
+        in_first = Signal()
+        with m.If(self.line_shifter.done & self.step):
+            m.d.sync += repeat.eq(Mux(first_line, 1, repeat + 1))
+            with m.If(first_line):
+                m.d.sync += in_first.eq(1)
+            with m.Elif(repeat == self.scale - 1):
+                m.d.sync += in_first.eq(0)
+        return (repeat == self.scale - 1) & ~first_line, in_first
+
     def elaborate(self, platform):
         m = Module()
+        self.connect_step(m)
         self.connect_line_shifter(m)
 
         # Tag is the current db read item after line is shifted out
         tag = self.db.data if self.debug else self.db.data[0]
         first_line = Signal()
         m.d.comb += first_line.eq(watch_lfsr(m, self.vt.y, 0))
+        last_repeat, first_in_frame = self.last_repeat(m, first_line)
 
         # Runs once per line, after line shifter done
         # DB should be pointing to first word (aka "tag")
-        with m.If(self.line_shifter.done):
+        with m.If(self.line_shifter.done & self.step):
             # Always toggle after showing first line. Also toggle if tag is zero.
             # By happy coincidence, at reset will also toggle for first line
             # because first item from DB reads as zero
-            with m.If((tag == 0) | first_line):
+            with m.If(last_repeat & ((tag == 0) | first_in_frame)):
                 m.d.comb += self.db.toggle.eq(1)
             with m.Else():
                 # If didn't toggle, loop back to start
@@ -294,24 +335,32 @@ class DoubleBufferReaderRGB(RGBElaboratable):
 
 class RgbReaderTest(SimulationTestCase):
     """Integration test."""
+    scale = 1
+
     def setUp(self):
         self.res = RESOLUTIONS['TESTBIG']
+        cells = self.res.cells(self.scale)
 
-        db = DoubleBuffer(self.res.words_per_line + 1,
+        db = DoubleBuffer(cells.words_per_line + 1,
                 read_domain='sync', write_domain='sync')
         self.db_write = db.write
         self.add(db, 'db')
         self.vt = VideoTimer(self.res)
         self.add(self.vt, 'vt')
-        self.reader = DoubleBufferReaderRGB(self.vt, db.read)
+        self.reader = DoubleBufferReaderRGB(self.vt, db.read, scale=self.scale)
         self.add(self.reader, 'reader')
 
         # list of frames
-        # each frame has 44 lines of 4 words
+        # each frame has 44 lines of 4 words, divided by scale
         def make_frame(c):
-            return [ [c*0x1000 + j*0x10 + i for i in range(4)] for j in range(44) ]
+            return [ [c*0x1000 + j*0x10 + i for i in range(cells.words_per_line)]
+                    for j in range(cells.vertical.active) ]
         self.frames = [make_frame(c+1) for c in range(3)]
-        self.bits = all_bits_list(flatten_list(flatten_list(self.frames)))
+        # Each bit is shown scale times, and each line is shown scale times
+        def show_line(line):
+            return [b for b in all_bits_list(line) for _ in range(self.scale)]
+        self.bits = [b for frame in self.frames for line in frame
+                for _ in range(self.scale) for b in show_line(line)]
         self.extra_processes.append(self.writer)
 
     def writer(self):
@@ -352,6 +401,14 @@ class RgbReaderTest(SimulationTestCase):
         self.run_sim(process, write_trace=False)
 
 
+class RgbReaderScale2Test(RgbReaderTest):
+    scale = 2
+
+
+class RgbReaderScale4Test(RgbReaderTest):
+    scale = 4
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -13,7 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Pseudo random number generator - multple LFSRs
+"""Pseudo random number generators
+
+RandomWordGenerator is made from multiple small LFSRs. XorshiftGenerator is a
+single 64 bit xorshift generator, giving up to 64 bits per cycle.
 """
 from nmigen import *
 from nmigen.back.pysim import Simulator, Settle
@@ -25,20 +28,25 @@ from collections import Counter
 from statistics import pstdev
 import unittest
 
-from lfsr import Lfsr
+from lfsr import Lfsr, LfsrConfig, linear_map
 
 class RandomWordGenerator(Elaboratable):
     """Generates random-ish words.
        New word every clock cycle
     """
     def __init__(self, n_bits, *, with_enable=False):
-        self.lfsrs = [Lfsr.num_steps(501+7*i, restart_value=i) for i in range(n_bits)]
+        self.lfsrs = [Lfsr(config) for config in self.lfsr_configs(n_bits)]
         self.restart = Signal() # Input
         self.with_enable = with_enable
         if with_enable:
             self.enable = Signal() # Input
         self.output = Signal(n_bits) # Output
 
+    @staticmethod
+    def lfsr_configs(n_bits):
+        """Returns the LfsrConfig for each bit of the output"""
+        return [LfsrConfig.num_steps(501+7*i, restart_value=i) for i in range(n_bits)]
+
     def elaborate(self, platform):
         m = Module()
         m.submodules += self.lfsrs
@@ -49,6 +57,47 @@ class RandomWordGenerator(Elaboratable):
                 m.d.comb += lfsr.enable.eq(self.enable)
         return m
 
+XORSHIFT_SEED = 0x9e37_79b9_7f4a_7c15
+
+def xorshift64(x):
+    """Returns the next state of a 64 bit xorshift generator (13, 7, 17)"""
+    mask = (1 << 64) - 1
+    x ^= (x << 13) & mask
+    x ^= x >> 7
+    x ^= (x << 17) & mask
+    return x
+
+
+class XorshiftGenerator(Elaboratable):
+    """Generates random words of up to 64 bits.
+       New word every clock cycle, with a period of 2**64 - 1.
+
+    Each step of the generator is linear, so is calculated as one flat XOR of
+    state bits per output bit, with no shifting over multiple cycles. Has the
+    same interface as RandomWordGenerator. The output is the low n_bits of
+    the state.
+    """
+    def __init__(self, n_bits, *, with_enable=False, seed=XORSHIFT_SEED):
+        assert 0 < n_bits <= 64
+        assert seed != 0
+        self.seed = seed
+        self.state = Signal(64, reset=seed)
+        self.restart = Signal() # Input
+        self.with_enable = with_enable
+        if with_enable:
+            self.enable = Signal() # Input
+        self.output = Signal(n_bits) # Output
+
+    def elaborate(self, platform):
+        m = Module()
+        m.d.comb += self.output.eq(self.state)
+        with m.If(self.restart):
+            m.d.sync += self.state.eq(self.seed)
+        with m.Elif(self.enable if self.with_enable else 1):
+            m.d.sync += self.state.eq(linear_map(xorshift64, self.state))
+        return m
+
+
 class RandomWordGeneratorTest(unittest.TestCase):
     def test_one_rule(self):
         n_bits = 4
@@ -72,5 +121,55 @@ class RandomWordGeneratorTest(unittest.TestCase):
         sim.run()
 
 
+class XorshiftGeneratorTest(unittest.TestCase):
+    def test_xorshift64(self):
+        # Known first outputs of xorshift64 from a seed of 1
+        self.assertEqual(0x40822041, xorshift64(1))
+        self.assertEqual(0x100041060c011441, xorshift64(0x40822041))
+
+    def run_gen(self, gen, process):
+        sim = Simulator(gen)
+        sim.add_clock(1)
+        sim.add_sync_process(process)
+        sim.run()
+
+    def test_sequence(self):
+        gen = XorshiftGenerator(32, with_enable=True)
+        def process():
+            # Each change of enable is seen one cycle later
+            state = gen.seed
+            last_enable = 0
+            for enable in [1, 1, 0, 1, 0, 0, 1, 1, 1]:
+                yield gen.enable.eq(enable)
+                yield
+                if last_enable:
+                    state = xorshift64(state)
+                self.assertEqual(state & 0xffff_ffff, (yield gen.output))
+                last_enable = enable
+            # Restart goes back to the seed
+            yield gen.restart.eq(1)
+            yield
+            yield
+            self.assertEqual(gen.seed & 0xffff_ffff, (yield gen.output))
+        self.run_gen(gen, process)
+
+    def test_counts(self):
+        gen = XorshiftGenerator(64)
+        n_words = 4000
+        def process():
+            counter = Counter()
+            for _ in range(n_words):
+                word = yield gen.output
+                counter.update((word >> s) & 0xf for s in range(0, 64, 4))
+                yield
+            # Each word has 16 nibbles, spread over 16 values, so each value
+            # is expected n_words times
+            counts = [c / n_words for c in counter.values()]
+            self.assertEqual(16, len(counts))
+            self.assertTrue(max(counts) < 1.1)
+            self.assertTrue(min(counts) > 0.9)
+        self.run_gen(gen, process)
+
+
 if __name__ == '__main__':
         unittest.main()
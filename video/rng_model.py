@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""NumPy models of the random number generators in rng.py.
+
+The models generate the same words as the hardware, cycle for cycle, in bulk.
+seed_frame() predicts the board that LifeWriter writes when it is seeded, so
+that reference runs can start from the same board as the FPGA.
+
+The statistical tests each return a score that is approximately normally
+distributed for a good generator, so values much above 3 in magnitude are
+suspicious. Run this file to test millions of words:
+
+    $ ./rng_model.py -g xorshift -b 32 -n 4000000
+"""
+import life_writer
+from rng import RandomWordGenerator, XorshiftGenerator, XORSHIFT_SEED, xorshift64
+
+from nmigen import *
+from nmigen.back.pysim import Simulator, Passive
+
+# pip install numpy
+import numpy as np
+
+import argparse
+import math
+import unittest
+
+
+def random_words(n, n_bits):
+    """Returns the first n outputs of a RandomWordGenerator(n_bits)."""
+    steps = np.arange(n)
+    words = np.zeros(n, dtype=np.uint64)
+    for i, config in enumerate(RandomWordGenerator.lfsr_configs(n_bits)):
+        # Each LFSR repeats after num_steps, so only one period is calculated
+        period = np.array([config.value_at(s) & 1 for s in range(config.num_steps)],
+                dtype=np.uint64)
+        words |= period[steps % config.num_steps] << np.uint64(i)
+    return words
+
+
+def _apply_columns(columns, x):
+    """Applies the linear map with the given columns to each value in x."""
+    result = np.zeros_like(x)
+    for i, column in enumerate(columns):
+        result ^= ((x >> np.uint64(i)) & np.uint64(1)) * np.uint64(column)
+    return result
+
+
+def xorshift_words(n, n_bits, *, seed=XORSHIFT_SEED, lanes=4096):
+    """Returns the first n outputs of a XorshiftGenerator(n_bits).
+
+    The first `lanes` states are stepped one by one. After that, each block of
+    `lanes` states is found from the block before by applying the xorshift
+    step `lanes` times, as a single linear map.
+    """
+    lanes = max(1, min(lanes, n))
+    block = [seed]
+    for _ in range(lanes - 1):
+        block.append(xorshift64(block[-1]))
+    columns = []
+    for i in range(64):
+        value = 1 << i
+        for _ in range(lanes):
+            value = xorshift64(value)
+        columns.append(value)
+    block = np.array(block, dtype=np.uint64)
+    blocks = []
+    for _ in range(0, n, lanes):
+        blocks.append(block)
+        block = _apply_columns(columns, block)
+    words = np.concatenate(blocks)[:n]
+    if n_bits < 64:
+        words &= np.uint64((1 << n_bits) - 1)
+    return words
+
+
+GENERATORS = {
+    'lfsrs': random_words,
+    'xorshift': xorshift_words,
+}
+
+
+def seed_frame(resolution, *, width=16, skip=0):
+    """Returns the board a LifeWriter writes when it is seeded by a
+    XorshiftGenerator(width), as it is connected in build.py.
+
+    Result is an array of 16 bit words, one row for each line. The writer takes
+    one random value per word of width cells, low half first. skip is the
+    number of random values the writer has already taken, for example by
+    earlier reseeds.
+    """
+    lines, wpl = resolution.vertical.active, resolution.words_per_line
+    halves = width // 16
+    values = xorshift_words(skip + lines * wpl // halves, width)[skip:]
+    words = np.stack([(values >> np.uint64(16 * h)) & np.uint64(0xffff)
+            for h in range(halves)], axis=1)
+    return words.reshape(lines, wpl).astype(np.uint16)
+
+
+def _bits(words, n_bits):
+    """Returns the bits of words, least significant first, as one array."""
+    shifts = np.arange(n_bits, dtype=np.uint64)
+    return ((words[:, None] >> shifts) & np.uint64(1)).astype(np.uint8).reshape(-1)
+
+
+def chi_square(words, n_bits, *, chunk_bits=8):
+    """Chi-square test of the counts of each chunk_bits wide field of each
+    word. Returns the statistic, normalized with the Wilson-Hilferty
+    approximation."""
+    values = np.concatenate([(words >> np.uint64(shift)) & np.uint64((1 << chunk_bits) - 1)
+            for shift in range(0, n_bits - chunk_bits + 1, chunk_bits)])
+    buckets = 1 << chunk_bits
+    counts = np.bincount(values.astype(np.int64), minlength=buckets)
+    expected = len(values) / buckets
+    statistic = ((counts - expected) ** 2 / expected).sum()
+    dof = buckets - 1
+    return (((statistic / dof) ** (1 / 3) - (1 - 2 / (9 * dof)))
+            / math.sqrt(2 / (9 * dof)))
+
+
+def serial_correlation(words, *, lag=1):
+    """Correlation of each word with the word lag later, scaled by sqrt(n)."""
+    x = words.astype(np.float64)
+    a, b = x[:-lag], x[lag:]
+    correlation = np.corrcoef(a, b)[0, 1]
+    return correlation * math.sqrt(len(a))
+
+
+def runs(words, n_bits):
+    """Wald-Wolfowitz runs test on the bit stream of the words, least
+    significant bit first."""
+    bits = _bits(words, n_bits)
+    n = len(bits)
+    ones = int(bits.sum())
+    zeros = n - ones
+    num_runs = 1 + int(np.count_nonzero(bits[1:] != bits[:-1]))
+    mean = 2 * ones * zeros / n + 1
+    variance = (mean - 1) * (mean - 2) / (n - 1)
+    return (num_runs - mean) / math.sqrt(variance)
+
+
+def battery(words, n_bits):
+    """Returns a dict of the score from each test."""
+    return {
+        'chi_square': chi_square(words, n_bits),
+        'serial_correlation': serial_correlation(words),
+        'runs': runs(words, n_bits),
+    }
+
+
+class ModelTest(unittest.TestCase):
+    def hardware_words(self, gen, n):
+        words = []
+        def process():
+            for _ in range(n):
+                words.append((yield gen.output))
+                yield
+        sim = Simulator(gen)
+        sim.add_clock(1)
+        sim.add_sync_process(process)
+        sim.run()
+        return words
+
+    def test_random_words(self):
+        # Long enough for every LFSR to wrap
+        n = 1500
+        self.assertEqual(self.hardware_words(RandomWordGenerator(16), n),
+                random_words(n, 16).tolist())
+
+    def test_xorshift_words(self):
+        n = 300
+        self.assertEqual(self.hardware_words(XorshiftGenerator(64), n),
+                xorshift_words(n, 64).tolist())
+
+    def test_xorshift_lanes(self):
+        # Stepping lanes gives the same sequence as stepping one at a time
+        n = 1000
+        self.assertEqual(xorshift_words(n, 32, lanes=1).tolist(),
+                xorshift_words(n, 32, lanes=64).tolist())
+
+
+class BatteryTest(unittest.TestCase):
+    def test_xorshift(self):
+        scores = battery(xorshift_words(200_000, 64), 64)
+        for name, score in scores.items():
+            self.assertLess(abs(score), 4, name)
+
+    def test_random_words(self):
+        # The short LFSRs do not have equal numbers of ones and zeros in
+        # their low bits, so some bits are set up to 53% of the time
+        words = random_words(200_000, 16)
+        self.assertGreater(chi_square(words, 16), 4)
+        self.assertLess(abs(runs(words, 16)), 4)
+
+    def test_bad_generators(self):
+        # A counter is too evenly spread, and each word follows the last
+        counter = np.arange(65536 * 4, dtype=np.uint64) & np.uint64(0xffff)
+        self.assertLess(chi_square(counter, 16), -4)
+        self.assertGreater(serial_correlation(counter), 4)
+        # Doubling every bit halves the number of runs
+        rng = np.random.default_rng(0)
+        bits = np.repeat(rng.integers(0, 2, 100_000 * 8, dtype=np.uint64), 2)
+        doubled = (bits.reshape(-1, 16) << np.arange(16, dtype=np.uint64)).sum(axis=1)
+        self.assertLess(runs(doubled, 16), -4)
+        # Words with few bits set fail the chi-square test
+        sparse = (rng.integers(0, 1 << 16, 100_000, dtype=np.uint64)
+                & rng.integers(0, 1 << 16, 100_000, dtype=np.uint64))
+        self.assertGreater(chi_square(sparse, 16), 4)
+
+
+class SeedFrameTest(life_writer.LifeWriterTest):
+    """Runs LifeWriter seeded by a XorshiftGenerator, expecting the first
+    frame to be the one predicted by seed_frame()."""
+    def setUp(self):
+        super().setUp()
+        self.m.submodules.rng = rng = XorshiftGenerator(self.width, with_enable=True)
+        self.m.d.comb += [
+                self.lw.rng_in.eq(rng.output),
+                rng.enable.eq(self.lw.rng_enable),
+        ]
+
+    def make_rng_data(self):
+        return seed_frame(self.res, width=self.width).tolist()
+
+    def rng_process(self):
+        # Random words come from the XorshiftGenerator
+        yield Passive()
+
+
+class SeedFrame32Test(SeedFrameTest):
+    width = 32
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-g', '--generator', action='append', choices=GENERATORS.keys(),
+            help='generator to test. May be repeated. Default is all generators')
+    parser.add_argument('-b', '--bits', type=int, default=16, help='bits per word')
+    parser.add_argument('-n', '--words', type=int, default=1_000_000,
+            help='number of words to test')
+    args = parser.parse_args()
+
+    for name in args.generator or GENERATORS.keys():
+        words = GENERATORS[name](args.words, args.bits)
+        scores = battery(words, args.bits)
+        print(f"{name:10} " + " ".join(f"{k} {v:+7.2f}" for k, v in scores.items()))
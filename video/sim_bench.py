@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures how fast our designs simulate.
+
+Each benchmark builds a representative design, then simulates a fixed number
+of pixel clock cycles. Setup time (elaboration and simulator construction) and
+run time are reported separately, along with simulated cycles per second.
+
+Results are appended to a JSON history file and compared with the most recent
+earlier result for the same design and resolution, so that changes in gateware
+structure or simulator show up as soon as the benchmark is run again.
+
+    $ ./sim_bench.py
+    $ ./sim_bench.py -b LifeWriter -r 640x480 --cycles 50000
+"""
+from double_buffer import DoubleBuffer
+from integration_test import WriterIntegrationFixture
+from rgb_reader import DoubleBufferReaderRGB
+from stall_bench import make_life_writer, make_oned_writer
+from timing import VideoTimer
+from video_config import RESOLUTIONS
+
+import nmigen
+from nmigen import *
+from nmigen.back.pysim import Simulator
+
+# pip install attrs
+from attr import attrs, attrib
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import unittest
+
+
+class ReaderFixture(Elaboratable):
+    """VideoTimer, DoubleBuffer and reader, with nothing writing."""
+    def __init__(self, resolution):
+        self.resolution = resolution
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.vt = vt = VideoTimer(self.resolution)
+        m.submodules.db = db = DoubleBuffer(self.resolution.words_per_line + 1,
+                write_domain='sync', read_domain='sync')
+        m.submodules.rgb = DoubleBufferReaderRGB(vt, db.read)
+        return m
+
+
+def writer_fixture(make_writer):
+    def make(res):
+        return WriterIntegrationFixture(res, lambda db_write: make_writer(res, db_write))
+    return make
+
+
+@attrs
+class Benchmark:
+    make_design = attrib() # function of resolution returning design
+    domains = attrib() # clock domains in the design, each given a 1Hz clock
+    needs_words = attrib() # whether the design needs whole words per line
+
+
+BENCHMARKS = {
+    'VideoTimer': Benchmark(VideoTimer, ['sync'], False),
+    'DoubleBufferReaderRGB': Benchmark(ReaderFixture, ['sync'], True),
+    'LifeWriter': Benchmark(writer_fixture(make_life_writer), ['sync', 'app'], True),
+    'OneDWriter': Benchmark(writer_fixture(make_oned_writer), ['sync', 'app'], True),
+}
+
+
+def run_benchmark(name, res_name, cycles):
+    """Simulates one design. Returns a dict of results."""
+    benchmark = BENCHMARKS[name]
+    res = RESOLUTIONS[res_name]
+    start = time.perf_counter()
+    sim = Simulator(benchmark.make_design(res))
+    for domain in benchmark.domains:
+        sim.add_clock(1, domain=domain)
+    setup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sim.run_until(cycles, run_passive=True)
+    run = time.perf_counter() - start
+    return {
+        'design': name,
+        'resolution': res_name,
+        'cycles': cycles,
+        'setup_s': round(setup, 3),
+        'run_s': round(run, 3),
+        'cycles_per_s': round(cycles / run, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_entry(results):
+    return {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'nmigen': getattr(nmigen, '__version__', None),
+        'results': results,
+    }
+
+
+def load_history(filename):
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as f:
+        return json.load(f)
+
+
+def append_history(filename, entry):
+    """Appends entry to the history file. Returns the earlier entries."""
+    history = load_history(filename)
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    with open(filename, 'w') as f:
+        json.dump(history + [entry], f, indent=1)
+    return history
+
+
+def compare(history, entry):
+    """Compares entry with the most recent earlier result for each benchmark.
+
+    Returns a dict of (design, resolution) to fractional change in cycles/s.
+    """
+    before = {}
+    for earlier in history:
+        for r in earlier['results']:
+            before[(r['design'], r['resolution'])] = r['cycles_per_s']
+    changes = {}
+    for r in entry['results']:
+        key = (r['design'], r['resolution'])
+        if key in before:
+            changes[key] = r['cycles_per_s'] / before[key] - 1
+    return changes
+
+
+class HistoryTest(unittest.TestCase):
+    def result(self, design, cycles_per_s):
+        return {'design': design, 'resolution': 'TEST', 'cycles_per_s': cycles_per_s}
+
+    def test_append_and_compare(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'history.json')
+            first = make_entry([self.result('a', 100.0)])
+            self.assertEqual(append_history(filename, first), [])
+            second = make_entry([self.result('b', 5.0)])
+            append_history(filename, second)
+            third = make_entry([self.result('a', 80.0), self.result('b', 10.0)])
+            history = append_history(filename, third)
+            self.assertEqual(history, [first, second])
+            self.assertEqual(len(load_history(filename)), 3)
+            changes = compare(history, third)
+            self.assertAlmostEqual(changes[('a', 'TEST')], -0.2)
+            self.assertAlmostEqual(changes[('b', 'TEST')], 1.0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--benchmark', action='append', choices=BENCHMARKS.keys(),
+            help='benchmark to run. May be repeated. Default is all benchmarks')
+    parser.add_argument('-r', '--resolution', action='append', choices=RESOLUTIONS.keys(),
+            help='resolution to run. May be repeated. Default is TEST, TESTBIG and 640x480')
+    parser.add_argument('--cycles', type=int, default=20000,
+            help='number of pixel clock cycles to simulate')
+    parser.add_argument('--history', default=os.path.join('build', 'sim_bench_history.json'),
+            help='JSON file to append results to')
+    parser.add_argument('--no-history', dest='history', action='store_const', const=None,
+            help='do not record results')
+    parser.add_argument('--threshold', type=float, default=0.1,
+            help='fractional slow down to flag as a regression')
+    args = parser.parse_args()
+
+    results = []
+    for res_name in args.resolution or ['TEST', 'TESTBIG', '640x480']:
+        for name in args.benchmark or BENCHMARKS.keys():
+            if BENCHMARKS[name].needs_words and RESOLUTIONS[res_name].words_per_line == 0:
+                print(f"{name:22} {res_name:10} skipped: less than one word per line")
+                continue
+            r = run_benchmark(name, res_name, args.cycles)
+            results.append(r)
+            print(f"{name:22} {res_name:10} setup {r['setup_s']:7.2f}s "
+                    f"run {r['run_s']:7.2f}s {r['cycles_per_s']:10.1f} cycles/s")
+
+    if args.history:
+        entry = make_entry(results)
+        history = append_history(args.history, entry)
+        if history:
+            print(f"Compared with most recent earlier results in {args.history}:")
+            for (name, res_name), change in compare(history, entry).items():
+                flag = '  REGRESSION' if change < -args.threshold else ''
+                print(f"{name:22} {res_name:10} {change:+7.1%}{flag}")
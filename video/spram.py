@@ -17,7 +17,6 @@
 """
 
 from nmigen import *
-from nmigen.back import verilog
 from nmigen.back.pysim import Simulator
 
 import argparse
@@ -146,73 +145,152 @@ class FakeSinglePortRamTest(unittest.TestCase):
 
 
 class RamBank(Elaboratable):
-    """A single RAM Bank, constructed from four smaller RAMs"""
-    def __init__(self, fake=False):
+    """A single RAM Bank, constructed from four smaller RAMs
+
+    With width=32, the RAMs are used in pairs, each pair holding the low and
+    high halves of 32 bit words. The bank then holds half as many words.
+
+    Consecutive addresses are interleaved between the RAMs (or pairs of RAMs),
+    so that a stream of reads and a stream of writes can usually proceed in
+    the same cycle. The bank has a write port and a read port. When both ports
+    use the same RAM in the same cycle, the write wins and read_ok is low; the
+    reader should try again next cycle.
+    """
+    def __init__(self, fake=False, *, width=16):
+        assert width in (16, 32)
+        self.width = width
+        # Write port
         self.addr = Signal(16)
-        self.data_in = Signal(16)
+        self.data_in = Signal(width)
         self.wren = Signal()
-        self.data_out = Signal(16)
+        # Read port
+        self.read_addr = Signal(16)
+        self.read_en = Signal() # Input: read from read_addr this cycle
+        self.read_ok = Signal() # Output: read accepted, data_out valid next cycle
+        self.data_out = Signal(width)
         ram_class = FakeSinglePortRam if fake else SinglePortRam 
         self.rams = [ram_class() for _ in range(4)]
 
     def elaborate(self, platform):
         m = Module()
         r = self.rams
-        for i in range(4):
-            m.submodules[f"bank{i}"] = r[i]
-            m.d.comb += [
-                    r[i].addr.eq(self.addr[0:14]),
-                    r[i].data_in.eq(self.data_in),
-                    r[i].wren.eq(self.wren & (self.addr[14:16] == i)),
-                    r[i].cs.eq(1),
-            ]
+        per_word = self.width // 16
+        groups = [r[i:i + per_word] for i in range(0, 4, per_word)]
+        select_bits = 3 - per_word
+        write_select = self.addr[0:select_bits]
+        read_select = self.read_addr[0:select_bits]
+        conflict = self.wren & (write_select == read_select)
+        m.d.comb += self.read_ok.eq(self.read_en & ~conflict)
+        # Data is returned a cycle after the address, so select on the
+        # registered address
+        last_select = Signal.like(read_select)
+        m.d.sync += last_select.eq(read_select)
+        for i, group in enumerate(groups):
+            writing = self.wren & (write_select == i)
+            reading = self.read_en & (read_select == i)
+            for j, ram in enumerate(group):
+                m.submodules[f"bank{i * per_word + j}"] = ram
+                m.d.comb += [
+                        ram.addr.eq(Mux(writing, self.addr, self.read_addr)[select_bits:]),
+                        ram.data_in.eq(self.data_in[j * 16:(j + 1) * 16]),
+                        ram.wren.eq(writing),
+                        ram.cs.eq(writing | reading),
+                ]
         m.d.comb += self.data_out.eq(
-                Array(self.rams)[self.addr[14:16]].data_out)
+                Array(Cat(*(ram.data_out for ram in group)) for group in groups)[last_select])
         return m
 
 
 class FakeRamBankTest(unittest.TestCase):
+    width = 16
+    values = [0x1111, 0x2222, 0xffff]
+
     def setUp(self):
         m = Module()
-        m.submodules.ram = self.ram = RamBank(True)
+        m.submodules.ram = self.ram = RamBank(True, width=self.width)
         self.sim = Simulator(m)
         self.sim.add_clock(1) # 1Hz for simplicity of counting
 
     def run_sim(self, p):
         self.sim.add_sync_process(p)
-        #self.sim.run()
-        with self.sim.write_vcd("zz.vcd", "zz.gtkw"):
-            self.sim.run()
+        self.sim.run()
+        #with self.sim.write_vcd("zz.vcd", "zz.gtkw"):
+        #    self.sim.run()
+
+    def read(self, addr):
+        r = self.ram
+        yield r.read_addr.eq(addr)
+        yield r.read_en.eq(1)
+        yield
+        yield r.read_en.eq(0)
+        yield
+
+    def write(self, addr, val):
+        r = self.ram
+        yield r.addr.eq(addr)
+        yield r.data_in.eq(val)
+        yield r.wren.eq(1)
+        yield
+        yield r.wren.eq(0)
+        yield
 
     def test(self):
         r = self.ram
-        def read(addr):
-            yield r.addr.eq(addr)
+        def process():
+            a, b, c = self.values
+            yield from self.write(0x0010, a)
+            yield from self.read(0x0010)
+            self.assertEqual(a, (yield r.data_out))
+            yield from self.write(0x0011, b)
+            yield from self.read(0x0011)
+            self.assertEqual(b, (yield r.data_out))
+            yield from self.write(0x1013, c)
+            yield from self.read(0x1013)
+            self.assertEqual(c, (yield r.data_out))
+            yield from self.read(0x0010)
+            self.assertEqual(a, (yield r.data_out))
+        self.run_sim(process)
+
+    def test_read_while_writing(self):
+        r = self.ram
+        def process():
+            a, b, _ = self.values
+            yield from self.write(0x0020, a)
+            # Different RAMs: both proceed
+            yield r.addr.eq(0x0021)
+            yield r.data_in.eq(b)
+            yield r.wren.eq(1)
+            yield r.read_addr.eq(0x0020)
+            yield r.read_en.eq(1)
+            yield
+            self.assertTrue((yield r.read_ok))
             yield r.wren.eq(0)
-            yield 
+            yield r.read_en.eq(0)
             yield
-
-        def write(addr, val):
-            yield r.addr.eq(addr)
-            yield r.data_in.eq(val)
+            self.assertEqual(a, (yield r.data_out))
+            # Same RAM: the write wins
+            yield from self.write(0x0030, a)
+            yield r.addr.eq(0x0020)
+            yield r.data_in.eq(b)
             yield r.wren.eq(1)
+            yield r.read_addr.eq(0x0030)
+            yield r.read_en.eq(1)
+            yield
+            self.assertFalse((yield r.read_ok))
+            yield r.wren.eq(0)
             yield
+            self.assertTrue((yield r.read_ok))
+            yield r.read_en.eq(0)
             yield
+            self.assertEqual(a, (yield r.data_out))
+            yield from self.read(0x0020)
+            self.assertEqual(b, (yield r.data_out))
+        self.run_sim(process)
 
-        def process():
-            yield from write(0x0010, 0x1111)
-            yield from read(0x0010)
-            self.assertEqual(0x1111, (yield r.data_out))
-            yield from write(0x4010, 0x2222)
-            yield from read(0x4010)
-            self.assertEqual(0x2222, (yield r.data_out))
-            yield from write(0xc010, 0xffff)
-            yield from read(0xc010)
-            self.assertEqual(0xffff, (yield r.data_out))
-            yield from read(0x0010)
-            self.assertEqual(0x1111, (yield r.data_out))
 
-        self.run_sim(process)
+class FakeRamBank32Test(FakeRamBankTest):
+    width = 32
+    values = [0x1111_2222, 0xffff_3333, 0x4444_5555]
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -220,6 +298,7 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     if args.generate:
+        from nmigen.back import verilog
         from nmigen_boards.icebreaker import ICEBreakerPlatform
         print(verilog.convert(SinglePortRam(), platform=ICEBreakerPlatform()))
     else:
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Detects when a Life board has stopped changing
+"""
+from nmigen import *
+
+from elab import SimulationTestCase
+
+import random
+import unittest
+
+CRC_POLY = 0x04c11db7
+
+
+def crc_update(crc, data, *, poly=CRC_POLY, n_bits=16):
+    """Returns crc after shifting in data, most significant bit first.
+
+    Works on both nMigen values and ints, so that tests can use the same
+    function to calculate expected values. For ints, data is n_bits wide.
+    """
+    if isinstance(crc, Value):
+        return _crc_update_value(crc, data, poly)
+    mask = (1 << 32) - 1
+    for i in reversed(range(n_bits)):
+        feedback = ((crc >> 31) ^ (data >> i)) & 1
+        crc = ((crc << 1) & mask) ^ (poly if feedback else 0)
+    return crc
+
+
+def _crc_update_value(crc, data, poly):
+    # Tracks which bits of crc and data are XORed into each bit of the
+    # result, so that each bit is one flat XOR rather than a deeply nested
+    # expression.
+    width = len(crc)
+    bits = [(1 << i, 0) for i in range(width)]
+    for i in reversed(range(len(data))):
+        top_crc, top_data = bits[width - 1]
+        bits = [(0, 0)] + bits[:width - 1]
+        bits = [(c ^ top_crc, d ^ top_data ^ (1 << i)) if (poly >> n) & 1 else (c, d)
+                for n, (c, d) in enumerate(bits)]
+    def xor(crc_mask, data_mask):
+        terms = ([crc[i] for i in range(width) if (crc_mask >> i) & 1] +
+                [data[i] for i in range(len(data)) if (data_mask >> i) & 1])
+        return Cat(*terms).xor() if terms else C(0, 1)
+    return Cat(*(xor(c, d) for c, d in bits))
+
+
+class StagnationDetector(Elaboratable):
+    """Watches the words of each frame as they are written, and flags
+    frames that look like the board has stopped changing.
+
+    For each frame, a population count and a CRC of all words are
+    calculated. At the end of the frame, stagnant is set for the following
+    frame if:
+        - the CRC matches one of the previous `history` frames, so the board
+          is still or oscillating with a short period, or
+        - the population has not changed for `flat_frames` frames.
+    """
+    def __init__(self, *, history=4, flat_frames=256):
+        self.history = history
+        self.flat_frames = flat_frames
+        self.data = Signal(16) # Input: word written
+        self.en = Signal() # Input: data is valid
+        self.end_frame = Signal() # Input: toggle after the last word of a frame
+        self.stagnant = Signal() # Output: high for the frame after detection
+
+        self.population = Signal(24) # Live cells in this frame
+        self.crc = Signal(32, reset=0xffff_ffff) # CRC of this frame
+
+    def elaborate(self, platform):
+        m = Module()
+        with m.If(self.en):
+            m.d.sync += [
+                self.population.eq(self.population + sum(self.data)),
+                self.crc.eq(crc_update(self.crc, self.data)),
+            ]
+
+        # CRCs of earlier frames, most recent first, and whether they are set
+        crcs = [Signal(32, name=f"crc_{i}") for i in range(self.history)]
+        crcs_valid = [Signal(name=f"crc_valid_{i}") for i in range(self.history)]
+        last_population = Signal.like(self.population)
+        flat_count = Signal(range(self.flat_frames))
+
+        repeated = Cat(*(v & (c == self.crc) for c, v in zip(crcs, crcs_valid))).any()
+        flat = self.population == last_population
+        detected = repeated | (flat & (flat_count == self.flat_frames - 1))
+        with m.If(self.end_frame):
+            m.d.sync += [
+                Cat(*crcs).eq(Cat(self.crc, *crcs[:-1])),
+                Cat(*crcs_valid).eq(Cat(1, *crcs_valid[:-1])),
+                last_population.eq(self.population),
+                flat_count.eq(Mux(flat, flat_count + 1, 0)),
+                self.stagnant.eq(detected),
+                self.population.eq(0),
+                self.crc.eq(self.crc.reset),
+            ]
+            with m.If(detected):
+                # Start again, as the next frame is reseeded
+                m.d.sync += flat_count.eq(0)
+                m.d.sync += Cat(*crcs_valid).eq(0)
+        return m
+
+
+class CrcUpdateTest(unittest.TestCase):
+    def test_check_value(self):
+        # CRC-32/MPEG-2 check value
+        crc = 0xffff_ffff
+        for byte in b'123456789':
+            crc = crc_update(crc, byte, n_bits=8)
+        self.assertEqual(0x0376e6e7, crc)
+
+    def test_words(self):
+        # A word is the same as its two bytes, high byte first
+        self.assertEqual(crc_update(0xffff_ffff, 0x3132),
+                crc_update(crc_update(0xffff_ffff, 0x31, n_bits=8), 0x32, n_bits=8))
+
+
+class StagnationDetectorTest(SimulationTestCase):
+    def setUp(self):
+        self.sd = StagnationDetector(history=2, flat_frames=4)
+        self.add(self.sd, 'sd')
+
+    def send_frame(self, words):
+        sd = self.sd
+        yield sd.en.eq(1)
+        for word in words:
+            yield sd.data.eq(word)
+            yield
+        yield sd.en.eq(0)
+        yield from self.toggle(sd.end_frame)
+
+    def run_frames(self, frames):
+        """Returns stagnant after each frame."""
+        results = []
+        def process():
+            for words in frames:
+                yield from self.send_frame(words)
+                results.append((yield self.sd.stagnant))
+        self.run_sim(process)
+        return results
+
+    def test_population_and_crc(self):
+        words = [0x0001, 0x8000, 0xffff, 0x1234]
+        def process():
+            sd = self.sd
+            yield sd.en.eq(1)
+            for word in words:
+                yield sd.data.eq(word)
+                yield
+            yield sd.en.eq(0)
+            yield
+            self.assertEqual(1 + 1 + 16 + 5, (yield sd.population))
+            crc = 0xffff_ffff
+            for word in words:
+                crc = crc_update(crc, word)
+            self.assertEqual(crc, (yield sd.crc))
+        self.run_sim(process)
+
+    def test_changing(self):
+        random.seed(0)
+        frames = [[random.randrange(65536) for _ in range(8)] for _ in range(10)]
+        self.assertEqual([0] * 10, self.run_frames(frames))
+
+    def test_still(self):
+        a, b = [1, 2, 3], [4, 5, 6]
+        self.assertEqual([0, 0, 1, 0, 0, 1],
+                self.run_frames([b, a, a, b, a, a]))
+
+    def test_period_two(self):
+        a, b, c = [1, 2, 3], [4, 5, 7], [0x100, 0, 0]
+        self.assertEqual([0, 0, 1, 0, 0, 0, 1],
+                self.run_frames([a, b, a, c, a, b, a]))
+
+    def test_flat_population(self):
+        # Same population, different CRC every frame
+        frames = [[1 << i] for i in range(10)]
+        self.assertEqual([0, 0, 0, 0, 1, 0, 0, 0, 1, 0], self.run_frames(frames))
+
+
+if __name__ == '__main__':
+    unittest.main()
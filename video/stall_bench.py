@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Finds how fast the app clock must run for each writer to keep up.
+
+Writers only work while the app domain keeps ahead of the pixel reader. This
+benchmark simulates a writer, double buffer and reader with a range of
+app/sync clock ratios, optionally freezing the writer on random cycles, and
+watches for the reader toggling to a line that the writer has not finished.
+
+The ratio is the app clock frequency divided by the pixel clock frequency.
+For example, at 1280x720 the pixel clock is 73.5MHz so a 12MHz app clock is a
+ratio of 0.163. Each result says whether the app clock chosen with -c, as
+build.py would provide it at that resolution, is fast enough. HF oscillator
+clocks are taken to be 10% slow.
+
+    $ ./stall_bench.py -w LifeWriter -r TESTBIG --stall 0.1
+    $ ./stall_bench.py -w LifeWriter32 -r 1280x720 -c hf12 --frames 1
+"""
+from build import APP_CLOCKS
+from double_buffer import DoubleBuffer, DoubleBufferWriteLayout
+from elab import SimulationTestCase
+from hfosc import HfOscillator
+from life_writer import build_life_writer
+from oned_rules import Rules1DConfig, InitStyle
+from oned_writer import OneDWriter
+from rgb_reader import DoubleBufferReaderRGB
+from rng import XorshiftGenerator
+from rng_writer import RandomWriter
+from square_writer import SquareWriter
+from timing import VideoTimer
+from video_config import RESOLUTIONS
+
+from nmigen import *
+from nmigen.back.pysim import Simulator, Passive
+
+import argparse
+import functools
+import random
+import unittest
+
+
+class StallInjector(Elaboratable):
+    """Sits between a writer and the DoubleBuffer write interface.
+
+    While stall is high, writes are dropped and the writer is expected to be
+    frozen (see freeze_writer). A ready pulse that arrives during a stall is
+    held until the stall ends, so the writer does not miss it.
+    """
+    def __init__(self, db_write):
+        self.db_write = db_write
+        self.stall = Signal() # Input: stall this cycle
+        self.write = Record(DoubleBufferWriteLayout) # Interface for the writer
+
+    def freeze_writer(self, writer):
+        """Returns writer, modified to hold its state while stalled."""
+        return EnableInserter(~self.stall)(writer)
+
+    def elaborate(self, platform):
+        m = Module()
+        pending_ready = Signal()
+        with m.If(self.stall & self.db_write.ready):
+            m.d.sync += pending_ready.eq(1)
+        with m.Elif(~self.stall):
+            m.d.sync += pending_ready.eq(0)
+        m.d.comb += [
+            self.write.ready.eq((self.db_write.ready | pending_ready) & ~self.stall),
+            self.db_write.en.eq(self.write.en & ~self.stall),
+            self.db_write.data.eq(self.write.data),
+        ]
+        return m
+
+
+class StallInjectorTest(SimulationTestCase):
+    def setUp(self):
+        self.db_write = Record(DoubleBufferWriteLayout)
+        self.injector = StallInjector(self.db_write)
+        self.add(self.injector)
+
+    def test_pass_through(self):
+        w = self.injector.write
+        def process():
+            yield self.db_write.ready.eq(1)
+            yield w.en.eq(1)
+            yield w.data.eq(0x1234)
+            yield
+            self.assertTrue((yield w.ready))
+            self.assertTrue((yield self.db_write.en))
+            self.assertEqual(0x1234, (yield self.db_write.data))
+        self.run_sim(process)
+
+    def test_stall(self):
+        w = self.injector.write
+        def process():
+            # Ready during stall is held back, writes are dropped
+            yield self.injector.stall.eq(1)
+            yield self.db_write.ready.eq(1)
+            yield w.en.eq(1)
+            yield
+            self.assertFalse((yield w.ready))
+            self.assertFalse((yield self.db_write.en))
+            yield self.db_write.ready.eq(0)
+            yield
+            yield
+            self.assertFalse((yield w.ready))
+            # Ready delivered once stall ends, for one cycle only
+            yield self.injector.stall.eq(0)
+            yield
+            self.assertTrue((yield w.ready))
+            self.assertTrue((yield self.db_write.en))
+            yield
+            self.assertFalse((yield w.ready))
+        self.run_sim(process)
+
+
+def make_square_writer(res, db_write):
+    return SquareWriter(res, db_write, size=0)
+
+def make_oned_writer(res, db_write, scroll=False):
+    return OneDWriter(res, db_write, Rules1DConfig(30, InitStyle.SINGLE, 1),
+            scroll=scroll, fake_ram=True)
+
+def make_random_writer(res, db_write):
+    return RandomWriter(res, db_write)
+
+def make_life_writer(res, db_write, generations=1, width=16):
+    m = Module()
+    writer = build_life_writer(m, res, db_write, generations=generations, width=width,
+            fake_ram=True)
+    m.submodules.rng = rng = XorshiftGenerator(width, with_enable=True)
+    m.d.comb += [
+            writer.rng_in.eq(rng.output),
+            rng.enable.eq(writer.rng_enable),
+    ]
+    return m
+
+WRITERS = {
+    'SquareWriter': make_square_writer,
+    'OneDWriter': make_oned_writer,
+    'OneDWriterScroll': functools.partial(make_oned_writer, scroll=True),
+    'RandomWriter': make_random_writer,
+    'LifeWriter': make_life_writer,
+    'LifeWriter2': functools.partial(make_life_writer, generations=2),
+    'LifeWriter32': functools.partial(make_life_writer, width=32),
+}
+
+
+class StallFixture(Elaboratable):
+    """A writer in the app domain, feeding a reader in the sync domain through
+    a StallInjector and DoubleBuffer."""
+    def __init__(self, resolution, make_writer):
+        self.resolution = resolution
+        self.vt = VideoTimer(resolution)
+        self.db = DoubleBuffer(resolution.words_per_line + 1,
+                write_domain='app', read_domain='sync')
+        self.injector = StallInjector(self.db.write)
+        self.writer = make_writer(resolution, self.injector.write)
+
+    def elaborate(self, platform):
+        m = Module()
+        m.domains += ClockDomain('sync')
+        m.domains += ClockDomain('app')
+        m.submodules.vt = self.vt
+        m.submodules.db = self.db
+        m.submodules.rgb = DoubleBufferReaderRGB(self.vt, self.db.read)
+        m.submodules.injector = DomainRenamer({'sync': 'app'})(self.injector)
+        m.submodules.writer = DomainRenamer({'sync': 'app'})(
+                self.injector.freeze_writer(self.writer))
+        return m
+
+
+class Trial:
+    """Simulates one writer at one clock ratio and stall rate.
+
+    After one frame of warm up, every time the reader toggles the double
+    buffer, checks that the writer wrote a full line into it.
+    """
+    def __init__(self, resolution, make_writer, ratio, *, stall=0.0,
+            frames=2, seed=0):
+        self.resolution = resolution
+        self.ratio = ratio
+        self.stall = stall
+        self.frames = frames
+        self.random = random.Random(seed)
+        self.fixture = StallFixture(resolution, make_writer)
+        self.num_words = resolution.words_per_line + 1
+        self.words_written = 0
+        self.cycle = 0
+        self.first_underrun = None
+
+    def stall_process(self):
+        yield Passive()
+        stall = self.fixture.injector.stall
+        while True:
+            yield stall.eq(self.random.random() < self.stall)
+            yield
+
+    def write_process(self):
+        # Count words written since the buffer was last handed to the writer
+        yield Passive()
+        db_write = self.fixture.db.write
+        while True:
+            if (yield db_write.ready):
+                self.words_written = 0
+            if (yield db_write.en):
+                self.words_written += 1
+            yield
+
+    def read_process(self):
+        # Count cycles and frames, checking each line as the reader toggles
+        vt = self.fixture.vt
+        toggle = self.fixture.db.read.toggle
+        frame = -1 # first frame is warm up
+        while frame < self.frames:
+            if (yield vt.at_frame_m1):
+                frame += 1
+            if frame >= 0 and (yield toggle):
+                if self.words_written != self.num_words:
+                    self.first_underrun = self.cycle
+                    return
+            self.cycle += 1
+            yield
+
+    def run(self):
+        """Returns cycle of first underrun, or None if there was none."""
+        sim = Simulator(self.fixture)
+        sim.add_clock(1, domain='sync')
+        sim.add_clock(1 / self.ratio, domain='app')
+        sim.add_sync_process(self.stall_process, domain='app')
+        sim.add_sync_process(self.write_process, domain='app')
+        sim.add_sync_process(self.read_process, domain='sync')
+        sim.run()
+        return self.first_underrun
+
+
+def find_min_ratio(resolution, make_writer, *, low, high, steps, **kwargs):
+    """Bisects for the lowest app/sync clock ratio with no underrun.
+
+    Returns (ratio, underrun) where ratio is the lowest passing ratio found, or
+    None if high fails, and underrun is (ratio, cycle) for the highest failing
+    ratio found, or None if low passes.
+    """
+    def underrun_at(ratio):
+        return Trial(resolution, make_writer, ratio, **kwargs).run()
+
+    cycle = underrun_at(high)
+    if cycle is not None:
+        return None, (high, cycle)
+    cycle = underrun_at(low)
+    if cycle is None:
+        return low, None
+    underrun = (low, cycle)
+    for _ in range(steps):
+        mid = (low + high) / 2
+        cycle = underrun_at(mid)
+        if cycle is None:
+            high = mid
+        else:
+            low = mid
+            underrun = (mid, cycle)
+    return high, underrun
+
+
+def app_clock_ratio(resolution, app_clock):
+    """Returns the lowest ratio of app clock to pixel clock that app_clock
+    gives at resolution."""
+    mhz, divide = APP_CLOCKS[app_clock]
+    if mhz is None:
+        return 1 / divide
+    return mhz * (1 - HfOscillator.TOLERANCE) / resolution.pll_config.mhz
+
+
+class AppClockRatioTest(unittest.TestCase):
+    def test_ratio(self):
+        res = RESOLUTIONS['1280x720']
+        self.assertAlmostEqual(12 * 0.9 / 73.5, app_clock_ratio(res, 'hf12'))
+        self.assertEqual(0.5, app_clock_ratio(res, 'pixel_half'))
+
+
+def report(writer, res_name, app_clock, ratio, underrun):
+    pixel_mhz = RESOLUTIONS[res_name].pll_config.mhz
+    if ratio is None:
+        needs = "> high ratio"
+    else:
+        needs = f"{ratio:.3f} ({ratio * pixel_mhz:.1f}MHz)"
+    if underrun is None:
+        failed = "none"
+    else:
+        failed = f"ratio {underrun[0]:.3f} at cycle {underrun[1]}"
+    available = app_clock_ratio(RESOLUTIONS[res_name], app_clock)
+    ok = "yes" if ratio is not None and ratio <= available else "no"
+    print(f"{writer:12} {res_name:10} min ratio {needs:22} "
+            f"first underrun {failed:30} {app_clock}: {ok}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--writer', action='append', choices=WRITERS.keys(),
+            help='writer to test. May be repeated. Default is all writers')
+    parser.add_argument('-r', '--resolution', action='append', choices=RESOLUTIONS.keys(),
+            help='resolution to test. May be repeated. Default is TEST16 and TESTBIG. '
+            'Full size resolutions take a long time to simulate')
+    parser.add_argument('-c', '--app-clock', default='hf24', choices=APP_CLOCKS.keys(),
+            help='app clock to check results against, as for build.py')
+    parser.add_argument('--stall', type=float, default=0.0,
+            help='probability that the writer is stalled on any app cycle')
+    parser.add_argument('--frames', type=int, default=2,
+            help='frames to check, after one frame of warm up')
+    parser.add_argument('--low', type=float, default=0.02, help='lowest ratio to try')
+    parser.add_argument('--high', type=float, default=1.0, help='highest ratio to try')
+    parser.add_argument('--steps', type=int, default=6, help='number of bisection steps')
+    parser.add_argument('--seed', type=int, default=0, help='seed for random stalls')
+    args = parser.parse_args()
+
+    for res_name in args.resolution or ['TEST16', 'TESTBIG']:
+        for writer in args.writer or WRITERS.keys():
+            ratio, underrun = find_min_ratio(RESOLUTIONS[res_name], WRITERS[writer],
+                    low=args.low, high=args.high, steps=args.steps,
+                    stall=args.stall, frames=args.frames, seed=args.seed)
+            report(writer, res_name, args.app_clock, ratio, underrun)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reports how much of the UP5K a design uses.
+
+Each design is synthesized and placed, without programming, and the LUT,
+carry and flip flop counts are read from the yosys and nextpnr logs. Designs
+are either a Life evaluator on its own, or any of the build.py modes. Counts
+are shown relative to the first design given.
+
+    $ ./utilization.py -d CalcLifeWord -d CalcLifeWordColumns
+    $ ./utilization.py -d CalcLifeWordColumns -w 32 -s 2
+    $ ./utilization.py -d DBLife -r 1280x720
+"""
+from life_rules import CalcLifeWord, CalcLifeWordColumns
+from video_config import RESOLUTIONS
+
+from nmigen import *
+
+import argparse
+import os
+import re
+import unittest
+
+
+class CalcHarness(Elaboratable):
+    """Surrounds a Life evaluator with registers, so that it is not optimized
+    away. Input rows and the rule are shifted in from the button, and the
+    output is reduced to an LED.
+    """
+    def __init__(self, calc):
+        self.calc = calc
+
+    def elaborate(self, platform):
+        m = Module()
+        m.submodules.calc = calc = self.calc
+        button = platform.request('button')
+        led = platform.request('led_r')
+        calc_inputs = [*calc.input, calc.rule]
+        inputs = Signal(sum(len(i) for i in calc_inputs))
+        m.d.sync += inputs.eq(Cat(button, inputs))
+        offset = 0
+        for i in calc_inputs:
+            m.d.comb += i.eq(inputs[offset:offset + len(i)])
+            offset += len(i)
+        output = Signal.like(calc.output)
+        m.d.sync += [
+                output.eq(calc.output),
+                led.eq(output.xor()),
+        ]
+        return m
+
+
+CALCS = {c.__name__: c for c in [CalcLifeWord, CalcLifeWordColumns]}
+
+# Cell types reported from the yosys log
+CELLS = ['SB_LUT4', 'SB_CARRY', 'SB_DFF*']
+
+
+def yosys_cells(log):
+    """Returns dict of cell counts from the last statistics in a yosys log.
+
+    Counts of cells matching a name ending in * are added together.
+    """
+    stats = log[log.rfind('Number of cells:'):]
+    counts = {}
+    for name in CELLS:
+        pattern = re.escape(name).replace(r'\*', r'\w*')
+        counts[name] = sum(int(n) for n in
+                re.findall(rf'^\s+{pattern}\s+(\d+)$', stats, re.MULTILINE))
+    return counts
+
+
+def nextpnr_cells(log):
+    """Returns (used, available) logic cells from a nextpnr log."""
+    m = re.search(r'ICESTORM_LC:\s+(\d+)/\s*(\d+)', log)
+    return (int(m.group(1)), int(m.group(2))) if m else None
+
+
+def make_design(name, args):
+    if name in CALCS:
+        return CalcHarness(CALCS[name](args.width, args.stages))
+    from build import MODES
+    return MODES[name](RESOLUTIONS[args.resolution])
+
+
+def measure(name, design, seed):
+    """Builds design, returning a dict of cell counts."""
+    from nmigen_boards.icebreaker import ICEBreakerPlatform
+    from output import add_gpdi_resources
+    platform = ICEBreakerPlatform()
+    add_gpdi_resources(platform)
+    platform.add_resources(platform.break_off_pmod)
+    build_dir = os.path.join('build', 'utilization', name)
+    platform.build(design, build_dir=build_dir, do_program=False,
+            nextpnr_opts=["--seed", str(seed)])
+    with open(os.path.join(build_dir, 'top.rpt')) as f:
+        counts = yosys_cells(f.read())
+    with open(os.path.join(build_dir, 'top.tim')) as f:
+        counts['ICESTORM_LC'] = nextpnr_cells(f.read())[0]
+    return counts
+
+
+def report(name, counts, base=None):
+    line = f"{name:22}"
+    for key, value in counts.items():
+        line += f" {value:6}"
+        if base is not None:
+            line += f" ({value - base[key]:+5})"
+    print(line)
+
+
+class ParseLogTest(unittest.TestCase):
+    def test_yosys_cells(self):
+        log = """
+   Number of cells:                 10
+     SB_LUT4                         1
+
+   Number of cells:                120
+     SB_CARRY                       12
+     SB_DFF                          5
+     SB_DFFE                         3
+     SB_LUT4                       100
+"""
+        self.assertEqual(yosys_cells(log),
+                {'SB_LUT4': 100, 'SB_CARRY': 12, 'SB_DFF*': 8})
+
+    def test_nextpnr_cells(self):
+        log = "Info: Device utilisation:\nInfo: \t         ICESTORM_LC:   310/  5280     5%\n"
+        self.assertEqual(nextpnr_cells(log), (310, 5280))
+        self.assertIsNone(nextpnr_cells(""))
+
+
+if __name__ == '__main__':
+    from build import MODES
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--design', action='append',
+            choices=[*CALCS.keys(), *MODES.keys()],
+            help='design to measure. May be repeated. '
+            'Default is CalcLifeWord and CalcLifeWordColumns')
+    parser.add_argument('-w', '--width', type=int, default=16,
+            help='cells calculated per cycle, for Life evaluators')
+    parser.add_argument('-s', '--stages', type=int, default=0,
+            help='register stages, for Life evaluators')
+    parser.add_argument('-r', '--resolution', default='640x480',
+            choices=RESOLUTIONS.keys(), help='resolution, for build.py modes')
+    parser.add_argument('--seed', default=1, type=int, help='seed to pass to nextpnr')
+    args = parser.parse_args()
+
+    base = None
+    print(f"{'design':22}" + "".join(f" {c:>14}" for c in CELLS + ['ICESTORM_LC']))
+    for name in args.design or ['CalcLifeWord', 'CalcLifeWordColumns']:
+        counts = measure(name, make_design(name, args), args.seed)
+        report(name, counts, base)
+        base = base or counts
@@ -89,8 +89,33 @@ class SyncConfigTest(unittest.TestCase):
         self.assertEqual(l.num_bits, 6) 
 
 
+class ActiveArea(object):
+    """Word counts for anything with horizontal and vertical active sizes"""
+    @property
+    def words_per_line(self):
+        return self.horizontal.active // 16
+
+    @property
+    def total_words(self):
+        return self.words_per_line * self.vertical.active
+
+
+@attrs
+class CellAxis(object):
+    """Number of cells along one side of a CellGrid"""
+    active = attrib()
+
+
 @attrs
-class ResolutionParams(object):
+class CellGrid(ActiveArea):
+    """The cells that a writer writes. Unlike ResolutionParams, there is no
+    timing, as cells may be larger than pixels."""
+    horizontal = attrib()
+    vertical = attrib()
+
+
+@attrs
+class ResolutionParams(ActiveArea):
     pll_config = attrib()
     sync_positive = attrib()
     horizontal = attrib()
@@ -106,13 +131,15 @@ class ResolutionParams(object):
         t = (yp * ht + xp + n) % (ht * vt)
         return t % ht, t // ht
 
-    @property
-    def words_per_line(self):
-        return self.horizontal.active // 16
-
-    @property
-    def total_words(self):
-        return self.words_per_line * self.vertical.active
+    def cells(self, scale):
+        """Returns the CellGrid of scale x scale pixel cells in the active
+        area, which is what a writer should write for a DoubleBufferReaderRGB
+        with the same scale.
+        """
+        assert self.horizontal.active % (16 * scale) == 0
+        assert self.vertical.active % scale == 0
+        return CellGrid(CellAxis(self.horizontal.active // scale),
+                CellAxis(self.vertical.active // scale))
 
 
 class ResolutionParamsTest(unittest.TestCase):
@@ -128,6 +155,17 @@ class ResolutionParamsTest(unittest.TestCase):
                 SyncConfig(10, 10, 10, 10), SyncConfig(5, 5, 5, 5))
         self.assertEqual(r.frame_clocks, 40 * 20)
 
+    def test_cells(self):
+        r = RESOLUTIONS['1920x1080'].cells(2)
+        self.assertEqual(r.horizontal.active, 960)
+        self.assertEqual(r.vertical.active, 540)
+        self.assertEqual(r.words_per_line, 60)
+        self.assertEqual(r.total_words, 32400)
+        # Cells have no timing, which would not be scaled
+        self.assertFalse(hasattr(r, 'frame_clocks'))
+        self.assertFalse(hasattr(r.horizontal, 'total'))
+        self.assertEqual(RESOLUTIONS['640x480'].cells(1), CellGrid(CellAxis(640), CellAxis(480)))
+
     def check_add_clocks(self, r, xy, n, expected):
         x, y = xy
         self.assertEqual(r.add_clocks(x, y, n), expected)